@@ -10,7 +10,6 @@ from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models.query import QuerySet
 from django.http import HttpResponse, Http404
 from django.utils.encoding import force_unicode
 from taggit.managers import TaggableManager
@@ -19,7 +18,7 @@ from philo.contrib.julian.feedgenerator import ICalendarFeed
 from philo.contrib.winer.models import FeedView
 from philo.contrib.winer.feeds import registry
 from philo.exceptions import ViewCanNotProvideSubpath
-from philo.models import Tag, Entity, Page
+from philo.models import Tag, Entity, EntityManager, EntityQuerySet, Page
 from philo.models.fields import TemplateField
 from philo.utils import ContentTypeRegistryLimiter
 
@@ -93,11 +92,11 @@ class TimedModel(models.Model):
 		abstract = True
 
 
-class EventManager(models.Manager):
+class EventManager(EntityManager):
 	def get_query_set(self):
 		return EventQuerySet(self.model)
 
-class EventQuerySet(QuerySet):
+class EventQuerySet(EntityQuerySet):
 	def upcoming(self):
 		return self.filter(start_date__gte=datetime.date.today())
 	def current(self):
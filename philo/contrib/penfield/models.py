@@ -85,7 +85,7 @@ class BlogEntry(Entity):
 		get_latest_by = "date"
 
 
-register_value_model(BlogEntry)
+register_value_model(BlogEntry, select_related=('blog', 'author'))
 
 
 class BlogView(FeedView):
@@ -398,7 +398,7 @@ class NewsletterArticle(Entity):
 		unique_together = (('newsletter', 'slug'),)
 
 
-register_value_model(NewsletterArticle)
+register_value_model(NewsletterArticle, select_related=('newsletter',))
 
 
 class NewsletterIssue(Entity):
@@ -422,7 +422,7 @@ class NewsletterIssue(Entity):
 		unique_together = (('newsletter', 'numbering'),)
 
 
-register_value_model(NewsletterIssue)
+register_value_model(NewsletterIssue, select_related=('newsletter',))
 
 
 class NewsletterView(FeedView):
@@ -10,8 +10,9 @@ from django.core.validators import RegexValidator, MinValueValidator
 from django.db import models
 from django.forms.models import model_to_dict
 
-from philo.models.base import TreeEntity, TreeEntityManager, Entity
+from philo.models.base import TreeEntity, TreeEntityManager, Entity, EntityManager
 from philo.models.nodes import Node, TargetURLModel
+from philo.utils.dependencies import record_model
 
 
 DEFAULT_NAVIGATION_DEPTH = 3
@@ -27,6 +28,9 @@ class NavigationMapper(object, DictMixin):
 		self._cache = {}
 	
 	def __getitem__(self, key):
+		# Which navigation applies depends on every navigation and item.
+		record_model(Navigation)
+		record_model(NavigationItem)
 		if key not in self._cache:
 			try:
 				self._cache[key] = Navigation.objects.get_for_node(self.node, key)
@@ -44,7 +48,7 @@ def navigation(self):
 Node.navigation = property(navigation)
 
 
-class NavigationManager(models.Manager):
+class NavigationManager(EntityManager):
 	use_for_related = True
 	
 	def get_for_node(self, node, key):
@@ -4,7 +4,7 @@ from django.contrib.sites.models import Site, RequestSite
 from django.contrib.syndication.views import add_domain
 from django.db import models
 from django.http import HttpResponse
-from django.template import RequestContext, Template as DjangoTemplate
+from django.template import RequestContext
 from django.utils import feedgenerator, tzinfo
 from django.utils.encoding import smart_unicode, force_unicode
 from django.utils.html import escape
@@ -12,7 +12,7 @@ from django.utils.html import escape
 from philo.contrib.winer.exceptions import HttpNotAcceptable
 from philo.contrib.winer.feeds import registry, DEFAULT_FEED
 from philo.contrib.winer.middleware import http_not_acceptable
-from philo.models import Page, Template, MultiView
+from philo.models import Page, Template, MultiView, uses_request_instance
 
 try:
 	import mimeparse
@@ -68,17 +68,17 @@ class FeedView(MultiView):
 		:returns: Patterns suitable for use in urlpatterns.
 		
 		Example::
-		
+			
 			class BlogView(FeedView):
 			    blog = models.ForeignKey(Blog)
 			    entry_archive_page = models.ForeignKey(Page)
-			    
+			
 			    @property
 			    def urlpatterns(self):
 			        urlpatterns = self.feed_patterns(r'^', 'get_all_entries', 'index_page', 'index')
 			        urlpatterns += self.feed_patterns(r'^(?P<year>\d{4})/(?P<month>\d{2})/(?P<day>\d{2})', 'get_entries_by_ymd', 'entry_archive_page', 'entries_by_day')
 			        return urlpatterns
-			    
+			
 			    def get_entries_by_ymd(request, year, month, day, extra_context=None):
 			        entries = Blog.entries.all()
 			        # filter entries based on the year, month, and day.
@@ -112,19 +112,19 @@ class FeedView(MultiView):
 		:returns: A view function that renders a list of items as a feed.
 		
 		"""
-		get_items = get_items_attr if callable(get_items_attr) else getattr(self, get_items_attr)
-		
 		def inner(request, extra_context=None, *args, **kwargs):
-			obj = self.get_object(request, *args, **kwargs)
-			feed = self.get_feed(obj, request, reverse_name, feed_type, *args, **kwargs)
+			instance = self.get_request_instance(request)
+			get_items = instance._get_items_callable(get_items_attr)
+			obj = instance.get_object(request, *args, **kwargs)
+			feed = instance.get_feed(obj, request, reverse_name, feed_type, *args, **kwargs)
 			items, xxx = get_items(obj, request, extra_context=extra_context, *args, **kwargs)
-			self.populate_feed(feed, items, request)
+			instance.populate_feed(feed, items, request)
 			
 			response = HttpResponse(mimetype=feed.mime_type)
 			feed.write(response, 'utf-8')
 			return response
 		
-		return inner
+		return uses_request_instance(inner)
 	
 	def page_view(self, get_items_attr, page_attr):
 		"""
@@ -134,20 +134,30 @@ class FeedView(MultiView):
 		:returns: A view function that renders a list of items as an :class:`HttpResponse`.
 		
 		"""
-		get_items = get_items_attr if callable(get_items_attr) else getattr(self, get_items_attr)
-		
 		def inner(request, extra_context=None, *args, **kwargs):
-			obj = self.get_object(request, *args, **kwargs)
+			instance = self.get_request_instance(request)
+			get_items = instance._get_items_callable(get_items_attr)
+			obj = instance.get_object(request, *args, **kwargs)
 			items, extra_context = get_items(obj, request, extra_context=extra_context, *args, **kwargs)
-			items, item_context = self.process_page_items(request, items)
+			items, item_context = instance.process_page_items(request, items)
 			
-			context = self.get_context()
+			context = instance.get_context()
 			context.update(extra_context or {})
 			context.update(item_context or {})
 			
-			page = page_attr if isinstance(page_attr, Page) else getattr(self, page_attr)
+			page = page_attr if isinstance(page_attr, Page) else getattr(instance, page_attr)
 			return page.render_to_response(request, extra_context=context)
-		return inner
+		return uses_request_instance(inner)
+	
+	def _get_items_callable(self, get_items_attr):
+		# Methods of another instance with the same primary key are rebound to
+		# this one; see :meth:`.MultiView.get_request_instance`.
+		if not callable(get_items_attr):
+			return getattr(self, get_items_attr)
+		im_self = getattr(get_items_attr, 'im_self', None)
+		if im_self is not self and type(im_self) is type(self) and im_self.pk == self.pk:
+			return get_items_attr.im_func.__get__(self, type(self))
+		return get_items_attr
 	
 	def process_page_items(self, request, items):
 		"""
@@ -241,11 +251,11 @@ class FeedView(MultiView):
 	def populate_feed(self, feed, items, request):
 		"""Populates a :class:`django.utils.feedgenerator.DefaultFeed` instance as is returned by :meth:`get_feed` with the passed-in ``items``."""
 		if self.item_title_template:
-			title_template = DjangoTemplate(self.item_title_template.code)
+			title_template = self.item_title_template.get_django_template()
 		else:
 			title_template = None
 		if self.item_description_template:
-			description_template = DjangoTemplate(self.item_description_template.code)
+			description_template = self.item_description_template.get_django_template()
 		else:
 			description_template = None
 		
@@ -1,4 +1,5 @@
 from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404
 
 
 #: Raised if ``request.node`` is required but not present. For example, this can be raised by :func:`philo.views.node_view`. :data:`MIDDLEWARE_NOT_CONFIGURED` is an instance of :exc:`django.core.exceptions.ImproperlyConfigured`.
@@ -15,6 +16,11 @@ class ViewCanNotProvideSubpath(Exception):
 	silent_variable_failure = True
 
 
+class UnresolvablePath(Http404):
+	"""Raised by :func:`philo.views.node_view` when the requested path does not correspond to a :class:`.Node` on the current site, or to a subpath which that :class:`.Node` handles. :exc:`UnresolvablePath` is a subclass of :exc:`django.http.Http404`."""
+	pass
+
+
 class AncestorDoesNotExist(Exception):
 	"""Raised by :meth:`.TreeEntity.get_path` if the root instance is not an ancestor of the current instance."""
 	pass
\ No newline at end of file
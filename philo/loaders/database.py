@@ -1,8 +1,15 @@
+from django.conf import settings
 from django.template import TemplateDoesNotExist
 from django.template.loader import BaseLoader
 from django.utils.encoding import smart_unicode
 
 from philo.models import Template
+from philo.models.pages import TEMPLATES_GENERATION
+from philo.utils.cache import LRUCache, get_generation
+from philo.utils.templates import TEMPLATE_REFERENCE_RE
+
+
+TEMPLATE_LOADER_CACHE_SIZE = getattr(settings, 'PHILO_TEMPLATE_LOADER_CACHE_SIZE', 200)
 
 
 class Loader(BaseLoader):
@@ -17,4 +24,83 @@ class Loader(BaseLoader):
 			template = Template.objects.get_with_path(template_name)
 		except Template.DoesNotExist:
 			raise TemplateDoesNotExist(template_name)
-		return (template.code, smart_unicode(template))
\ No newline at end of file
+		return (template.code, smart_unicode(template))
+
+
+class CachedLoader(Loader):
+	"""
+	:class:`philo.loaders.database.CachedLoader` behaves like :class:`Loader`, but keeps the compiled templates - and the names which don't match any :class:`.Template` - in a per-process LRU cache of :setting:`PHILO_TEMPLATE_LOADER_CACHE_SIZE` entries (default: 200). The cache is discarded in every process whenever any :class:`.Template` is saved, deleted, or moved.
+	
+	When a template's source has to be fetched, the sources of the templates it extends or includes by constant name are fetched along with it, one query per level of the chain rather than one per template.
+	
+	"""
+	def __init__(self):
+		self.templates = LRUCache(TEMPLATE_LOADER_CACHE_SIZE)
+		self.sources = LRUCache(TEMPLATE_LOADER_CACHE_SIZE)
+	
+	def load_template_sources(self, template_names, generation=None):
+		"""
+		Fetches the sources of the :class:`.Template`\ s at ``template_names``, along with those of the templates they extend or include, and keeps them for :meth:`load_template_source`.
+		
+		:returns: A dictionary mapping each of ``template_names`` to a (source, display_name) tuple, or to ``None`` if there is no :class:`.Template` with that name.
+		
+		"""
+		if generation is None:
+			generation = get_generation(TEMPLATES_GENERATION)
+		
+		results = {}
+		names = set(template_names)
+		seen = set()
+		while names:
+			seen.update(names)
+			# Template names are the paths of the templates; normalize them the way
+			# get_with_path would.
+			paths = dict([(name, '/'.join([segment for segment in name.split('/') if segment])) for name in names])
+			found = Template.objects.get_by_full_paths(paths.values())
+			
+			referenced = set()
+			for name, path in paths.items():
+				try:
+					template = found[path]
+				except KeyError:
+					source = None
+				else:
+					source = (template.code, smart_unicode(template))
+					referenced.update([match[1] for match in TEMPLATE_REFERENCE_RE.findall(template.code)])
+				self.sources.set(name, (generation, source))
+				if name in template_names:
+					results[name] = source
+			names = referenced - seen
+		return results
+	
+	def load_template_source(self, template_name, template_dirs=None):
+		generation = get_generation(TEMPLATES_GENERATION)
+		cached = self.sources.get(template_name)
+		if cached is None or cached[0] != generation:
+			source = self.load_template_sources([template_name], generation)[template_name]
+		else:
+			source = cached[1]
+		
+		if source is None:
+			raise TemplateDoesNotExist(template_name)
+		return source
+	
+	def load_template(self, template_name, template_dirs=None):
+		generation = get_generation(TEMPLATES_GENERATION)
+		cached = self.templates.get(template_name)
+		if cached is not None and cached[0] == generation:
+			return cached[1], None
+		
+		template, origin = super(CachedLoader, self).load_template(template_name, template_dirs)
+		if not hasattr(template, 'render'):
+			# The template was found, but something it refers to wasn't. Let django
+			# report that, and don't cache anything.
+			return template, origin
+		
+		self.templates.set(template_name, (generation, template))
+		return template, None
+	
+	def reset(self):
+		"""Discards every cached template and source."""
+		self.templates.clear()
+		self.sources.clear()
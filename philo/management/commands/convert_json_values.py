@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+from philo.models.base import JSONValue
+
+
+class Command(NoArgsCommand):
+	help = "Converts each JSONValue which holds a boolean, an integer, a decimal, a datetime or a short string to the matching typed, indexed attribute value model."
+	
+	def handle_noargs(self, **options):
+		verbosity = int(options.get('verbosity', 1))
+		converted = JSONValue.objects.convert()
+		if verbosity > 0:
+			self.stdout.write("Converted %d value%s\n" % (converted, converted != 1 and 's' or ''))
@@ -0,0 +1,19 @@
+from django.core.management.base import NoArgsCommand
+from django.utils import simplejson as json
+
+from philo.models import Template
+
+
+class Command(NoArgsCommand):
+	help = "Recalculates the stored container specs for every Template."
+	
+	def handle_noargs(self, **options):
+		verbosity = int(options.get('verbosity', 1))
+		updated = 0
+		for template in Template.objects.all():
+			container_specs = template.calculate_container_specs()
+			if container_specs != template.container_specs:
+				Template.objects.filter(pk=template.pk).update(container_specs=json.dumps(container_specs))
+				updated += 1
+		if verbosity > 0:
+			self.stdout.write("Template: updated %d container spec%s\n" % (updated, updated != 1 and 's' or ''))
@@ -0,0 +1,17 @@
+from django.core.management.base import NoArgsCommand
+from django.db.models import get_models
+
+from philo.models.base import TreeEntity, EffectiveAttribute
+
+
+class Command(NoArgsCommand):
+	help = "Recalculates the materialized effective attributes for every installed TreeEntity subclass, such as Node and Template."
+	
+	def handle_noargs(self, **options):
+		verbosity = int(options.get('verbosity', 1))
+		for model in get_models():
+			if not issubclass(model, TreeEntity):
+				continue
+			stored = EffectiveAttribute.objects.rebuild(model)
+			if verbosity > 0:
+				self.stdout.write("%s: stored %d effective attribute%s\n" % (model._meta.object_name, stored, stored != 1 and 's' or ''))
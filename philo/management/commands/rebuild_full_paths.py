@@ -0,0 +1,17 @@
+from django.core.management.base import NoArgsCommand
+from django.db.models import get_models
+
+from philo.models.base import SlugTreeEntity
+
+
+class Command(NoArgsCommand):
+	help = "Recalculates the materialized full_path column for every installed SlugTreeEntity subclass, such as Node and Template."
+	
+	def handle_noargs(self, **options):
+		verbosity = int(options.get('verbosity', 1))
+		for model in get_models():
+			if not issubclass(model, SlugTreeEntity):
+				continue
+			updated = model._default_manager.rebuild_full_paths()
+			if verbosity > 0:
+				self.stdout.write("%s: updated %d path%s\n" % (model._meta.object_name, updated, updated != 1 and 's' or ''))
@@ -1,13 +1,32 @@
+from hashlib import sha1
+
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.http import Http404
+from django.utils.encoding import smart_str
 
+from philo.exceptions import UnresolvablePath
 from philo.models import Node, View
+from philo.models.nodes import UNRESOLVABLE_PATHS_GENERATION
+from philo.utils.cache import LRUCache, get_generation
 from philo.utils.lazycompat import SimpleLazyObject
+from philo.views import node_view
+
+
+CACHE_NODE_PATHS = getattr(settings, 'PHILO_CACHE_NODE_PATHS', False)
+UNRESOLVABLE_PATH_CACHE_TIMEOUT = getattr(settings, 'PHILO_UNRESOLVABLE_PATH_CACHE_TIMEOUT', 0)
+UNRESOLVABLE_PATH_CACHE_SIZE = getattr(settings, 'PHILO_UNRESOLVABLE_PATH_CACHE_SIZE', 1000)
+SHARE_UNRESOLVABLE_PATH_CACHE = getattr(settings, 'PHILO_SHARE_UNRESOLVABLE_PATH_CACHE', False)
 
 
 def get_node(path):
-	"""Returns a :class:`Node` instance at ``path`` (relative to the current site) or ``None``."""
+	"""
+	Returns a :class:`Node` instance at ``path`` (relative to the current site) or ``None``.
+	
+	If :setting:`PHILO_CACHE_NODE_PATHS` is ``True``, the :class:`Node` will be found using a per-process :class:`~philo.utils.trees.PathTrie` (see :meth:`.TreeEntityManager.get_path_trie`) rather than with :meth:`.TreeEntityManager.get_with_path`. This removes all queries from path resolution at the cost of keeping every :class:`Node` on the site in memory. Default: ``False``.
+	
+	"""
 	try:
 		current_site = Site.objects.get_current()
 	except Site.DoesNotExist:
@@ -17,8 +36,13 @@ def get_node(path):
 	if path[-1] == '/':
 		trailing_slash = True
 	
+	root = getattr(current_site, 'root_node', None)
+	
 	try:
-		node, subpath = Node.objects.get_with_path(path, root=getattr(current_site, 'root_node', None), absolute_result=False)
+		if CACHE_NODE_PATHS:
+			node, subpath = Node.objects.get_path_trie(root=root).lookup(path)
+		else:
+			node, subpath = Node.objects.get_with_path(path, root=root, absolute_result=False)
 	except Node.DoesNotExist:
 		return None
 	
@@ -35,12 +59,64 @@ def get_node(path):
 	return node
 
 
+class UnresolvablePathCache(object):
+	"""
+	Remembers, per site, the request paths for which :func:`philo.views.node_view` recently raised :exc:`~philo.exceptions.UnresolvablePath`, so that repeated requests for them can be answered without touching the database. Entries are kept in a bounded per-process LRU and, if ``shared`` is ``True``, in django's cache as well. Every entry is discarded when the :data:`~philo.models.nodes.UNRESOLVABLE_PATHS_GENERATION` generation is bumped, which happens whenever a :class:`.Node`, a :class:`Site`, or an "Http404" :class:`.Attribute` is saved or deleted.
+	
+	:param max_size: The maximum number of paths to remember in each process.
+	:param timeout: The number of seconds to remember each path for.
+	:param shared: Whether paths should also be remembered in django's cache.
+	
+	"""
+	def __init__(self, max_size, timeout, shared=False):
+		self.timeout = timeout
+		self.shared = shared
+		self._paths = LRUCache(max_size, timeout)
+		self._generation = None
+	
+	def _get_generation(self):
+		generation = get_generation(UNRESOLVABLE_PATHS_GENERATION)
+		if generation != self._generation:
+			self._paths.clear()
+			self._generation = generation
+		return generation
+	
+	def _get_shared_key(self, key, generation):
+		# Paths can contain characters which aren't allowed in cache keys.
+		return 'philo_unresolvable_path__%s__%s__%s' % (generation, key[0], sha1(smart_str(key[1])).hexdigest())
+	
+	def __contains__(self, path):
+		generation = self._get_generation()
+		key = (settings.SITE_ID, path)
+		if self._paths.get(key, False):
+			return True
+		if self.shared and cache.get(self._get_shared_key(key, generation), False):
+			self._paths.set(key, True)
+			return True
+		return False
+	
+	def add(self, path):
+		"""Remembers ``path`` as unresolvable on the current site."""
+		generation = self._get_generation()
+		key = (settings.SITE_ID, path)
+		self._paths.set(key, True)
+		if self.shared:
+			cache.set(self._get_shared_key(key, generation), True, self.timeout)
+
+
+unresolvable_paths = UnresolvablePathCache(UNRESOLVABLE_PATH_CACHE_SIZE, UNRESOLVABLE_PATH_CACHE_TIMEOUT, SHARE_UNRESOLVABLE_PATH_CACHE)
+
+
 class RequestNodeMiddleware(object):
 	"""
 	Adds a ``node`` attribute, representing the currently-viewed :class:`.Node`, to every incoming :class:`HttpRequest` object. This is required by :func:`philo.views.node_view`.
 	
 	:class:`RequestNodeMiddleware` also catches all exceptions raised while handling requests that have attached :class:`.Node`\ s if :setting:`settings.DEBUG` is ``True``. If a :exc:`django.http.Http404` error was caught, :class:`RequestNodeMiddleware` will look for an "Http404" :class:`.Attribute` on the request's :class:`.Node`; otherwise it will look for an "Http500" :class:`.Attribute`. If an appropriate :class:`.Attribute` is found, and the value of the attribute is a :class:`.View` instance, then the :class:`.View` will be rendered with the exception in the ``extra_context``, bypassing any later handling of exceptions.
 	
+	If :setting:`PHILO_UNRESOLVABLE_PATH_CACHE_TIMEOUT` is a positive number of seconds, paths which :func:`~philo.views.node_view` could not resolve (and for which no "Http404" :class:`.View` was rendered) will be remembered for that long, and later requests for them will raise :exc:`~philo.exceptions.UnresolvablePath` before any :class:`.Node` lookup is done. At most :setting:`PHILO_UNRESOLVABLE_PATH_CACHE_SIZE` paths are remembered per process (default: 1000); if :setting:`PHILO_SHARE_UNRESOLVABLE_PATH_CACHE` is ``True``, they are also shared between processes through django's cache. Default: ``0`` (disabled).
+	
+	.. note:: Remembered paths are forgotten whenever a :class:`.Node`, :class:`Site`, or "Http404" :class:`.Attribute` changes. Other changes which could make a path resolvable - such as reconfiguring a :class:`.MultiView` - only take effect once the timeout has passed.
+	
 	"""
 	def process_view(self, request, view_func, view_args, view_kwargs):
 		try:
@@ -48,10 +124,17 @@ class RequestNodeMiddleware(object):
 		except KeyError:
 			request.node = None
 		else:
+			if UNRESOLVABLE_PATH_CACHE_TIMEOUT and view_func is node_view and request.path in unresolvable_paths:
+				raise UnresolvablePath
 			request.node = SimpleLazyObject(lambda: get_node(path))
 	
+	def remember_unresolvable_path(self, request, exception):
+		if UNRESOLVABLE_PATH_CACHE_TIMEOUT and isinstance(exception, UnresolvablePath):
+			unresolvable_paths.add(request.path)
+	
 	def process_exception(self, request, exception):
 		if settings.DEBUG or not hasattr(request, 'node') or not request.node:
+			self.remember_unresolvable_path(request, exception)
 			return
 		
 		if isinstance(exception, Http404):
@@ -63,6 +146,7 @@ class RequestNodeMiddleware(object):
 		
 		if error_view is None or not isinstance(error_view, View):
 			# Should this be duck-typing? Perhaps even no testing?
+			self.remember_unresolvable_path(request, exception)
 			return
 		
 		extra_context = {'exception': exception}
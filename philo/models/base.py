@@ -1,36 +1,69 @@
+import datetime
+from decimal import Decimal
+
 from django import forms
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils import simplejson as json
 from django.utils.encoding import force_unicode
 from mptt.models import MPTTModel, MPTTModelBase, MPTTOptions
+try:
+	from mptt.signals import node_moved
+except ImportError:
+	# Older versions of mptt don't send a signal when nodes are moved.
+	node_moved = None
 
 from philo.exceptions import AncestorDoesNotExist
 from philo.models.fields import JSONField
 from philo.signals import entity_class_prepared
-from philo.utils import ContentTypeRegistryLimiter, ContentTypeSubclassLimiter
-from philo.utils.entities import AttributeMapper, TreeAttributeMapper
+from philo.utils import ContentTypeRegistryLimiter, ContentTypeSubclassLimiter, bulk_create
+from philo.utils.entities import AttributeMapper, TreeAttributeMapper, CACHE_TREE_ATTRIBUTES, MATERIALIZE_TREE_ATTRIBUTES, invalidate_tree_attributes, invalidate_tree_attributes_for_attribute, invalidate_tree_attributes_for_value
+from philo.utils.trees import PathTrie, get_path_trie, invalidate_path_tries
 from philo.validators import json_validator
 
 
-__all__ = ('value_content_type_limiter', 'register_value_model', 'unregister_value_model', 'JSONValue', 'ForeignKeyValue', 'ManyToManyValue', 'Attribute', 'Entity', 'TreeEntity', 'SlugTreeEntity')
+__all__ = ('value_content_type_limiter', 'register_value_model', 'unregister_value_model', 'get_values_in_bulk', 'JSONValue', 'BooleanValue', 'IntegerValue', 'DecimalValue', 'DateTimeValue', 'StringValue', 'SCALAR_VALUE_MODELS', 'ForeignKeyValue', 'ManyToManyValue', 'Attribute', 'EffectiveAttribute', 'EntityQuerySet', 'EntityManager', 'Entity', 'TreeEntity', 'SlugTreeEntity')
 
 
 #: An instance of :class:`.ContentTypeRegistryLimiter` which is used to track the content types which can be related to by :class:`ForeignKeyValue`\ s and :class:`ManyToManyValue`\ s.
 value_content_type_limiter = ContentTypeRegistryLimiter()
 
 
-def register_value_model(model):
-	"""Registers a model as a valid content type for a :class:`ForeignKeyValue` or :class:`ManyToManyValue` through the :data:`value_content_type_limiter`."""
+_value_bulk_hooks = {}
+
+
+def register_value_model(model, select_related=None, prefetch=None):
+	"""
+	Registers a model as a valid content type for a :class:`ForeignKeyValue` or :class:`ManyToManyValue` through the :data:`value_content_type_limiter`.
+	
+	:param select_related: An optional sequence of lookups which should be passed to :meth:`select_related` whenever instances of the model are fetched with :func:`get_values_in_bulk`.
+	:param prefetch: An optional callable which will be passed a list of instances of the model fetched with :func:`get_values_in_bulk`, so that it can attach any related objects they are likely to need.
+	
+	"""
 	value_content_type_limiter.register_class(model)
+	if select_related is not None or prefetch is not None:
+		_value_bulk_hooks[model] = (select_related, prefetch)
 
 
 def unregister_value_model(model):
 	"""Registers a model as a valid content type for a :class:`ForeignKeyValue` or :class:`ManyToManyValue` through the :data:`value_content_type_limiter`."""
 	value_content_type_limiter.unregister_class(model)
+	_value_bulk_hooks.pop(model, None)
+
+
+def get_values_in_bulk(model, pks):
+	"""Returns a dictionary mapping each of ``pks`` to the instance of ``model`` with that primary key, fetched with a single query and the ``select_related`` and ``prefetch`` hooks which were passed to :func:`register_value_model` for the model, if any. Primary keys without an instance are left out."""
+	select_related, prefetch = _value_bulk_hooks.get(model, (None, None))
+	queryset = model._default_manager.all()
+	if select_related:
+		queryset = queryset.select_related(*select_related)
+	objects = queryset.in_bulk(list(pks))
+	if prefetch is not None and objects:
+		prefetch(objects.values())
+	return objects
 
 
 class AttributeValue(models.Model):
@@ -73,10 +106,50 @@ class AttributeValue(models.Model):
 attribute_value_limiter = ContentTypeSubclassLimiter(AttributeValue)
 
 
+class JSONValueManager(models.Manager):
+	def convert(self):
+		"""
+		Replaces each :class:`JSONValue` whose value could be stored by one of the :data:`SCALAR_VALUE_MODELS` with an instance of that model, and points its :class:`Attribute` at the new value. The :class:`JSONValue`\ s are fetched with a single query and deleted in batches; everything is done in one transaction, unless a transaction is already being managed. This is what the ``convert_json_values`` management command does.
+		
+		:returns: The number of values converted.
+		
+		"""
+		if transaction.is_managed():
+			return self._convert()
+		return transaction.commit_on_success(self._convert)()
+	
+	def _convert(self):
+		ct = ContentType.objects.get_for_model(self.model)
+		attributes = Attribute.objects.filter(value_content_type=ct)
+		values = dict([(value.pk, value) for value in self.filter(pk__in=attributes.values('value_object_id'))])
+		
+		converted = []
+		for attribute in attributes:
+			try:
+				value = values[attribute.value_object_id]
+			except KeyError:
+				continue
+			value_class = get_scalar_value_class(value.value)
+			if value_class is None:
+				continue
+			new_value = value_class()
+			new_value.set_value(value.value)
+			new_value.save(force_insert=True)
+			attribute.value = new_value
+			attribute.save()
+			converted.append(value.pk)
+		
+		for i in xrange(0, len(converted), 500):
+			self.filter(pk__in=converted[i:i + 500]).delete()
+		return len(converted)
+
+
 class JSONValue(AttributeValue):
 	"""Stores a python object as a json string."""
 	value = JSONField(verbose_name='Value (JSON)', help_text='This value must be valid JSON.', default='null', db_index=True)
 	
+	objects = JSONValueManager()
+	
 	def __unicode__(self):
 		return force_unicode(self.value)
 	
@@ -96,6 +169,110 @@ class JSONValue(AttributeValue):
 		app_label = 'philo'
 
 
+class ScalarValue(AttributeValue):
+	"""
+	Abstract base class for :class:`AttributeValue`\ s which store a single python value in a native, indexed database column, so that entities can be filtered and ordered by their :class:`Attribute`\ s in the database. Subclasses must define a ``value`` field and the :attr:`value_types` it can hold.
+	
+	"""
+	#: A tuple of the python types whose instances the model can store.
+	value_types = ()
+	
+	@classmethod
+	def accepts(cls, value):
+		"""Returns ``True`` if ``value`` can be stored by the model without being altered, and ``False`` otherwise."""
+		return isinstance(value, cls.value_types)
+	
+	def value_formfields(self):
+		field = self._meta.get_field('value')
+		return {field.name: field.formfield(initial=self.value)}
+	
+	def construct_instance(self, **kwargs):
+		field_name = self._meta.get_field('value').name
+		self.set_value(kwargs.pop(field_name, None))
+	
+	def set_value(self, value):
+		self.value = value
+	
+	class Meta:
+		abstract = True
+
+
+class BooleanValue(ScalarValue):
+	"""Stores a boolean."""
+	value = models.BooleanField(db_index=True)
+	value_types = (bool,)
+	
+	class Meta:
+		app_label = 'philo'
+
+
+class IntegerValue(ScalarValue):
+	"""Stores an integer which fits in 64 bits."""
+	value = models.BigIntegerField(db_index=True)
+	value_types = (int, long)
+	
+	@classmethod
+	def accepts(cls, value):
+		# bool is a subclass of int.
+		return super(IntegerValue, cls).accepts(value) and not isinstance(value, bool) and -2**63 <= value < 2**63
+	
+	class Meta:
+		app_label = 'philo'
+
+
+class DecimalValue(ScalarValue):
+	"""Stores a :class:`~decimal.Decimal` with up to twenty digits before the decimal point and ten after it."""
+	value = models.DecimalField(max_digits=30, decimal_places=10, db_index=True)
+	value_types = (Decimal,)
+	
+	@classmethod
+	def accepts(cls, value):
+		if not super(DecimalValue, cls).accepts(value):
+			return False
+		sign, digits, exponent = value.as_tuple()
+		# NaN and infinity have string exponents.
+		if not isinstance(exponent, (int, long)):
+			return False
+		return exponent >= -10 and len(digits) + exponent <= 20
+	
+	class Meta:
+		app_label = 'philo'
+
+
+class DateTimeValue(ScalarValue):
+	"""Stores a :class:`~datetime.datetime`."""
+	value = models.DateTimeField(db_index=True)
+	value_types = (datetime.datetime,)
+	
+	class Meta:
+		app_label = 'philo'
+
+
+class StringValue(ScalarValue):
+	"""Stores a string of up to 255 characters. Longer strings are stored as :class:`JSONValue`\ s."""
+	value = models.CharField(max_length=255, db_index=True)
+	value_types = (basestring,)
+	
+	@classmethod
+	def accepts(cls, value):
+		return super(StringValue, cls).accepts(value) and len(value) <= 255
+	
+	class Meta:
+		app_label = 'philo'
+
+
+#: The :class:`ScalarValue` subclasses which are tried, in order, when a value class is chosen for a python value. Values which none of them accept are stored as :class:`JSONValue`\ s.
+SCALAR_VALUE_MODELS = (BooleanValue, IntegerValue, DecimalValue, DateTimeValue, StringValue)
+
+
+def get_scalar_value_class(value):
+	"""Returns the first of the :data:`SCALAR_VALUE_MODELS` which accepts ``value``, or ``None`` if none of them do."""
+	for value_class in SCALAR_VALUE_MODELS:
+		if value_class.accepts(value):
+			return value_class
+	return None
+
+
 class ForeignKeyValue(AttributeValue):
 	"""Stores a generic relationship to an instance of any value content type (as defined by the :data:`value_content_type_limiter`)."""
 	content_type = models.ForeignKey(ContentType, limit_choices_to=value_content_type_limiter, verbose_name='Value type', null=True, blank=True)
@@ -144,6 +321,12 @@ class ManyToManyValue(AttributeValue):
 	object_ids = property(get_object_ids)
 	
 	def set_value(self, value):
+		"""
+		Makes the instances in the :class:`QuerySet` ``value`` the members of this :class:`ManyToManyValue`. Members which are already present are kept, and the rest are deleted with a single query.
+		
+		.. note:: Each new member still costs an ``INSERT`` of its own: the primary keys of the new :class:`ForeignKeyValue`\ s are needed for the memberships, and :meth:`QuerySet.bulk_create` doesn't return them - nor does it exist before django 1.4, where :func:`~philo.utils.bulk_create` falls back to saving instances one at a time. Only the memberships are inserted with a single query, and only on django 1.4 and later.
+		
+		"""
 		# Value must be a queryset. Watch out for ModelMultipleChoiceField;
 		# it returns its value as a list if empty.
 		
@@ -154,33 +337,41 @@ class ManyToManyValue(AttributeValue):
 		if self.pk is None:
 			self.save()
 		
-		object_ids = value.values_list('id', flat=True)
+		object_ids = set(value.values_list('pk', flat=True))
 		
-		# These lines shouldn't be necessary; however, if object_ids is an EmptyQuerySet,
-		# the code (specifically the object_id__in query) won't work without them. Unclear why...
-		# TODO: is this still the case?
-		if not object_ids:
-			self.values.all().delete()
-		else:
-			self.values.exclude(object_id__in=object_ids, content_type=self.content_type).delete()
-			
-			current_ids = self.object_ids
-			
-			for object_id in object_ids:
-				if object_id in current_ids:
-					continue
-				self.values.create(content_type=self.content_type, object_id=object_id)
+		# Compare against the current members with a single query, then remove
+		# everything that no longer belongs with another.
+		stale = []
+		current_ids = set()
+		for pk, content_type_id, object_id in self.values.values_list('pk', 'content_type', 'object_id'):
+			if content_type_id == self.content_type.pk and object_id in object_ids and object_id not in current_ids:
+				current_ids.add(object_id)
+			else:
+				stale.append(pk)
+		if stale:
+			ForeignKeyValue.objects.filter(pk__in=stale).delete()
+		
+		new_ids = object_ids - current_ids
+		if not new_ids:
+			return
+		
+		# The primary keys of the new values are needed for the memberships, so
+		# they have to be created one at a time; the memberships can be inserted
+		# together.
+		through = self._meta.get_field('values').rel.through
+		memberships = []
+		for object_id in sorted(new_ids):
+			foreign_key_value = ForeignKeyValue.objects.create(content_type=self.content_type, object_id=object_id)
+			memberships.append(through(manytomanyvalue_id=self.pk, foreignkeyvalue_id=foreign_key_value.pk))
+		bulk_create(through, memberships)
 	
 	def get_value(self):
 		if self.content_type is None:
 			return None
 		
-		# HACK to be safely explicit until http://code.djangoproject.com/ticket/15145 is resolved
-		object_ids = self.object_ids
+		# A single query, with the object ids as a subquery.
 		manager = self.content_type.model_class()._default_manager
-		if not object_ids:
-			return manager.none()
-		return manager.filter(id__in=self.object_ids)
+		return manager.filter(pk__in=self.values.filter(content_type=self.content_type).values('object_id'))
 	
 	value = property(get_value, set_value)
 	
@@ -259,6 +450,97 @@ class Attribute(models.Model):
 		unique_together = (('key', 'entity_content_type', 'entity_object_id'), ('value_content_type', 'value_object_id'))
 
 
+class EffectiveAttributeManager(models.Manager):
+	def rebuild(self, model, root=None, keys=None):
+		"""
+		Recalculates the :class:`EffectiveAttribute`\ s of the instances of ``model`` - a :class:`TreeEntity` subclass - and stores them, replacing any which were stored before. This takes one query for the instances, one for their :class:`Attribute`\ s, and one for those inherited from above ``root``, plus the writes.
+		
+		:param root: If given, only ``root`` and its descendants will be updated.
+		:param keys: If given, only the :class:`EffectiveAttribute`\ s with these keys will be updated.
+		:returns: The number of :class:`EffectiveAttribute`\ s stored.
+		
+		"""
+		opts = model._mptt_meta
+		ct = ContentType.objects.get_for_model(model)
+		if root is None:
+			nodes = model._default_manager.all()
+		else:
+			nodes = root.get_descendants(include_self=True)
+		
+		attributes = Attribute.objects.filter(entity_content_type=ct)
+		existing = self.filter(entity_content_type=ct)
+		if root is not None:
+			attributes = attributes.filter(entity_object_id__in=nodes.values('pk'))
+			existing = existing.filter(entity_object_id__in=nodes.values('pk'))
+		if keys is not None:
+			attributes = attributes.filter(key__in=keys)
+			existing = existing.filter(key__in=keys)
+		
+		own = {}
+		for attribute in attributes:
+			own.setdefault(attribute.entity_object_id, []).append(attribute)
+		
+		effective = {}
+		parent_id = root is not None and getattr(root, "%s_id" % opts.parent_attr) or None
+		if parent_id is not None:
+			# Start from whatever the root inherits.
+			inherited = {}
+			filters = keys is not None and {'key__in': keys} or {}
+			for attribute in TreeAttributeMapper(getattr(root, opts.parent_attr)).get_ancestor_attributes(**filters):
+				inherited[attribute.key] = attribute
+			effective[parent_id] = inherited
+		
+		rows = []
+		# Ordering by tree and left value guarantees that parents are seen before their children.
+		for pk, parent_id in nodes.order_by(opts.tree_id_attr, opts.left_attr).values_list('pk', opts.parent_attr):
+			current = effective.get(parent_id, {})
+			if pk in own:
+				current = dict(current)
+				for attribute in own[pk]:
+					current[attribute.key] = attribute
+			effective[pk] = current
+			for key, attribute in current.items():
+				rows.append(self.model(entity_content_type=ct, entity_object_id=pk, key=key, attribute=attribute, owner_object_id=attribute.entity_object_id, value_content_type_id=attribute.value_content_type_id, value_object_id=attribute.value_object_id))
+		
+		existing.delete()
+		bulk_create(self.model, rows)
+		return len(rows)
+
+
+class EffectiveAttribute(models.Model):
+	"""
+	If :setting:`PHILO_MATERIALIZE_TREE_ATTRIBUTES` is ``True``, an :class:`EffectiveAttribute` is stored for each key of each :class:`TreeEntity` instance, recording the :class:`Attribute` which applies to the instance for that key - whether it belongs to the instance itself or is inherited from an ancestor. They are kept up to date whenever :class:`Attribute`\ s are saved or deleted and whenever instances are added, moved or deleted, and can be rebuilt with the ``rebuild_effective_attributes`` management command. The migrations which add them store them for existing data if the setting is enabled at the time; if it is enabled later, run the command before relying on them. Default: ``False``.
+	
+	Besides letting a :class:`.TreeAttributeMapper` fetch its :class:`Attribute`\ s with a single indexed lookup, this makes it possible to query the effective attributes of a whole tree at once. For example, to find every :class:`.Node` which inherits a given ``Http404`` view::
+		
+		>>> node_ct = ContentType.objects.get_for_model(Node)
+		>>> values = ForeignKeyValue.objects.filter(content_type=ContentType.objects.get_for_model(view), object_id=view.pk)
+		>>> EffectiveAttribute.objects.filter(entity_content_type=node_ct, key='Http404', value_content_type=ContentType.objects.get_for_model(ForeignKeyValue), value_object_id__in=values.values('pk')).values_list('entity_object_id', flat=True)
+	
+	"""
+	entity_content_type = models.ForeignKey(ContentType, related_name='effective_attribute_entity_set')
+	entity_object_id = models.PositiveIntegerField()
+	#: :class:`GenericForeignKey` to the :class:`TreeEntity` instance the :class:`Attribute` applies to.
+	entity = generic.GenericForeignKey('entity_content_type', 'entity_object_id')
+	#: The key of the :class:`Attribute`.
+	key = models.CharField(max_length=255)
+	#: The :class:`Attribute` which applies to the entity.
+	attribute = models.ForeignKey(Attribute, related_name='effective_attribute_set')
+	#: The primary key of the entity or ancestor which the :class:`Attribute` belongs to.
+	owner_object_id = models.PositiveIntegerField()
+	value_content_type = models.ForeignKey(ContentType, related_name='effective_attribute_value_set', null=True, blank=True)
+	value_object_id = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+	
+	objects = EffectiveAttributeManager()
+	
+	def __unicode__(self):
+		return u'"%s" for %s %s' % (self.key, self.entity_content_type, self.entity_object_id)
+	
+	class Meta:
+		app_label = 'philo'
+		unique_together = (('entity_content_type', 'entity_object_id', 'key'),)
+
+
 class EntityOptions(object):
 	def __init__(self, options):
 		if options is not None:
@@ -280,18 +562,98 @@ class EntityBase(models.base.ModelBase):
 		return new
 
 
+class EntityQuerySet(models.query.QuerySet):
+	"""A :class:`QuerySet` which can filter and order :class:`Entity` instances by their :class:`Attribute`\ s in the database, rather than by loading each instance's :attr:`~Entity.attributes`. Only an instance's own :class:`Attribute`\ s are considered, not those which a :class:`TreeEntity` inherits."""
+	def with_attribute(self, key, *args):
+		"""
+		Returns the instances which have an :class:`Attribute` with the given ``key`` and, if it is given, the given ``value``, using one join against the :class:`Attribute` table. For example::
+			
+			>>> Node.objects.with_attribute('featured', True)
+		
+		A model instance matches :class:`ForeignKeyValue`\ s which refer to it. Any other value matches a :class:`JSONValue` with the same json representation, or an instance of whichever of the :data:`SCALAR_VALUE_MODELS` would be used to store it.
+		
+		"""
+		if len(args) > 1:
+			raise TypeError("with_attribute() takes at most 2 arguments (%d given)" % (len(args) + 1))
+		q = models.Q(attribute_set__entity_content_type=ContentType.objects.get_for_model(self.model), attribute_set__key=key)
+		if args:
+			q &= self._attribute_value_q(args[0])
+		return self.filter(q)
+	
+	def _attribute_value_q(self, value):
+		def value_q(value_class, values):
+			return models.Q(attribute_set__value_content_type=ContentType.objects.get_for_model(value_class), attribute_set__value_object_id__in=values.values('pk'))
+		
+		if isinstance(value, models.Model):
+			return value_q(ForeignKeyValue, ForeignKeyValue.objects.filter(content_type=ContentType.objects.get_for_model(value), object_id=value.pk))
+		
+		try:
+			q = value_q(JSONValue, JSONValue.objects.filter(value=json.dumps(value)))
+		except TypeError:
+			# Not representable as json.
+			q = None
+		value_class = get_scalar_value_class(value)
+		if value_class is not None:
+			typed_q = value_q(value_class, value_class._default_manager.filter(value=value))
+			if q is None:
+				q = typed_q
+			else:
+				q |= typed_q
+		if q is None:
+			return models.Q(pk__in=[])
+		return q
+	
+	def order_by_attribute(self, key, value_class, descending=False):
+		"""
+		Orders the instances by the value of their :class:`Attribute` with the given ``key``, which is selected from the database as ``attribute_<key>``. Instances whose :class:`Attribute` is missing or is not stored as an instance of ``value_class`` sort as though their value were ``NULL``.
+		
+		:param value_class: A subclass of :class:`AttributeValue` with a ``value`` column - one of the :data:`SCALAR_VALUE_MODELS` or :class:`JSONValue`. :class:`JSONValue`\ s are ordered by their json representation.
+		
+		"""
+		qn = connection.ops.quote_name
+		attribute_opts = Attribute._meta
+		value_opts = value_class._meta
+		
+		def column(name):
+			return 'a.%s' % qn(attribute_opts.get_field(name).column)
+		
+		sql = 'SELECT v.%s FROM %s a INNER JOIN %s v ON %s = v.%s WHERE %s = %%s AND %s = %%s AND %s = %%s AND %s = %s.%s' % (
+			qn(value_opts.get_field('value').column), qn(attribute_opts.db_table), qn(value_opts.db_table),
+			column('value_object_id'), qn(value_opts.pk.column), column('entity_content_type'), column('key'),
+			column('value_content_type'), column('entity_object_id'), qn(self.model._meta.db_table), qn(self.model._meta.pk.column)
+		)
+		params = [ContentType.objects.get_for_model(self.model).pk, key, ContentType.objects.get_for_model(value_class).pk]
+		name = 'attribute_%s' % key
+		return self.extra(select={name: sql}, select_params=params).order_by('%s%s' % (descending and '-' or '', name))
+
+
+class EntityManager(models.Manager):
+	def get_query_set(self):
+		return EntityQuerySet(self.model, using=self._db)
+	
+	def with_attribute(self, key, *args):
+		"""See :meth:`EntityQuerySet.with_attribute`."""
+		return self.get_query_set().with_attribute(key, *args)
+	
+	def order_by_attribute(self, key, value_class, descending=False):
+		"""See :meth:`EntityQuerySet.order_by_attribute`."""
+		return self.get_query_set().order_by_attribute(key, value_class, descending)
+
+
 class Entity(models.Model):
 	"""An abstract class that simplifies access to related attributes. Most models provided by Philo subclass Entity."""
 	__metaclass__ = EntityBase
 	
 	attribute_set = generic.GenericRelation(Attribute, content_type_field='entity_content_type', object_id_field='entity_object_id')
 	
+	objects = EntityManager()
+	
 	def get_attribute_mapper(self, mapper=AttributeMapper):
 		"""
 		Returns an :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly.
-
+		
 		Example::
-
+			
 			>>> attr = entity.attribute_set.get(key='spam')
 			>>> attr.value.value
 			u'eggs'
@@ -316,10 +678,24 @@ class TreeEntityBase(MPTTModelBase, EntityBase):
 		attrs['_mptt_meta'] = MPTTOptions(attrs.pop('MPTTMeta', None))
 		cls = EntityBase.__new__(meta, name, bases, attrs)
 		
+		if not cls._meta.abstract:
+			models.signals.post_save.connect(invalidate_path_tries, sender=cls)
+			models.signals.post_delete.connect(invalidate_path_tries, sender=cls)
+			models.signals.post_save.connect(invalidate_tree_attributes, sender=cls)
+			models.signals.post_delete.connect(invalidate_tree_attributes, sender=cls)
+			if node_moved is not None:
+				node_moved.connect(invalidate_path_tries, sender=cls)
+				node_moved.connect(invalidate_tree_attributes, sender=cls)
+			if MATERIALIZE_TREE_ATTRIBUTES:
+				models.signals.post_save.connect(update_effective_attributes, sender=cls)
+				models.signals.post_delete.connect(delete_effective_attributes, sender=cls)
+				if node_moved is not None:
+					node_moved.connect(update_effective_attributes, sender=cls)
+		
 		return meta.register(cls)
 
 
-class TreeEntityManager(models.Manager):
+class TreeEntityManager(EntityManager):
 	use_for_related_fields = True
 	
 	def get_with_path(self, path, root=None, absolute_result=True, pathsep='/', field='pk'):
@@ -430,6 +806,68 @@ class TreeEntityManager(models.Manager):
 		# of the path, since short paths are more likely, but how far forward? It would
 		# need to shift depending on len(segments) - perhaps logarithmically?
 		return find_obj(segments, len(segments)/2 or len(segments))
+	
+	def get_many_with_path(self, paths, root=None, pathsep='/', field='pk'):
+		"""
+		Resolves each of ``paths`` the way :meth:`get_with_path` would with ``absolute_result=False``, but with one query per 500 distinct path segments, no matter how deep the paths go. Only the objects whose ``field`` matches one of the segments of ``paths`` are fetched.
+		
+		Example::
+			
+			>>> Node.objects.get_many_with_path(['second/third/sub/path', 'second2', 'invalid'], root=root)
+			{'second/third/sub/path': (<Node: root/second/third>, 'sub/path'), 'second2': (<Node: root/second2>, None), 'invalid': (<Node: root>, 'invalid')}
+		
+		:param paths: An iterable of paths
+		:param root: The object which will be considered the root of the search
+		:param pathsep: The path separator used in ``paths``
+		:param field: The field on the model which should be queried for path segment matching.
+		:returns: A dictionary mapping each path to an (instance, remaining_path) tuple. Paths for which :meth:`get_with_path` would raise :exc:`~django.core.exceptions.ObjectDoesNotExist` are left out.
+		
+		"""
+		paths = list(paths)
+		segments = set()
+		for path in paths:
+			segments.update([segment for segment in path.split(pathsep) if segment])
+		
+		if root is None:
+			queryset = self.all()
+		else:
+			queryset = root.get_descendants()
+		
+		# Any object along one of the paths must match one of its segments; the trie
+		# discards matching objects which aren't connected to the root.
+		segments = list(segments)
+		opts = self.model._mptt_meta
+		objects = []
+		for i in xrange(0, len(segments), 500):
+			objects.extend(queryset.filter(**{'%s__in' % field: segments[i:i + 500]}))
+		objects.sort(key=lambda obj: (getattr(obj, opts.tree_id_attr), getattr(obj, opts.left_attr)))
+		trie = PathTrie(self.none(), root, field)
+		trie.add(objects)
+		
+		results = {}
+		for path in paths:
+			try:
+				results[path] = trie.lookup(path, pathsep)
+			except self.model.DoesNotExist:
+				pass
+		return results
+	
+	def get_path_trie(self, root=None, field='pk'):
+		"""
+		Returns a :class:`~philo.utils.trees.PathTrie` of the objects below ``root`` which can be used in place of :meth:`get_with_path` with ``absolute_result=False``. The trie is built with a single query the first time it is requested and kept for the life of the process; it is rebuilt after any instance of the model is saved, deleted, or moved.
+		
+		Example::
+			
+			>>> trie = Node.objects.get_path_trie(root=root)
+			>>> trie.lookup('second/third/sub/path')
+			(<Node: root/second/third>, 'sub/path')
+		
+		:param root: The object which will be considered the root of the search
+		:param field: The field on the model which should be matched against path segments.
+		:returns: A :class:`~philo.utils.trees.PathTrie` instance.
+		
+		"""
+		return get_path_trie(self, root, field)
 
 
 class TreeEntity(Entity, MPTTModel):
@@ -484,9 +922,9 @@ class TreeEntity(Entity, MPTTModel):
 	def get_attribute_mapper(self, mapper=None):
 		"""
 		Returns a :class:`.TreeAttributeMapper` or :class:`.AttributeMapper` which can be used to retrieve related :class:`Attribute`\ s' values directly. If an :class:`Attribute` with a given key is not related to the :class:`Entity`, then the mapper will check the parent's attributes.
-
+		
 		Example::
-
+			
 			>>> attr = entity.attribute_set.get(key='spam')
 			DoesNotExist: Attribute matching query does not exist.
 			>>> attr = entity.parent.attribute_set.get(key='spam')
@@ -503,6 +941,12 @@ class TreeEntity(Entity, MPTTModel):
 				mapper = AttributeMapper
 		return super(TreeEntity, self).get_attribute_mapper(mapper)
 	
+	def save(self, *args, **kwargs):
+		if MATERIALIZE_TREE_ATTRIBUTES:
+			# mptt moves the instance - changing its parent in the database - before pre_save is sent.
+			remember_parent(self)
+		super(TreeEntity, self).save(*args, **kwargs)
+	
 	def __unicode__(self):
 		return self.path
 	
@@ -510,19 +954,222 @@ class TreeEntity(Entity, MPTTModel):
 		abstract = True
 
 
+#: The number of characters of :attr:`SlugTreeEntity.full_path` which are copied to the indexed :attr:`SlugTreeEntity.full_path_prefix` column. MySQL can't index a longer ``utf8`` column.
+FULL_PATH_PREFIX_LENGTH = 255
+
+
 class SlugTreeEntityManager(TreeEntityManager):
 	def get_with_path(self, path, root=None, absolute_result=True, pathsep='/', field='slug'):
-		return super(SlugTreeEntityManager, self).get_with_path(path, root, absolute_result, pathsep, field)
+		"""
+		Behaves like :meth:`TreeEntityManager.get_with_path`, but uses the materialized :attr:`SlugTreeEntity.full_path` column when matching on ``slug``. Exact lookups become a single indexed equality query, and the search for the deepest object along ``path`` becomes a single query against every prefix of ``path``, regardless of its depth.
+		
+		"""
+		if field != 'slug' or (root is not None and not root.full_path):
+			return super(SlugTreeEntityManager, self).get_with_path(path, root, absolute_result, pathsep, field)
+		
+		segments = [segment for segment in path.split(pathsep) if segment]
+		
+		# Special-case a lack of segments. No queries necessary.
+		if not segments:
+			if root is not None:
+				if absolute_result:
+					return root
+				return root, None
+			else:
+				raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
+		
+		if root is None:
+			prefix = ''
+		else:
+			prefix = root.full_path + '/'
+		
+		if absolute_result:
+			full_path = prefix + '/'.join(segments)
+			return self.get(full_path_prefix=full_path[:FULL_PATH_PREFIX_LENGTH], full_path=full_path)
+		
+		paths = [prefix + '/'.join(segments[:depth]) for depth in xrange(1, len(segments) + 1)]
+		found = self.get_by_full_paths(paths)
+		for depth in xrange(len(segments), 0, -1):
+			try:
+				obj = found[paths[depth - 1]]
+			except KeyError:
+				continue
+			return obj, pathsep.join(segments[depth:]) or None
+		
+		if root is not None:
+			return root, pathsep.join(segments)
+		raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
+	
+	def get_many_with_path(self, paths, root=None, pathsep='/', field='slug'):
+		"""
+		Behaves like :meth:`TreeEntityManager.get_many_with_path`, but uses the materialized :attr:`SlugTreeEntity.full_path` column when matching on ``slug``, fetching only the objects which lie along one of ``paths``. Every prefix of every path is looked up, 500 at a time, so large batches of paths take one query per 500 distinct prefixes rather than exceeding the database's limit on query parameters.
+		
+		"""
+		if field != 'slug' or (root is not None and not root.full_path):
+			return super(SlugTreeEntityManager, self).get_many_with_path(paths, root, pathsep, field)
+		
+		if root is None:
+			prefix = ''
+		else:
+			prefix = root.full_path + '/'
+		
+		path_segments = []
+		full_paths = set()
+		for path in paths:
+			segments = [segment for segment in path.split(pathsep) if segment]
+			path_segments.append((path, segments))
+			for depth in xrange(1, len(segments) + 1):
+				full_paths.add(prefix + '/'.join(segments[:depth]))
+		
+		found = self.get_by_full_paths(full_paths)
+		
+		results = {}
+		for path, segments in path_segments:
+			for depth in xrange(len(segments), 0, -1):
+				try:
+					obj = found[prefix + '/'.join(segments[:depth])]
+				except KeyError:
+					continue
+				results[path] = (obj, pathsep.join(segments[depth:]) or None)
+				break
+			else:
+				if root is not None:
+					results[path] = (root, pathsep.join(segments) or None)
+		return results
+	
+	def get_by_full_paths(self, full_paths):
+		"""
+		Returns a dictionary mapping each of ``full_paths`` which is the :attr:`~SlugTreeEntity.full_path` of an object to that object. The objects are looked up by the indexed :attr:`~SlugTreeEntity.full_path_prefix` column, with one query per 500 distinct prefixes.
+		
+		"""
+		full_paths = set(full_paths)
+		prefixes = list(set([full_path[:FULL_PATH_PREFIX_LENGTH] for full_path in full_paths]))
+		found = {}
+		for i in xrange(0, len(prefixes), 500):
+			for obj in self.filter(full_path_prefix__in=prefixes[i:i + 500]):
+				if obj.full_path in full_paths:
+					found[obj.full_path] = obj
+		return found
+	
+	def get_path_trie(self, root=None, field='slug'):
+		return super(SlugTreeEntityManager, self).get_path_trie(root, field)
+	
+	def rebuild_full_paths(self, root=None):
+		"""
+		Recalculates :attr:`SlugTreeEntity.full_path` for every object (or every object below ``root``) from the slugs of its ancestors and saves any which have changed. This is used by the ``rebuild_full_paths`` management command to backfill the column.
+		
+		:returns: The number of objects whose paths were updated.
+		
+		"""
+		opts = self.model._mptt_meta
+		if root is None:
+			queryset = self.all()
+			paths = {}
+		else:
+			queryset = root.get_descendants()
+			paths = {root.pk: root.full_path}
+		
+		updated = 0
+		# Ordering by tree and left value guarantees that parents are seen before their children.
+		for pk, parent_id, slug, full_path, full_path_prefix in queryset.order_by(opts.tree_id_attr, opts.left_attr).values_list('pk', opts.parent_attr, 'slug', 'full_path', 'full_path_prefix'):
+			if parent_id is None:
+				path = slug
+			else:
+				path = u'%s/%s' % (paths[parent_id], slug)
+			paths[pk] = path
+			if path != full_path or path[:FULL_PATH_PREFIX_LENGTH] != full_path_prefix:
+				self.filter(pk=pk).update(full_path=path, full_path_prefix=path[:FULL_PATH_PREFIX_LENGTH])
+				updated += 1
+		return updated
 
 
 class SlugTreeEntity(TreeEntity):
 	objects = SlugTreeEntityManager()
 	slug = models.SlugField(max_length=255)
+	#: A denormalized copy of the instance's path from the top of its tree. This is kept up to date automatically when the instance is saved or moved, including the paths of all its descendants, and can be backfilled with the ``rebuild_full_paths`` management command.
+	full_path = models.CharField(max_length=1000, editable=False, blank=True)
+	#: The first :data:`FULL_PATH_PREFIX_LENGTH` characters of :attr:`full_path`, which are indexed in its place; :meth:`SlugTreeEntityManager.get_by_full_paths` uses it to look up objects by path.
+	full_path_prefix = models.CharField(max_length=FULL_PATH_PREFIX_LENGTH, db_index=True, editable=False, blank=True)
 	
 	def get_path(self, root=None, pathsep='/', field='slug', memoize=True):
+		"""Returns the path using :attr:`full_path` - without any queries - when possible. Otherwise, this behaves like :meth:`TreeEntity.get_path`."""
+		if field == 'slug' and self.full_path and (root is None or getattr(root, 'full_path', None)):
+			if root is None:
+				path = self.full_path
+			elif root == self:
+				return ''
+			elif not self.is_descendant_of(root):
+				raise AncestorDoesNotExist(root)
+			else:
+				path = self.full_path[len(root.full_path) + 1:]
+			
+			# Slugs can't contain slashes, so this is safe.
+			if pathsep != '/':
+				path = path.replace('/', pathsep)
+			return path
 		return super(SlugTreeEntity, self).get_path(root, pathsep, field, memoize)
 	path = property(get_path)
 	
+	def calculate_full_path(self):
+		"""Returns what the value of :attr:`full_path` should be, based on the instance's slug and its parent's path."""
+		parent_attr = self._mptt_meta.parent_attr
+		if getattr(self, "%s_id" % parent_attr) is None:
+			return self.slug
+		return u'%s/%s' % (getattr(self, parent_attr).get_path(), self.slug)
+	
+	def update_full_path(self):
+		"""Recalculates :attr:`full_path` and, if it has changed, updates it and the paths of all descendants in the database without a full save. This is called automatically when an instance is moved."""
+		old_full_path = self.full_path
+		self.full_path = self.calculate_full_path()
+		if old_full_path != self.full_path:
+			self.full_path_prefix = self.full_path[:FULL_PATH_PREFIX_LENGTH]
+			self._default_manager.filter(pk=self.pk).update(full_path=self.full_path, full_path_prefix=self.full_path_prefix)
+			self._update_descendant_full_paths(old_full_path)
+	
+	def _update_descendant_full_paths(self, old_full_path):
+		if self.is_leaf_node():
+			return
+		
+		if not old_full_path:
+			# The old path was never recorded, so the descendants can't be
+			# rewritten by prefix.
+			self._default_manager.rebuild_full_paths(root=self)
+			return
+		
+		# Rewrite the prefix of every descendant's path in a single query.
+		opts = self._mptt_meta
+		qn = connection.ops.quote_name
+		column = qn(self._meta.get_field('full_path').column)
+		if 'mysql' in connection.settings_dict['ENGINE']:
+			value = 'CONCAT(%%s, SUBSTR(%s, %%s))' % column
+		else:
+			value = '%%s || SUBSTR(%s, %%s)' % column
+		# The prefix is set first: MySQL would otherwise compute it from the
+		# already updated full_path.
+		sql = 'UPDATE %s SET %s = SUBSTR(%s, 1, %d), %s = %s WHERE %s = %%s AND %s > %%s AND %s < %%s' % (
+			qn(self._meta.db_table),
+			qn(self._meta.get_field('full_path_prefix').column),
+			value,
+			FULL_PATH_PREFIX_LENGTH,
+			column,
+			value,
+			qn(self._meta.get_field(opts.tree_id_attr).column),
+			qn(self._meta.get_field(opts.left_attr).column),
+			qn(self._meta.get_field(opts.right_attr).column)
+		)
+		params = [self.full_path, len(old_full_path) + 1, self.full_path, len(old_full_path) + 1, getattr(self, opts.tree_id_attr), getattr(self, opts.left_attr), getattr(self, opts.right_attr)]
+		cursor = connection.cursor()
+		cursor.execute(sql, params)
+		transaction.commit_unless_managed()
+	
+	def save(self, *args, **kwargs):
+		old_full_path = self.full_path
+		self.full_path = self.calculate_full_path()
+		self.full_path_prefix = self.full_path[:FULL_PATH_PREFIX_LENGTH]
+		super(SlugTreeEntity, self).save(*args, **kwargs)
+		if old_full_path != self.full_path:
+			self._update_descendant_full_paths(old_full_path)
+	
 	def clean(self):
 		if getattr(self, "%s_id" % self._mptt_meta.parent_attr) is None:
 			try:
@@ -534,4 +1181,75 @@ class SlugTreeEntity(TreeEntity):
 	
 	class Meta:
 		unique_together = ('parent', 'slug')
-		abstract = True
\ No newline at end of file
+		abstract = True
+
+
+def update_full_path_on_move(sender, instance, **kwargs):
+	"""Keeps :attr:`SlugTreeEntity.full_path` current when an instance is moved without being saved."""
+	if isinstance(instance, SlugTreeEntity):
+		instance.update_full_path()
+
+
+if node_moved is not None:
+	node_moved.connect(update_full_path_on_move)
+
+
+models.signals.post_save.connect(invalidate_tree_attributes_for_attribute, sender=Attribute)
+models.signals.post_delete.connect(invalidate_tree_attributes_for_attribute, sender=Attribute)
+# Finding the attributes of a value costs a query for every value saved, so
+# only do it if cached tree attributes need it. (Cached pages connect it too.)
+if CACHE_TREE_ATTRIBUTES:
+	for value_model in (JSONValue, ForeignKeyValue, ManyToManyValue) + SCALAR_VALUE_MODELS:
+		models.signals.post_save.connect(invalidate_tree_attributes_for_value, sender=value_model)
+		models.signals.post_delete.connect(invalidate_tree_attributes_for_value, sender=value_model)
+
+
+def remember_parent(instance):
+	"""Notes the parent which a :class:`TreeEntity` instance had before it was saved, so that :func:`update_effective_attributes` can tell whether it moved. Only instances which weren't loaded from the database but have a primary key take a query; for the rest, the parent is already known."""
+	opts = instance._mptt_meta
+	if instance.pk is None:
+		parent_id = None
+	elif not instance._state.adding:
+		# mptt keeps the parent the instance was loaded or last saved with.
+		parent_id = instance._mptt_cached_fields[opts.parent_attr]
+	else:
+		try:
+			parent_id = type(instance)._default_manager.filter(pk=instance.pk).values_list("%s_id" % opts.parent_attr, flat=True)[0]
+		except IndexError:
+			parent_id = None
+	instance._effective_attributes_parent_id = parent_id
+
+
+def update_effective_attributes(sender, instance, created=False, **kwargs):
+	"""Rebuilds the :class:`EffectiveAttribute`\ s of a :class:`TreeEntity` instance and its descendants when it is created or moved."""
+	parent_id = getattr(instance, "%s_id" % instance._mptt_meta.parent_attr)
+	if created or not hasattr(instance, '_effective_attributes_parent_id') or instance._effective_attributes_parent_id != parent_id:
+		EffectiveAttribute.objects.rebuild(sender, root=instance)
+	instance._effective_attributes_parent_id = parent_id
+
+
+def delete_effective_attributes(sender, instance, **kwargs):
+	"""Deletes the :class:`EffectiveAttribute`\ s of a deleted :class:`TreeEntity` instance."""
+	EffectiveAttribute.objects.filter(entity_content_type=ContentType.objects.get_for_model(sender), entity_object_id=instance.pk).delete()
+
+
+def update_effective_attributes_for_attribute(sender, instance, **kwargs):
+	"""Rebuilds the :class:`EffectiveAttribute`\ s which an :class:`Attribute` of a :class:`TreeEntity` instance could affect - those with its key, on the instance and its descendants."""
+	model = ContentType.objects.get_for_id(instance.entity_content_type_id).model_class()
+	if model is None or not issubclass(model, TreeEntity):
+		return
+	try:
+		entity = model._default_manager.get(pk=instance.entity_object_id)
+	except model.DoesNotExist:
+		return
+	
+	keys = set([instance.key])
+	if instance.pk is not None:
+		# The key may have been changed.
+		keys.update(EffectiveAttribute.objects.filter(attribute=instance.pk).values_list('key', flat=True))
+	EffectiveAttribute.objects.rebuild(model, root=entity, keys=keys)
+
+
+if MATERIALIZE_TREE_ATTRIBUTES:
+	models.signals.post_save.connect(update_effective_attributes_for_attribute, sender=Attribute)
+	models.signals.post_delete.connect(update_effective_attributes_for_attribute, sender=Attribute)
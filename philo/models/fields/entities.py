@@ -3,12 +3,13 @@ from itertools import tee
 
 from django import forms
 from django.core.exceptions import FieldError, ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.db.models.fields import NOT_PROVIDED
 from django.utils.text import capfirst
 
 from philo.models import ManyToManyValue, JSONValue, ForeignKeyValue, Attribute, Entity
 from philo.signals import entity_class_prepared
+from philo.utils.entities import AttributeMapper
 
 
 __all__ = ('JSONAttribute', 'ForeignKeyAttribute', 'ManyToManyAttribute')
@@ -144,22 +145,31 @@ class AttributeFieldDescriptor(object):
 
 
 def process_attribute_fields(sender, instance, created, **kwargs):
-	"""This function is attached to each :class:`Entity` subclass's post_save signal. Any :class:`Attribute`\ s managed by :class:`AttributeProxyField`\ s which have been removed will be deleted, and any new attributes will be created."""
+	"""This function is attached to each :class:`Entity` subclass's post_save signal. Any :class:`Attribute`\ s managed by :class:`AttributeProxyField`\ s which have been removed will be deleted, and any new attributes will be created. The existing :class:`Attribute`\ s are fetched once, and the changes are written together with :meth:`.AttributeMapper.set_values` in one transaction, unless a transaction is already being managed."""
 	if ATTRIBUTE_REGISTRY in instance.__dict__:
 		registry = instance.__dict__[ATTRIBUTE_REGISTRY]
+		if registry['removed'] or registry['added']:
+			if transaction.is_managed():
+				_flush_attribute_fields(instance, registry)
+			else:
+				transaction.commit_on_success(_flush_attribute_fields)(instance, registry)
+			instance.attributes.clear_cache()
+		del instance.__dict__[ATTRIBUTE_REGISTRY]
+
+
+def _flush_attribute_fields(instance, registry):
+	if registry['removed']:
 		instance.attribute_set.filter(key__in=[field.attribute_key for field in registry['removed']]).delete()
-		
+	
+	if registry['added']:
+		values = {}
+		value_classes = {}
 		for field in registry['added']:
-			# TODO: Should this perhaps just use instance.attributes[field.attribute_key] = getattr(instance, field.name, None)?
-			# (Would eliminate the need for field.value_class.)
-			try:
-				attribute = instance.attribute_set.get(key=field.attribute_key)
-			except Attribute.DoesNotExist:
-				attribute = Attribute()
-				attribute.entity = instance
-				attribute.key = field.attribute_key
-			attribute.set_value(value=getattr(instance, field.name, None), value_class=field.value_class)
-		del instance.__dict__[ATTRIBUTE_REGISTRY]
+			values[field.attribute_key] = getattr(instance, field.name, None)
+			value_classes[field.attribute_key] = field.value_class
+		# Use a fresh mapper, so that only the instance's own attributes are
+		# considered and nothing stale is compared against.
+		AttributeMapper(instance).set_values(values, value_classes)
 
 
 class JSONAttribute(AttributeProxyField):
@@ -1,3 +1,4 @@
+from copy import deepcopy
 from inspect import getargspec
 import mimetypes
 from os.path import basename
@@ -9,24 +10,73 @@ from django.contrib.sites.models import Site, RequestSite
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.servers.basehttp import FileWrapper
-from django.core.urlresolvers import resolve, clear_url_caches, reverse, NoReverseMatch
+from django.core.urlresolvers import RegexURLResolver, get_script_prefix, reverse, NoReverseMatch
 from django.db import models
+from django.db.models.fields.related import add_lazy_relation
+from django.db.models.signals import post_save, post_delete, class_prepared
 from django.http import HttpResponse, HttpResponseServerError, HttpResponseRedirect, Http404
-from django.utils.encoding import smart_str
+from django.utils.encoding import iri_to_uri, smart_str
 
 from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED, ViewCanNotProvideSubpath, ViewDoesNotProvideSubpaths
-from philo.models.base import SlugTreeEntity, Entity, register_value_model
+from philo.models.base import SlugTreeEntity, Entity, Attribute, register_value_model, node_moved
 from philo.models.fields import JSONField
 from philo.utils import ContentTypeSubclassLimiter
+from philo.utils.cache import LRUCache, get_generation, bump_generation
 from philo.utils.entities import LazyPassthroughAttributeMapper
 from philo.signals import view_about_to_render, view_finished_rendering
 
 
-__all__ = ('Node', 'View', 'MultiView', 'Redirect', 'File')
+__all__ = ('Node', 'View', 'MultiView', 'uses_request_instance', 'Redirect', 'File')
 
 
 _view_content_type_limiter = ContentTypeSubclassLimiter(None)
 CACHE_PHILO_ROOT = getattr(settings, "PHILO_CACHE_PHILO_ROOT", True)
+#: The name of the cache generation which is bumped whenever a change could make a previously unresolvable path resolvable. See :class:`philo.middleware.RequestNodeMiddleware`.
+UNRESOLVABLE_PATHS_GENERATION = 'unresolvable_paths'
+VIEW_RESOLVER_CACHE_SIZE = getattr(settings, 'PHILO_VIEW_RESOLVER_CACHE_SIZE', 100)
+#: The name of the cache generation which is bumped whenever a :class:`View`, or any model which a :class:`View` has a foreign key to, is saved or deleted. Resolvers built by :meth:`View.get_resolver` are discarded when it changes.
+VIEW_RESOLVERS_GENERATION = 'view_resolvers'
+CACHE_VIEWS = getattr(settings, 'PHILO_CACHE_VIEWS', False)
+VIEW_CACHE_SIZE = getattr(settings, 'PHILO_VIEW_CACHE_SIZE', 1000)
+#: The name of the cache generation which is bumped whenever a :class:`View`, or any model which a :class:`View` has a foreign key to, is saved or deleted.
+VIEWS_GENERATION = 'views'
+#: How many levels of foreign keys are fetched along with cached :class:`View`\ s.
+VIEW_RELATED_DEPTH = 2
+
+
+_view_resolvers = LRUCache(VIEW_RESOLVER_CACHE_SIZE)
+_views = LRUCache(VIEW_CACHE_SIZE)
+
+
+def _get_related_fields(model, depth=VIEW_RELATED_DEPTH):
+	# Returns (lookup, model) pairs for the foreign keys of ``model``, followed to ``depth``.
+	related = []
+	for field in model._meta.fields:
+		if isinstance(field, models.ForeignKey):
+			related.append((field.name, field.rel.to))
+			if depth > 1:
+				related.extend([('%s__%s' % (field.name, name), to) for name, to in _get_related_fields(field.rel.to, depth - 1)])
+	return related
+
+
+def get_view(view_model, pk):
+	"""
+	Returns the instance of ``view_model`` with the given ``pk``, along with the objects its foreign keys point to (up to :data:`VIEW_RELATED_DEPTH` levels deep). Instances are kept in a per-process LRU cache of :setting:`PHILO_VIEW_CACHE_SIZE` entries (default: 1000) until any :class:`View`, or any model which a :class:`View` has a foreign key to, is saved or deleted in any process. A deep copy of the cached instance is returned each time, so no two requests share the instance or its related objects.
+	
+	"""
+	# Read the generation first so that a change made while the view is
+	# being fetched is not masked by the stored entry.
+	generation = get_generation(VIEWS_GENERATION)
+	key = (view_model, pk)
+	cached = _views.get(key)
+	if cached is None or cached[0] != generation:
+		view = view_model._default_manager.select_related(*[name for name, to in _get_related_fields(view_model)]).get(pk=pk)
+		cached = (generation, view)
+		_views.set(key, cached)
+	
+	# Callers are free to annotate the instance and its related objects, so
+	# never hand out any part of the cached one.
+	return deepcopy(cached[1])
 
 
 class Node(SlugTreeEntity):
@@ -52,10 +102,13 @@ class Node(SlugTreeEntity):
 		return False
 	
 	def render_to_response(self, request, extra_context=None):
-		"""This is a shortcut method for :meth:`View.render_to_response`"""
+		"""This is a shortcut method for :meth:`View.render_to_response`. If :setting:`PHILO_CACHE_VIEWS` is ``True``, the :class:`View` will be fetched with :func:`get_view` rather than with a fresh query. Default: ``False``."""
 		if self.view_object_id and self.view_content_type_id:
 			view_model = ContentType.objects.get_for_id(self.view_content_type_id).model_class()
-			self.view = view_model._default_manager.get(pk=self.view_object_id)
+			if CACHE_VIEWS:
+				self.view = get_view(view_model, self.view_object_id)
+			else:
+				self.view = view_model._default_manager.get(pk=self.view_object_id)
 			return self.view.render_to_response(request, extra_context)
 		raise Http404
 	
@@ -150,6 +203,46 @@ class View(Entity):
 			return False
 		return True
 	
+	def get_urlpatterns_fingerprint(self):
+		"""Returns a value which changes whenever anything that the :class:`View`'s ``urlpatterns`` are built from changes. By default, this is a representation of the values of all the instance's fields; subclasses whose ``urlpatterns`` depend on anything else should extend it."""
+		return repr([getattr(self, field.attname) for field in self._meta.fields])
+	
+	def _get_cached_resolver(self):
+		# Returns a (resolver, instance, paths) tuple, where ``instance`` is the one
+		# which built the resolver and ``paths`` maps the id of each of its views
+		# to that view's position in the urlpatterns. See :meth:`_get_request_view`.
+		key = (ContentType.objects.get_for_model(self).pk, self.pk, self.get_urlpatterns_fingerprint(), get_generation(VIEW_RESOLVERS_GENERATION))
+		cached = _view_resolvers.get(key)
+		if cached is None:
+			resolver = RegexURLResolver(r'^/', self.urlpatterns)
+			cached = (resolver, self, _get_view_paths(resolver.url_patterns))
+			_view_resolvers.set(key, cached)
+		return cached
+	
+	def _get_request_view(self, view, instance, paths):
+		# Returns the equivalent of ``view`` - which was resolved with a resolver
+		# that ``instance`` built - for this instance, so that a shared resolver
+		# never renders with another request's instance or related objects.
+		if instance is self or getattr(view, 'uses_request_instance', False):
+			return view
+		if getattr(view, 'im_self', None) is instance:
+			return view.im_func.__get__(self, type(self))
+		# Anything else may have captured ``instance``; take the view at the same
+		# position in this instance's own urlpatterns instead. Views built with
+		# :func:`uses_request_instance` never need this.
+		urlpatterns = self.urlpatterns
+		for index in paths[id(view)]:
+			pattern = urlpatterns[index]
+			urlpatterns = getattr(pattern, 'url_patterns', None)
+		return pattern.callback
+	
+	def get_resolver(self):
+		"""
+		Returns a :class:`RegexURLResolver` for the :class:`View`'s ``urlpatterns``. Resolvers are shared by all instances with the same content type, primary key, and :meth:`fingerprint <get_urlpatterns_fingerprint>` until a :class:`View` or a model related to one is saved or deleted, and up to :setting:`PHILO_VIEW_RESOLVER_CACHE_SIZE` of them (default: 100) are kept per process, so ``urlpatterns`` are not rebuilt and recompiled for every request.
+		
+		"""
+		return self._get_cached_resolver()[0]
+	
 	def reverse(self, view_name=None, args=None, kwargs=None, node=None, obj=None):
 		"""
 		If :attr:`accepts_subpath` is True, try to reverse a URL using the given parameters using ``self`` as the urlconf.
@@ -179,7 +272,7 @@ class View(Entity):
 			kwargs = obj_kwargs
 		
 		try:
-			subpath = reverse(view_name, urlconf=self, args=args or [], kwargs=kwargs or {})
+			subpath = iri_to_uri(u'%s%s' % (get_script_prefix(), self.get_resolver().reverse(view_name, *(args or []), **(kwargs or {}))))
 		except NoReverseMatch, e:
 			raise ViewCanNotProvideSubpath(e.message)
 		
@@ -206,7 +299,7 @@ class View(Entity):
 		Renders the :class:`View` as an :class:`HttpResponse`. This will raise :const:`~philo.exceptions.MIDDLEWARE_NOT_CONFIGURED` if the `request` doesn't have an attached :class:`Node`. This can happen if the :class:`~philo.middleware.RequestNodeMiddleware` is not in :setting:`settings.MIDDLEWARE_CLASSES` or if it is not functioning correctly.
 		
 		:meth:`render_to_response` will send the :data:`~philo.signals.view_about_to_render` signal, then call :meth:`actually_render_to_response`, and finally send the :data:`~philo.signals.view_finished_rendering` signal before returning the ``response``.
-
+		
 		"""
 		if not hasattr(request, 'node'):
 			raise MIDDLEWARE_NOT_CONFIGURED
@@ -228,6 +321,63 @@ class View(Entity):
 _view_content_type_limiter.cls = View
 
 
+def _get_view_paths(urlpatterns, path=()):
+	# Maps the id of each view in ``urlpatterns`` to a tuple of the indices which
+	# lead to it through any included patterns.
+	paths = {}
+	for index, pattern in enumerate(urlpatterns):
+		if hasattr(pattern, 'url_patterns'):
+			paths.update(_get_view_paths(pattern.url_patterns, path + (index,)))
+		else:
+			paths[id(pattern.callback)] = path + (index,)
+	return paths
+
+
+def invalidate_view_resolvers(sender, **kwargs):
+	"""Signal receiver which discards the resolvers built by :meth:`View.get_resolver` in every process."""
+	bump_generation(VIEW_RESOLVERS_GENERATION)
+
+
+def invalidate_views(sender, **kwargs):
+	"""Signal receiver which discards the :class:`View`\ s cached by :func:`get_view` in every process. It is only connected if :setting:`PHILO_CACHE_VIEWS` is ``True``."""
+	bump_generation(VIEWS_GENERATION)
+
+
+_view_receivers = [invalidate_view_resolvers]
+if CACHE_VIEWS:
+	_view_receivers.append(invalidate_views)
+
+
+def _connect_view_receivers(model, depth=VIEW_RELATED_DEPTH):
+	# Connects the view invalidation receivers to ``model`` and to the models it
+	# has foreign keys to, followed to ``depth``.
+	for receiver in _view_receivers:
+		post_save.connect(receiver, sender=model)
+		post_delete.connect(receiver, sender=model)
+	if depth > 0:
+		for field in model._meta.fields:
+			if isinstance(field, models.ForeignKey):
+				if isinstance(field.rel.to, basestring):
+					# The related model hasn't been loaded yet.
+					add_lazy_relation(model, field, field.rel.to, lambda field, to, cls: _connect_view_receivers(to, depth - 1))
+				else:
+					_connect_view_receivers(field.rel.to, depth - 1)
+
+
+def _view_class_prepared(sender, **kwargs):
+	if issubclass(sender, View):
+		_connect_view_receivers(sender)
+
+
+class_prepared.connect(_view_class_prepared)
+
+
+def uses_request_instance(view):
+	"""Marks a view function built for a :class:`MultiView`'s ``urlpatterns`` as looking up everything it uses on :meth:`MultiView.get_request_instance` when it is called, so that it can be called from a resolver which another instance built without rebuilding ``urlpatterns``."""
+	view.uses_request_instance = True
+	return view
+
+
 class MultiView(View):
 	"""
 	:class:`MultiView` is an abstract model which represents a section of related pages - for example, a :class:`~philo.contrib.penfield.BlogView` might have a foreign key to :class:`Page`\ s for an index, an entry detail, an entry archive by day, and so on. :class:`!MultiView` subclasses :class:`View`, and defines the following additional methods and attributes:
@@ -243,18 +393,34 @@ class MultiView(View):
 	
 	def actually_render_to_response(self, request, extra_context=None):
 		"""
-		Resolves the remaining subpath left after finding this :class:`View`'s node using :attr:`self.urlpatterns <urlpatterns>` and renders the view function (or method) found with the appropriate args and kwargs.
+		Resolves the remaining subpath left after finding this :class:`View`'s node using :attr:`self.urlpatterns <urlpatterns>` (via :meth:`~View.get_resolver`) and renders the view function (or method) found with the appropriate args and kwargs.
 		
 		"""
-		clear_url_caches()
 		subpath = request.node._subpath
-		view, args, kwargs = resolve(subpath, urlconf=self)
+		resolver, instance, paths = self._get_cached_resolver()
+		view, args, kwargs = resolver.resolve(subpath)
+		view = self._get_request_view(view, instance, paths)
 		view_args = getargspec(view)
 		if extra_context is not None and ('extra_context' in view_args[0] or view_args[2] is not None):
 			if 'extra_context' in kwargs:
 				extra_context.update(kwargs['extra_context'])
 			kwargs['extra_context'] = extra_context
-		return view(request, *args, **kwargs)
+		previous = getattr(request, '_multiview', None)
+		request._multiview = self
+		try:
+			return view(request, *args, **kwargs)
+		finally:
+			request._multiview = previous
+	
+	def get_request_instance(self, request):
+		"""
+		Returns the instance of this :class:`MultiView` which is rendering ``request``, or ``self`` if there is none. Resolvers are shared by every instance with the same primary key (see :meth:`~View.get_resolver`), so view functions which are built for ``urlpatterns`` - such as those returned by :meth:`basic_view` - should look up fields and methods on this instance when they are called rather than on the instance which built them, and be marked with :func:`uses_request_instance`.
+		
+		"""
+		instance = getattr(request, '_multiview', None)
+		if instance is not None and type(instance) is type(self) and instance.pk == self.pk:
+			return instance
+		return self
 	
 	def get_context(self):
 		"""Hook for providing instance-specific context - such as the value of a Field - to any view methods on the instance."""
@@ -286,16 +452,17 @@ class MultiView(View):
 		
 		"""
 		field = self._meta.get_field(field_name)
-		view = getattr(self, field.name, None)
 		
 		def inner(request, extra_context=None, **kwargs):
+			instance = self.get_request_instance(request)
+			view = getattr(instance, field.name, None)
 			if not view:
 				raise Http404
-			context = self.get_context()
+			context = instance.get_context()
 			context.update(extra_context or {})
 			return view.render_to_response(request, extra_context=context)
 		
-		return inner
+		return uses_request_instance(inner)
 	
 	class Meta:
 		abstract = True
@@ -424,4 +591,27 @@ class File(View):
 		return self.name
 
 
-register_value_model(Node)
\ No newline at end of file
+register_value_model(Node)
+
+
+def invalidate_unresolvable_paths(sender, **kwargs):
+	"""Signal receiver which discards all remembered unresolvable paths in every process."""
+	bump_generation(UNRESOLVABLE_PATHS_GENERATION)
+
+
+def invalidate_unresolvable_paths_for_attribute(sender, instance, **kwargs):
+	"""Signal receiver which discards all remembered unresolvable paths when an "Http404" :class:`.Attribute` changes, since that changes how a 404 is rendered."""
+	if instance.key == 'Http404':
+		bump_generation(UNRESOLVABLE_PATHS_GENERATION)
+
+
+post_save.connect(invalidate_unresolvable_paths, sender=Node)
+post_delete.connect(invalidate_unresolvable_paths, sender=Node)
+if node_moved is not None:
+	node_moved.connect(invalidate_unresolvable_paths, sender=Node)
+# A site's root node determines how all of its paths resolve.
+post_save.connect(invalidate_unresolvable_paths, sender=Site)
+post_delete.connect(invalidate_unresolvable_paths, sender=Site)
+post_save.connect(invalidate_unresolvable_paths_for_attribute, sender=Attribute)
+post_delete.connect(invalidate_unresolvable_paths_for_attribute, sender=Attribute)
+
@@ -4,24 +4,50 @@
 
 """
 
+from hashlib import sha1
+
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models
+from django.db.models.signals import post_save, post_delete
 from django.http import HttpResponse
 from django.template import Context, RequestContext, Template as DjangoTemplate
+from django.utils import simplejson as json
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import smart_str
+from django.utils.safestring import mark_safe
 
-from philo.models.base import SlugTreeEntity, register_value_model
-from philo.models.fields import TemplateField
-from philo.models.nodes import View
+from philo.models.base import SlugTreeEntity, Attribute, JSONValue, ForeignKeyValue, ManyToManyValue, SCALAR_VALUE_MODELS, register_value_model, node_moved
+from philo.models.fields import JSONField, TemplateField
+from philo.models.nodes import Node, View
 from philo.signals import page_about_to_render_to_string, page_finished_rendering_to_string
 from philo.utils import templates
+from philo.utils.cache import LRUCache, get_generation, get_generations, bump_generation
+from philo.utils.dependencies import start_recording, stop_recording, record_generation, record_object, object_generation_name, invalidate_object
+from philo.utils.entities import invalidate_tree_attributes_for_attribute
 
 
 __all__ = ('Template', 'Page', 'Contentlet', 'ContentReference')
 
 
+CACHE_TEMPLATES = getattr(settings, 'PHILO_CACHE_TEMPLATES', False)
+TEMPLATE_CACHE_SIZE = getattr(settings, 'PHILO_TEMPLATE_CACHE_SIZE', 200)
+#: The name of the cache generation which is bumped whenever a :class:`Template` is saved, deleted, or moved.
+TEMPLATES_GENERATION = 'templates'
+
+
+CACHE_PAGES = getattr(settings, 'PHILO_CACHE_PAGES', False)
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PHILO_PAGE_CACHE_TIMEOUT', 600)
+PAGE_CACHE_VARY = getattr(settings, 'PHILO_PAGE_CACHE_VARY', ('user',))
+STREAM_PAGES = getattr(settings, 'PHILO_STREAM_PAGES', False)
+
+
+_compiled_templates = LRUCache(TEMPLATE_CACHE_SIZE)
+
+
 class Template(SlugTreeEntity):
 	"""Represents a database-driven django template."""
 	#: The name of the template. Used for organization and debugging.
@@ -32,16 +58,96 @@ class Template(SlugTreeEntity):
 	mimetype = models.CharField(max_length=255, default=getattr(settings, 'DEFAULT_CONTENT_TYPE', 'text/html'))
 	#: An insecure :class:`~philo.models.fields.TemplateField` containing the django template code for this template.
 	code = TemplateField(secure=False, verbose_name='django template code')
+	#: A :class:`~philo.models.fields.JSONField` which stores the specs returned by :meth:`get_containers`, with content types as natural keys. This is recalculated whenever the template, or any template it extends or includes, is saved, deleted, or moved, and can be rebuilt with the ``rebuild_container_specs`` management command. ``None`` if the specs have not been (or could not be) calculated.
+	container_specs = JSONField(editable=False, default='null')
+	
+	def __init__(self, *args, **kwargs):
+		super(Template, self).__init__(*args, **kwargs)
+		# Remember the code as loaded, so that save() can tell whether it changed.
+		# Deferred code isn't fetched just for this; it then counts as changed.
+		self._saved_code = self.__dict__.get('code')
+	
+	def get_django_template(self):
+		"""
+		Returns a compiled django template for :attr:`code`.
+		
+		If :setting:`PHILO_CACHE_TEMPLATES` is ``True``, compiled templates are kept in a per-process LRU cache of :setting:`PHILO_TEMPLATE_CACHE_SIZE` entries (default: 200), keyed on the primary key and a hash of :attr:`code`, and shared by every instance and caller. Since a compiled template can contain the templates it includes, the whole cache is discarded in every process whenever any :class:`Template` is saved, deleted, or moved. Default: ``False``.
+		
+		"""
+		if not CACHE_TEMPLATES or self.pk is None:
+			return DjangoTemplate(self.code)
+		
+		# Read the generation first so that a change made while the template is
+		# being compiled is not masked by the stored entry.
+		generation = get_generation(TEMPLATES_GENERATION)
+		key = (self.pk, sha1(smart_str(self.code)).hexdigest())
+		cached = _compiled_templates.get(key)
+		if cached is None or cached[0] != generation:
+			cached = (generation, DjangoTemplate(self.code))
+			_compiled_templates.set(key, cached)
+		return cached[1]
 	
 	def get_containers(self):
 		"""
-		Returns a tuple where the first item is a list of names of contentlets referenced by containers, and the second item is a list of tuples of names and contenttypes of contentreferences referenced by containers. This will break if there is a recursive extends or includes in the template code. Due to the use of an empty Context, any extends or include tags with dynamic arguments probably won't work.
+		Returns a tuple where the first item is a list of names of contentlets referenced by containers, and the second item is a list of tuples of names and contenttypes of contentreferences referenced by containers. If :attr:`container_specs` has been calculated, it is used and no parsing is necessary; otherwise, the template code is parsed. This will break if there is a recursive extends or includes in the template code. Due to the use of an empty Context, any extends or include tags with dynamic arguments probably won't work.
 		
 		"""
-		template = DjangoTemplate(self.code)
-		return templates.get_containers(template)
+		if self.container_specs is None:
+			return templates.get_containers(self.get_django_template())
+		contentlet_specs, contentreference_specs = self.container_specs
+		return contentlet_specs, SortedDict([(name, ContentType.objects.get_by_natural_key(*natural_key)) for name, natural_key in contentreference_specs])
 	containers = property(get_containers)
 	
+	def calculate_container_specs(self):
+		"""Parses the template code and returns its container specs in the form stored in :attr:`container_specs`, or ``None`` if the code can't be parsed."""
+		try:
+			contentlet_specs, contentreference_specs = templates.get_containers(self.get_django_template())
+		except Exception:
+			# Any error will be raised when the containers are next accessed.
+			return None
+		return [contentlet_specs, [[name, list(ct.natural_key())] for name, ct in contentreference_specs.items()]]
+	
+	def update_dependent_container_specs(self, paths):
+		"""
+		Recalculates and stores the :attr:`container_specs` of every other :class:`Template` whose code extends or includes any of ``paths`` by a constant name - as well as those whose code extends or includes *those* templates, and so on - without a full save.
+		
+		:param paths: The paths by which this template was (or is now) known to the template loader.
+		
+		"""
+		paths = [path for path in paths if path]
+		seen = set([self.pk])
+		while paths:
+			query = models.Q()
+			for path in paths:
+				query |= models.Q(code__contains=path)
+			referenced = set(paths)
+			paths = []
+			for template in Template.objects.filter(query).exclude(pk__in=seen):
+				# The query only narrows things down; the path may just be mentioned.
+				if not referenced & templates.get_referenced_paths(template.code):
+					continue
+				seen.add(template.pk)
+				Template.objects.filter(pk=template.pk).update(container_specs=json.dumps(template.calculate_container_specs()))
+				paths.append(template.full_path)
+	
+	def update_full_path(self):
+		old_full_path = self.full_path
+		super(Template, self).update_full_path()
+		if old_full_path != self.full_path:
+			# Make sure that no compiled templates from before the move are used.
+			bump_generation(TEMPLATES_GENERATION)
+			self.update_dependent_container_specs([old_full_path, self.full_path])
+	
+	def save(self, *args, **kwargs):
+		old_full_path = self.full_path
+		code_changed = self.pk is None or self.code != self._saved_code
+		if code_changed or self.container_specs is None:
+			self.container_specs = self.calculate_container_specs()
+		super(Template, self).save(*args, **kwargs)
+		self._saved_code = self.code
+		if code_changed or old_full_path != self.full_path:
+			self.update_dependent_container_specs([old_full_path, self.full_path])
+	
 	def __unicode__(self):
 		"""Returns the value of the :attr:`name` field."""
 		return self.name
@@ -77,23 +183,125 @@ class Page(View):
 		The :class:`Page` will add itself to the context as ``page`` and its :attr:`~.Entity.attributes` as ``attributes``. If a request is provided, then :class:`request.node <.Node>` will also be added to the context as ``node`` and ``attributes`` will be set to the result of calling :meth:`~.View.attributes_with_node` with that :class:`.Node`.
 		
 		"""
+		template, context = self._get_render_context(request, extra_context)
+		string = template.render(context)
+		page_finished_rendering_to_string.send(sender=self, string=string)
+		return string
+	
+	def render_to_iterator(self, request=None, extra_context=None):
+		"""
+		Renders the :class:`Page` in the same way as :meth:`render_to_string`, but returns an iterator which yields the output of the template a piece at a time, as it is rendered. The template is compiled and :data:`~philo.signals.page_about_to_render_to_string` is sent straight away; :data:`~philo.signals.page_finished_rendering_to_string` is sent once the iterator is exhausted, and the full string is only assembled if the signal has any receivers.
+		
+		.. note:: When the iterator is the content of a response, it is only consumed after the view has returned - on django 1.3, after :data:`~django.core.signals.request_finished` has closed the database connection and after :class:`~django.middleware.transaction.TransactionMiddleware` has committed. Anything the template queries is then fetched over a new connection outside the request's transaction, which is closed again once the iterator is exhausted. Templates which depend on the request's transaction or write to the database shouldn't be streamed, which is why :setting:`PHILO_STREAM_PAGES` is off by default.
+		
+		"""
+		template, context = self._get_render_context(request, extra_context)
+		return self._iter_render(template, context)
+	
+	def _iter_render(self, template, context):
+		# If request_finished has already closed the connection, close the one
+		# which rendering opens as well rather than leave it to the next request.
+		closed = connection.connection is None
+		collect = bool(page_finished_rendering_to_string.receivers)
+		bits = []
+		try:
+			for bit in templates.iter_render(template, context):
+				if collect:
+					bits.append(bit)
+				yield bit
+		finally:
+			if closed and connection.connection is not None:
+				connection.close()
+		if collect:
+			page_finished_rendering_to_string.send(sender=self, string=mark_safe(u''.join(bits)))
+	
+	def _get_render_context(self, request, extra_context):
+		# Returns the compiled template and the context to render it with, and
+		# sends page_about_to_render_to_string.
+		record_object(Page, self.pk)
+		record_object(Template, self.template_id)
+		record_generation(TEMPLATES_GENERATION)
+		
 		context = {}
 		context.update(extra_context or {})
 		context.update({'page': self, 'attributes': self.attributes})
-		template = DjangoTemplate(self.template.code)
+		template = self.template.get_django_template()
 		if request:
+			# request.node is usually a lazy object, so its type isn't Node.
+			record_object(Node, request.node.pk)
 			context.update({'node': request.node, 'attributes': self.attributes_with_node(request.node)})
 			page_about_to_render_to_string.send(sender=self, request=request, extra_context=context)
-			string = template.render(RequestContext(request, context))
-		else:
-			page_about_to_render_to_string.send(sender=self, request=request, extra_context=context)
-		 	string = template.render(Context(context))
-		page_finished_rendering_to_string.send(sender=self, string=string)
-		return string
+			return template, RequestContext(request, context)
+		page_about_to_render_to_string.send(sender=self, request=request, extra_context=context)
+		return template, Context(context)
+	
+	def get_cache_key(self, request):
+		"""Returns the key under which the response to ``request`` will be cached by :meth:`actually_render_to_response`, or ``None`` if it shouldn't be cached. Only ``GET`` and ``HEAD`` requests for a :class:`.Node` whose view is this :class:`Page` are cached."""
+		if request.method not in ('GET', 'HEAD'):
+			return None
+		
+		node = getattr(request, 'node', None)
+		if node is None or node.view_object_id != self.pk or node.view_content_type_id != ContentType.objects.get_for_model(self).pk:
+			return None
+		
+		vary = []
+		for name in PAGE_CACHE_VARY:
+			if name == 'user':
+				vary.append(getattr(getattr(request, 'user', None), 'id', None))
+			else:
+				vary.append(request.META.get(name))
+		return 'philo_page__%s' % sha1(smart_str(repr((settings.SITE_ID, self.pk, request.get_full_path(), vary)))).hexdigest()
 	
 	def actually_render_to_response(self, request, extra_context=None):
-		"""Returns an :class:`HttpResponse` with the content of the :meth:`render_to_string` method and the mimetype set to the :attr:`~Template.mimetype` of the related :class:`Template`."""
-		return HttpResponse(self.render_to_string(request, extra_context), mimetype=self.template.mimetype)
+		"""
+		Returns an :class:`HttpResponse` with the content of the :meth:`render_to_string` method and the mimetype set to the :attr:`~Template.mimetype` of the related :class:`Template`.
+		
+		If :setting:`PHILO_CACHE_PAGES` is ``True``, the content will be cached for :setting:`PHILO_PAGE_CACHE_TIMEOUT` seconds (default: 600) under the :meth:`key <get_cache_key>` for the request, which varies on each item of :setting:`PHILO_PAGE_CACHE_VARY` - either ``'user'`` or the name of a key in ``request.META`` (default: ``('user',)``). While the page renders, every object it uses - the :class:`Page`, its :class:`Template`\ s, :class:`Contentlet`\ s and :class:`ContentReference`\ s, embedded instances, the :class:`.Node` and the :class:`.Attribute`\ s read from either, and any navigation - is recorded with :mod:`philo.utils.dependencies`, and the cached content is discarded as soon as any of them is saved or deleted. Default: ``False``.
+		
+		If :setting:`PHILO_STREAM_PAGES` is ``True``, responses which aren't cached are streamed: the response content is the iterator returned by :meth:`render_to_iterator`, so output is sent as it is rendered rather than once the whole page is ready. Since the template is then rendered after the view has returned, errors while rendering won't be handled by the view, any middleware which reads the response content will consume the iterator, and queries run outside the request's connection and transaction (see :meth:`render_to_iterator`). Default: ``False``.
+		
+		.. note:: Objects which templates fetch some other way - for example, with custom template tags - are not tracked, so changes to them only appear once the timeout has passed. Responses which use a CSRF token or messages - or the user, unless the cache varies on it - are never cached (see :meth:`used_request_state`), and :data:`~philo.signals.page_about_to_render_to_string` and :data:`~philo.signals.page_finished_rendering_to_string` are not sent when a cached page is served.
+		
+		"""
+		if CACHE_PAGES and not extra_context:
+			cache_key = self.get_cache_key(request)
+		else:
+			cache_key = None
+		
+		if cache_key is None:
+			if STREAM_PAGES:
+				return HttpResponse(self.render_to_iterator(request, extra_context), mimetype=self.template.mimetype)
+			return HttpResponse(self.render_to_string(request, extra_context), mimetype=self.template.mimetype)
+		
+		cached = cache.get(cache_key)
+		if cached is not None:
+			generations, content, mimetype = cached
+			if get_generations(generations.keys()) == generations:
+				return HttpResponse(content, mimetype=mimetype)
+		
+		# Each generation is read when it is first recorded, before what it
+		# covers is used, so a change made while rendering isn't masked.
+		start_recording()
+		try:
+			content = self.render_to_string(request, extra_context)
+		finally:
+			generations = stop_recording()
+		mimetype = self.template.mimetype
+		
+		if not self.used_request_state(request):
+			cache.set(cache_key, (generations, content, mimetype), PAGE_CACHE_TIMEOUT)
+		return HttpResponse(content, mimetype=mimetype)
+	
+	def used_request_state(self, request):
+		"""Returns ``True`` if rendering the response to ``request`` used anything particular to the request which the :meth:`cache key <get_cache_key>` doesn't vary on - a CSRF token, the request's messages, or its user (unless :setting:`PHILO_PAGE_CACHE_VARY` includes ``'user'``) - in which case the response isn't cached."""
+		if request.META.get('CSRF_COOKIE_USED', False):
+			return True
+		messages = getattr(request, '_messages', None)
+		# Message storage only loads its messages once they're looked at.
+		if messages is not None and (messages.used or hasattr(messages, '_loaded_data')):
+			return True
+		# AuthenticationMiddleware's lazy user is only loaded once it's accessed.
+		return 'user' not in PAGE_CACHE_VARY and '_cached_user' in request.__dict__
 	
 	def __unicode__(self):
 		"""Returns the value of :attr:`title`"""
@@ -165,4 +373,76 @@ class ContentReference(models.Model):
 
 
 register_value_model(Template)
-register_value_model(Page)
\ No newline at end of file
+register_value_model(Page)
+
+
+def invalidate_templates(sender, **kwargs):
+	"""Signal receiver which discards the compiled templates cached by :meth:`Template.get_django_template` in every process."""
+	bump_generation(TEMPLATES_GENERATION)
+
+
+post_save.connect(invalidate_templates, sender=Template)
+post_delete.connect(invalidate_templates, sender=Template)
+if node_moved is not None:
+	node_moved.connect(invalidate_templates, sender=Template)
+
+
+def update_dependent_container_specs_on_delete(sender, instance, **kwargs):
+	"""Recalculates the :attr:`~Template.container_specs` of any templates which referred to a deleted :class:`Template`."""
+	instance.update_dependent_container_specs([instance.full_path])
+
+
+post_delete.connect(update_dependent_container_specs_on_delete, sender=Template)
+
+
+# Bumps the versions of Contentlets and ContentReferences, for the container
+# tag's ``cache`` option.
+for model in (Contentlet, ContentReference):
+	post_save.connect(invalidate_object, sender=model)
+	post_delete.connect(invalidate_object, sender=model)
+
+
+def invalidate_page_dependency(sender, instance, **kwargs):
+	"""Signal receiver which marks any saved or deleted object as changed, so that cached pages which used it are discarded. Like the other page cache receivers, it does nothing unless :setting:`PHILO_CACHE_PAGES` is ``True``."""
+	if CACHE_PAGES:
+		invalidate_object(sender, instance)
+
+
+def invalidate_page_for_container(sender, instance, **kwargs):
+	"""Signal receiver which marks the :class:`Page` of a :class:`Contentlet` or :class:`ContentReference` as changed."""
+	if CACHE_PAGES:
+		bump_generation(object_generation_name(Page, instance.page_id))
+
+
+def invalidate_entity_for_attribute(sender, instance, **kwargs):
+	"""Signal receiver which marks the entity of an :class:`.Attribute` as changed."""
+	if not CACHE_PAGES:
+		return
+	model = ContentType.objects.get_for_id(instance.entity_content_type_id).model_class()
+	if model is not None:
+		bump_generation(object_generation_name(model, instance.entity_object_id))
+
+
+def invalidate_entities_for_attribute_value(sender, instance, **kwargs):
+	"""Signal receiver which marks the entities of any :class:`.Attribute`\ s with the given value as changed, along with the :class:`.Attribute`\ s which their descendants inherit."""
+	if not CACHE_PAGES:
+		return
+	attributes = Attribute.objects.filter(value_content_type=ContentType.objects.get_for_model(sender), value_object_id=instance.pk)
+	for attribute in attributes:
+		invalidate_entity_for_attribute(Attribute, attribute)
+		# Pages record the generations of the attributes their nodes inherit.
+		invalidate_tree_attributes_for_attribute(Attribute, attribute)
+
+
+# The receivers check PHILO_CACHE_PAGES themselves, so that it can be changed
+# at runtime.
+post_save.connect(invalidate_page_dependency)
+post_delete.connect(invalidate_page_dependency)
+for model in (Contentlet, ContentReference):
+	post_save.connect(invalidate_page_for_container, sender=model)
+	post_delete.connect(invalidate_page_for_container, sender=model)
+post_save.connect(invalidate_entity_for_attribute, sender=Attribute)
+post_delete.connect(invalidate_entity_for_attribute, sender=Attribute)
+for model in (JSONValue, ForeignKeyValue, ManyToManyValue) + SCALAR_VALUE_MODELS:
+	post_save.connect(invalidate_entities_for_attribute_value, sender=model)
+	post_delete.connect(invalidate_entities_for_attribute_value, sender=model)
@@ -3,13 +3,20 @@ The container template tags are automatically included as builtins if :mod:`phil
 
 """
 
+from hashlib import sha1
+
 from django import template
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
+from django.utils.encoding import smart_str
 from django.utils.safestring import SafeUnicode, mark_safe
 
+from philo.utils.cache import get_generations, model_generation_name
+from philo.utils.dependencies import MODEL_NAMESPACE, record_generation, record_object, object_generation_name
+
 
 register = template.Library()
 
@@ -28,16 +35,40 @@ class ContainerContext(object):
 	
 	def get_references(self):
 		if not hasattr(self, '_references'):
-			references = self.page.contentreferences.all()
+			references = list(self.page.contentreferences.all())
 			self._references = dict((((c.name, ContentType.objects.get_for_id(c.content_type_id)), c) for c in references))
+			self.fetch_reference_content(references)
 		return self._references
+	
+	def fetch_reference_content(self, references):
+		"""Fetches the content of ``references`` with one query per content type, rather than one per reference."""
+		# philo.models.base imports this module (through philo.utils.templates).
+		from philo.models.base import get_values_in_bulk
+		pks = {}
+		for reference in references:
+			if reference.content_id is not None:
+				pks.setdefault(reference.content_type_id, set()).add(reference.content_id)
+		
+		contents = {}
+		for content_type_id, content_pks in pks.items():
+			model = ContentType.objects.get_for_id(content_type_id).model_class()
+			if model is not None:
+				contents[content_type_id] = get_values_in_bulk(model, content_pks)
+				for pk in content_pks:
+					record_object(model, pk)
+		
+		for reference in references:
+			if reference.content_type_id in contents:
+				# Prime the GenericForeignKey's cache, just as accessing it would.
+				setattr(reference, type(reference).content.cache_attr, contents[reference.content_type_id].get(reference.content_id))
 
 
 class ContainerNode(template.Node):
-	def __init__(self, name, references=None, as_var=None):
+	def __init__(self, name, references=None, as_var=None, cache_timeout=None):
 		self.name = name
 		self.as_var = as_var
 		self.references = references
+		self.cache_timeout = cache_timeout
 	
 	def render(self, context):
 		container_content = self.get_container_content(context)
@@ -60,6 +91,9 @@ class ContainerNode(template.Node):
 			container_context = ContainerContext(page)
 			context.render_context[CONTAINER_CONTEXT_KEY] = container_context
 		
+		if self.cache_timeout is not None:
+			return self.get_cached_content(container_context)
+		
 		if self.references:
 			# Then it's a content reference.
 			try:
@@ -77,6 +111,53 @@ class ContainerNode(template.Node):
 			else:
 				content = contentlet.content
 		return content
+	
+	def get_cached_content(self, container_context):
+		"""Returns the same content as the tag would without the ``cache`` option, caching the :class:`.Contentlet`'s content - or the id of the :class:`.ContentReference`'s instance, which is fetched again every time - for :attr:`cache_timeout` seconds, so that the page's containers needn't be queried. The cached value is discarded as soon as the :class:`.Contentlet` or :class:`.ContentReference` is saved or deleted, or one is created for a container which had none."""
+		# philo.models.base imports this module (through philo.utils.templates).
+		from philo.models.base import get_values_in_bulk
+		from philo.models.pages import Contentlet, ContentReference
+		
+		page = container_context.page
+		cache_key = 'philo_container__%s__%s' % (page.pk, sha1(smart_str(self.name)).hexdigest())
+		if self.references:
+			cache_key = '%s__%s' % (cache_key, self.references.pk)
+		
+		cached = cache.get(cache_key)
+		if cached is not None and get_generations(cached[0].keys()) == cached[0]:
+			dependencies, found, value = cached
+			# Anything recording the dependencies of the surrounding output
+			# still depends on whatever the container used.
+			for name, generation in dependencies.items():
+				record_generation(name, generation)
+		else:
+			if self.references:
+				model = ContentReference
+				container = container_context.get_references().get((self.name, self.references))
+				value = container and container.content_id
+			else:
+				model = Contentlet
+				container = container_context.get_contentlets().get(self.name)
+				value = container and container.content
+			
+			found = container is not None
+			if found:
+				names = [object_generation_name(model, container.pk)]
+			else:
+				# Creating a container for this name bumps the model's generation.
+				names = [model_generation_name(model, MODEL_NAMESPACE)]
+			dependencies = get_generations(names)
+			cache.set(cache_key, (dependencies, found, value), self.cache_timeout)
+		
+		if not found:
+			return ''
+		if not self.references:
+			return value
+		if value is None:
+			return None
+		model = self.references.model_class()
+		record_object(model, value)
+		return get_values_in_bulk(model, [value]).get(value)
 
 
 @register.tag
@@ -85,8 +166,10 @@ def container(parser, token):
 	If a template using this tag is used to render a :class:`.Page`, that :class:`.Page` will have associated content which can be set in the admin interface. If a content type is referenced, then a :class:`.ContentReference` object will be created; otherwise, a :class:`.Contentlet` object will be created.
 	
 	Usage::
+		
+		{% container <name> [[references <app_label>.<model_name>] as <variable>] [cache <seconds>] %}
 	
-		{% container <name> [[references <app_label>.<model_name>] as <variable>] %}
+	If the ``cache`` option is given, the :class:`.Contentlet`'s content or the :class:`.ContentReference`'s target will be looked up without querying the page's containers for the given number of seconds, or until the :class:`.Contentlet` or :class:`.ContentReference` is saved. The output is the same as without the option.
 	
 	"""
 	params = token.split_contents()
@@ -95,6 +178,7 @@ def container(parser, token):
 		name = params[1].strip('"')
 		references = None
 		as_var = None
+		cache_timeout = None
 		if len(params) > 2:
 			remaining_tokens = params[2:]
 			while remaining_tokens:
@@ -114,9 +198,16 @@ def container(parser, token):
 						as_var = remaining_tokens.pop(0)
 					except IndexError:
 						raise template.TemplateSyntaxError('"%s" template tag option "as" requires an argument specifying a variable name' % tag)
+				elif option_token == 'cache':
+					try:
+						cache_timeout = int(remaining_tokens.pop(0))
+					except IndexError:
+						raise template.TemplateSyntaxError('"%s" template tag option "cache" requires an argument specifying a number of seconds' % tag)
+					except ValueError:
+						raise template.TemplateSyntaxError('"%s" template tag option "cache" requires an integer argument' % tag)
 			if references and not as_var:
 				raise template.TemplateSyntaxError('"%s" template tags using "references" option require additional use of the "as" option specifying a variable name' % tag)
-		return ContainerNode(name, references, as_var)
-		
+		return ContainerNode(name, references, as_var, cache_timeout)
+	
 	else: # error
 		raise template.TemplateSyntaxError('"%s" template tag provided without arguments (at least one required)' % tag)
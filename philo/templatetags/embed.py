@@ -2,65 +2,209 @@
 The embed template tags are automatically included as builtins if :mod:`philo` is an installed app.
 
 """
+from bisect import bisect_left, bisect_right
+
 from django import template
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.template.loader_tags import ExtendsNode, BlockContext, BLOCK_CONTEXT_KEY, TextNode, BlockNode
 
+from philo.utils.dependencies import record_object
 from philo.utils.templates import LOADED_TEMPLATE_ATTR
 
 
 register = template.Library()
 EMBED_CONTEXT_KEY = 'embed_context'
+EMBED_CONTEXTS_KEY = 'philo_embed_contexts'
+EMBEDDED_INSTANCES_KEY = 'philo_embedded_instances'
+# The attribute of a template parser which holds the constant embeds it has parsed.
+PARSER_EMBEDS_ATTR = '_philo_constant_embeds'
 
 
-class EmbedContext(object):
-	"Inspired by django.template.loader_tags.BlockContext."
+class EmbeddedInstances(object):
+	"""
+	Fetches the instances which are embedded during a render pass. Instances are fetched the first time one of them is needed, together with every other instance which the templates rendered so far embed by a constant primary key, with one query per content type.
+	
+	"""
 	def __init__(self):
+		self.instances = {}
+		self.pending = {}
+		self.batches = set()
+	
+	def add_batch(self, batch):
+		"""Marks the (content type, primary key) pairs in ``batch`` to be fetched along with the next instance which is needed. Each batch is only added once."""
+		if id(batch) in self.batches:
+			return
+		self.batches.add(id(batch))
+		for content_type, pk in batch:
+			self.pending.setdefault(content_type, set()).add(pk)
+	
+	def get(self, content_type, pk):
+		"""Returns the instance of ``content_type`` with primary key ``pk``, or ``False`` if there is no such instance."""
+		# philo.models.base imports this module (through philo.utils.templates).
+		from philo.models.base import get_values_in_bulk
+		model = content_type.model_class()
+		try:
+			pk = model._meta.pk.to_python(pk)
+		except ValidationError:
+			return False
+		
+		key = (content_type, pk)
+		if key not in self.instances:
+			pks = set()
+			for pending_pk in self.pending.pop(content_type, ()):
+				try:
+					pending_pk = model._meta.pk.to_python(pending_pk)
+				except ValidationError:
+					continue
+				if (content_type, pending_pk) not in self.instances:
+					pks.add(pending_pk)
+			pks.add(pk)
+			
+			objects = get_values_in_bulk(model, pks)
+			for fetched_pk in pks:
+				self.instances[(content_type, fetched_pk)] = objects.get(fetched_pk, False)
+		return self.instances[key]
+
+
+def get_embedded_instances(context):
+	"""Returns the :class:`EmbeddedInstances` for the render pass of ``context``, which is shared by every template rendered with ``context``."""
+	# Each template rendered pushes a new level onto the render context, so
+	# keep the instances on the lowest level.
+	render_context = context.render_context.dicts[0]
+	try:
+		return render_context[EMBEDDED_INSTANCES_KEY]
+	except KeyError:
+		embedded_instances = render_context[EMBEDDED_INSTANCES_KEY] = EmbeddedInstances()
+		return embedded_instances
+
+
+class EmbedContext(object):
+	"""
+	Inspired by django.template.loader_tags.BlockContext. For each content type, keeps the embed nodes in the order in which they apply. Each node keeps the position it was given: embeds added by :meth:`add_embeds` go before the existing ones and embeds added by :meth:`append` after them, so adding embeds never moves the ones already indexed. The positions of the nodes which define a template are kept sorted, so finding the template for an embed is a binary search rather than a walk through the embeds.
+	
+	``parent`` is the :class:`EmbedContext` of the enclosing template, if any - for example, of the template which used an inclusion tag. See :func:`get_embed_context`.
+	
+	"""
+	def __init__(self, parent=None):
+		self.parent = parent
 		self.embeds = {}
+		self.positions = {}
+		self.starts = {}
+		# For each content type, the negated positions of the template-defining
+		# embeds which come before position 0 and the positions of those which
+		# don't, both in ascending order.
+		self.definers = {}
 		self.rendered = []
 	
+	def _add_content_type(self, content_type):
+		if content_type not in self.embeds:
+			self.embeds[content_type] = {}
+			self.positions[content_type] = {}
+			self.starts[content_type] = 0
+			self.definers[content_type] = ([], [])
+	
 	def add_embeds(self, embeds):
+		"""Adds the lists of embeds in ``embeds``, a dictionary keyed by content type, before the existing embeds for each content type."""
 		for content_type, embed_list in embeds.iteritems():
-			if content_type in self.embeds:
-				self.embeds[content_type] = embed_list + self.embeds[content_type]
-			else:
-				self.embeds[content_type] = embed_list
+			self._add_content_type(content_type)
+			nodes = self.embeds[content_type]
+			positions = self.positions[content_type]
+			negated_definers = self.definers[content_type][0]
+			start = self.starts[content_type] - len(embed_list)
+			self.starts[content_type] = start
+			# Go backwards, so that a node which is listed twice keeps its first
+			# position and the negated definers stay in ascending order.
+			for offset in xrange(len(embed_list) - 1, -1, -1):
+				embed = embed_list[offset]
+				position = start + offset
+				nodes[position] = embed
+				positions[embed] = position
+				if embed.defines_template():
+					negated_definers.append(-position)
+	
+	def append(self, content_type, embed):
+		"""Adds ``embed`` after the existing embeds for ``content_type``, unless it's already present."""
+		self._add_content_type(content_type)
+		positions = self.positions[content_type]
+		if embed in positions:
+			return
+		
+		nodes = self.embeds[content_type]
+		position = self.starts[content_type] + len(nodes)
+		nodes[position] = embed
+		positions[embed] = position
+		if embed.defines_template():
+			self.definers[content_type][1].append(position)
+	
+	def get_definer(self, content_type, position):
+		"""Returns the position of the closest embed for ``content_type`` before ``position`` which defines a template, or ``None``."""
+		negated_definers, definers = self.definers[content_type]
+		i = bisect_left(definers, position)
+		if i:
+			return definers[i - 1]
+		i = bisect_right(negated_definers, -position)
+		if i < len(negated_definers):
+			return -negated_definers[i]
+		return None
+	
+	def find_template(self, content_type, position, context):
+		"""Returns the template defined by the closest embed for ``content_type`` before ``position`` which defines one, or ``None``."""
+		if content_type not in self.embeds:
+			return None
+		definer = self.get_definer(content_type, position)
+		while definer is not None:
+			template = self.embeds[content_type][definer].get_template(context)
+			if template:
+				return template
+			# The closest definer didn't have a usable template; try the one before it.
+			definer = self.get_definer(content_type, definer)
+		return None
 	
 	def get_embed_template(self, embed, context):
 		"""To return a template for an embed node, find the node's position in the stack
 		and then progress up the stack until a template-defining node is found
 		"""
 		ct = embed.get_content_type(context)
-		embeds = self.embeds[ct]
-		embeds = embeds[:embeds.index(embed)][::-1]
-		for e in embeds:
-			template = e.get_template(context)
-			if template:
-				return template
+		template = self.find_template(ct, self.positions[ct][embed], context)
+		if template:
+			return template
 		
 		# No template was found in the current render_context - but perhaps one level up? Or more?
 		# We may be in an inclusion tag.
-		self_found = False
-		for context_dict in context.render_context.dicts[::-1]:
-			if not self_found:
-				if self in context_dict.values():
-					self_found = True
-					continue
-			elif EMBED_CONTEXT_KEY not in context_dict:
-				continue
-			else:
-				embed_context = context_dict[EMBED_CONTEXT_KEY]
-				# We can tell where we are in the list of embeds by which have already been rendered.
-				embeds = embed_context.embeds[ct][:len(embed_context.rendered)][::-1]
-				for e in embeds:
-					template = e.get_template(context)
-					if template:
-						return template
+		embed_context = self.parent
+		while embed_context is not None:
+			# We can tell where we are in the list of embeds by which have already been rendered.
+			position = embed_context.starts.get(ct, 0) + len(embed_context.rendered)
+			template = embed_context.find_template(ct, position, context)
+			if template:
+				return template
+			embed_context = embed_context.parent
 		
 		raise IndexError
 
 
+def get_embed_context(context):
+	"""Returns the :class:`EmbedContext` for the current level of the render context of ``context``, creating it if necessary. A new :class:`EmbedContext`'s parent is the one of the closest enclosing level which has one. The :class:`EmbedContext`\ s of the enclosing levels are tracked on the lowest level of the render context, so finding it doesn't mean looking through every level."""
+	render_context = context.render_context
+	embed_context = render_context.get(EMBED_CONTEXT_KEY)
+	if embed_context is not None:
+		return embed_context
+	
+	# (level, EmbedContext) pairs, innermost last. Levels which have been popped
+	# - or replaced by a new level at the same depth - are dropped as they're found.
+	enclosing = render_context.dicts[0].setdefault(EMBED_CONTEXTS_KEY, [])
+	level = len(render_context.dicts) - 1
+	while enclosing and (enclosing[-1][0] >= level or render_context.dicts[enclosing[-1][0]].get(EMBED_CONTEXT_KEY) is not enclosing[-1][1]):
+		enclosing.pop()
+	
+	embed_context = EmbedContext(enclosing and enclosing[-1][1] or None)
+	render_context[EMBED_CONTEXT_KEY] = embed_context
+	enclosing.append((level, embed_context))
+	return embed_context
+
+
 # Override ExtendsNode render method to have it handle EmbedNodes
 # similarly to BlockNodes.
 old_extends_node_init = ExtendsNode.__init__
@@ -85,7 +229,8 @@ def extends_node_init(self, nodelist, *args, **kwargs):
 	old_extends_node_init(self, nodelist, *args, **kwargs)
 
 
-def render_extends_node(self, context):
+def prepare_extends_node(self, context):
+	"""Does everything that rendering an :class:`ExtendsNode` does short of rendering its parent - adding the blocks and embeds of the node (and of the root template) to the render context and rendering the node's direct embed children - and returns the compiled parent."""
 	compiled_parent = self.get_parent(context)
 	embeds = get_embed_dict(self.embed_list, context)
 	
@@ -93,15 +238,18 @@ def render_extends_node(self, context):
 		context.render_context[BLOCK_CONTEXT_KEY] = BlockContext()
 	block_context = context.render_context[BLOCK_CONTEXT_KEY]
 	
-	if EMBED_CONTEXT_KEY not in context.render_context:
-		context.render_context[EMBED_CONTEXT_KEY] = EmbedContext()
-	embed_context = context.render_context[EMBED_CONTEXT_KEY]
+	embed_context = get_embed_context(context)
 	
 	# Add the block nodes from this node to the block context
 	# Do the equivalent for embed nodes
 	block_context.add_blocks(self.blocks)
 	embed_context.add_embeds(embeds)
 	
+	# Fetch the instances embedded anywhere in the extension chain together.
+	embedded_instances = get_embedded_instances(context)
+	for node in self.embed_list:
+		embedded_instances.add_batch(node.batch)
+	
 	# If this block's parent doesn't have an extends node it is the root,
 	# and its block nodes also need to be added to the block context.
 	for node in compiled_parent.nodelist:
@@ -110,8 +258,11 @@ def render_extends_node(self, context):
 			if not isinstance(node, ExtendsNode):
 				blocks = dict([(n.name, n) for n in compiled_parent.nodelist.get_nodes_by_type(BlockNode)])
 				block_context.add_blocks(blocks)
-				embeds = get_embed_dict(compiled_parent.nodelist.get_nodes_by_type(ConstantEmbedNode), context)
+				embed_list = compiled_parent.nodelist.get_nodes_by_type(ConstantEmbedNode)
+				embeds = get_embed_dict(embed_list, context)
 				embed_context.add_embeds(embeds)
+				for node in embed_list:
+					embedded_instances.add_batch(node.batch)
 			break
 	
 	# Explicitly render all direct embed children of this node.
@@ -120,6 +271,11 @@ def render_extends_node(self, context):
 			if isinstance(node, ConstantEmbedNode):
 				node.render(context)
 	
+	return compiled_parent
+
+
+def render_extends_node(self, context):
+	compiled_parent = prepare_extends_node(self, context)
 	# Call Template._render explicitly so the parser context stays
 	# the same.
 	return compiled_parent._render(context)
@@ -130,8 +286,8 @@ ExtendsNode.render = render_extends_node
 
 
 class ConstantEmbedNode(template.Node):
-	"""Analogous to the ConstantIncludeNode, this node precompiles several variables necessary for correct rendering - namely the referenced instance or the included template."""
-	def __init__(self, content_type, object_pk=None, template_name=None, kwargs=None):
+	"""Analogous to the ConstantIncludeNode, this node precompiles the included template. A referenced instance is fetched when the node is rendered, along with the other instances embedded by constant primary keys in the same template and its extension chain."""
+	def __init__(self, content_type, object_pk=None, template_name=None, kwargs=None, batch=None):
 		assert template_name is not None or object_pk is not None
 		self.content_type = content_type
 		
@@ -140,28 +296,32 @@ class ConstantEmbedNode(template.Node):
 			kwargs[k] = v
 		self.kwargs = kwargs
 		
+		self.constant_pk = object_pk
+		if batch is None:
+			batch = []
 		if object_pk is not None:
-			self.instance = self.compile_instance(object_pk)
-		else:
-			self.instance = None
+			batch.append((content_type, object_pk))
+		#: The list of (content type, primary key) pairs embedded by constant nodes in the same template.
+		self.batch = batch
 		
 		if template_name is not None:
 			self.template = self.compile_template(template_name[1:-1])
 		else:
 			self.template = None
 	
-	def compile_instance(self, object_pk):
-		model = self.content_type.model_class()
-		try:
-			return model.objects.get(pk=object_pk)
-		except model.DoesNotExist:
-			if not hasattr(self, 'object_pk') and settings.TEMPLATE_DEBUG:
-				# Then it's a constant node.
-				raise
-			return False
+	def fetch_instance(self, context, object_pk):
+		return get_embedded_instances(context).get(self.get_content_type(context), object_pk)
 	
 	def get_instance(self, context):
-		return self.instance
+		if self.constant_pk is None:
+			return None
+		embedded_instances = get_embedded_instances(context)
+		embedded_instances.add_batch(self.batch)
+		instance = self.fetch_instance(context, self.constant_pk)
+		if instance is False and settings.TEMPLATE_DEBUG:
+			model = self.content_type.model_class()
+			raise model.DoesNotExist('%s matching query does not exist.' % model._meta.object_name)
+		return instance
 	
 	def compile_template(self, template_name):
 		try:
@@ -175,19 +335,15 @@ class ConstantEmbedNode(template.Node):
 	def get_template(self, context):
 		return self.template
 	
+	def defines_template(self):
+		"""Returns ``True`` if this node sets the template for its content type rather than embedding an instance."""
+		return self.template is not None
+	
 	def get_content_type(self, context):
 		return self.content_type
 	
 	def check_context(self, context):
-		if EMBED_CONTEXT_KEY not in context.render_context:
-			context.render_context[EMBED_CONTEXT_KEY] = EmbedContext()
-		embed_context = context.render_context[EMBED_CONTEXT_KEY]
-		
-		ct = self.get_content_type(context)
-		if ct not in embed_context.embeds:
-			embed_context.embeds[ct] = [self]
-		elif self not in embed_context.embeds[ct]:
-			embed_context.embeds[ct].append(self)
+		get_embed_context(context).append(self.get_content_type(context), self)
 	
 	def mark_rendered_for(self, context):
 		context.render_context[EMBED_CONTEXT_KEY].rendered.append(self)
@@ -217,6 +373,7 @@ class ConstantEmbedNode(template.Node):
 			self.mark_rendered_for(context)
 			return settings.TEMPLATE_STRING_IF_INVALID
 		
+		record_object(type(instance), instance.pk)
 		context.push()
 		context['embedded'] = instance
 		for k, v in self.kwargs.items():
@@ -228,6 +385,9 @@ class ConstantEmbedNode(template.Node):
 
 
 class EmbedNode(ConstantEmbedNode):
+	# Variable embeds can't be fetched ahead of time.
+	batch = ()
+	
 	def __init__(self, content_type, object_pk=None, template_name=None, kwargs=None):
 		assert template_name is not None or object_pk is not None
 		self.content_type = content_type
@@ -246,12 +406,15 @@ class EmbedNode(ConstantEmbedNode):
 	def get_instance(self, context):
 		if self.object_pk is None:
 			return None
-		return self.compile_instance(self.object_pk.resolve(context))
+		return self.fetch_instance(context, self.object_pk.resolve(context))
 	
 	def get_template(self, context):
 		if self.template_name is None:
 			return None
 		return self.compile_template(self.template_name.resolve(context))
+	
+	def defines_template(self):
+		return self.template_name is not None
 
 
 class InstanceEmbedNode(EmbedNode):
@@ -262,6 +425,9 @@ class InstanceEmbedNode(EmbedNode):
 	def get_template(self, context):
 		return None
 	
+	def defines_template(self):
+		return False
+	
 	def get_instance(self, context):
 		return self.instance.resolve(context)
 	
@@ -291,6 +457,16 @@ def parse_content_type(bit, tagname):
 	return ct
 
 
+def get_parser_embeds(parser):
+	"""Returns the list which is shared by the constant embeds in the template being parsed by ``parser``."""
+	try:
+		return getattr(parser, PARSER_EMBEDS_ATTR)
+	except AttributeError:
+		batch = []
+		setattr(parser, PARSER_EMBEDS_ATTR, batch)
+		return batch
+
+
 @register.tag
 def embed(parser, token):
 	"""
@@ -299,13 +475,13 @@ def embed(parser, token):
 	First, to set which template will be used to render a particular model. This declaration can be placed in a base template and will propagate into all templates that extend that template.
 	
 	Syntax::
-	
+		
 		{% embed <app_label>.<model_name> with <template> %}
 	
 	Second, to embed a specific model instance in the document with a template specified earlier in the template or in a parent template using the first syntax. The instance can be specified as a content type and pk or as a context variable. Any kwargs provided will be passed into the context of the template.
 	
 	Syntax::
-	
+		
 		{% embed (<app_label>.<model_name> <object_pk> || <instance>) [<argname>=<value> ...] %}
 	
 	"""
@@ -319,7 +495,7 @@ def embed(parser, token):
 		ct = parse_content_type(bits[0], tag)
 		
 		if bits[2][0] in ['"', "'"] and bits[2][0] == bits[2][-1]:
-			return ConstantEmbedNode(ct, template_name=bits[2])
+			return ConstantEmbedNode(ct, template_name=bits[2], batch=get_parser_embeds(parser))
 		return EmbedNode(ct, template_name=bits[2])
 	
 	# Otherwise they're trying to embed a certain instance.
@@ -347,4 +523,4 @@ def embed(parser, token):
 	except ValueError:
 		return EmbedNode(ct, object_pk=parser.compile_filter(pk), kwargs=kwargs)
 	else:
-		return ConstantEmbedNode(ct, object_pk=pk, kwargs=kwargs)
\ No newline at end of file
+		return ConstantEmbedNode(ct, object_pk=pk, kwargs=kwargs, batch=get_parser_embeds(parser))
\ No newline at end of file
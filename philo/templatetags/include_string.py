@@ -1,17 +1,58 @@
+from hashlib import sha1
+import re
+
 from django import template
 from django.conf import settings
+from django.template.base import tag_re
+from django.utils.encoding import smart_str
+
+from philo.models.pages import TEMPLATES_GENERATION
+from philo.utils.cache import LRUCache, get_generation
 
 
 register = template.Library()
 
 
+INCLUDE_STRING_CACHE_SIZE = getattr(settings, 'PHILO_INCLUDE_STRING_CACHE_SIZE', 500)
+INCLUDE_STRING_CACHE_MAX_LENGTH = getattr(settings, 'PHILO_INCLUDE_STRING_CACHE_MAX_LENGTH', 65536)
+# Tags which load other templates while they are being compiled.
+LOADING_TAG_RE = re.compile(r'{%\s*(?:include|extends|embed)\b')
+
+
+_fragments = LRUCache(INCLUDE_STRING_CACHE_SIZE)
+
+
+def get_fragment(string):
+	"""
+	Returns a compiled template for ``string``. Up to :setting:`PHILO_INCLUDE_STRING_CACHE_SIZE` compiled fragments (default: 500) are kept per process, keyed on a hash of their code; fragments longer than :setting:`PHILO_INCLUDE_STRING_CACHE_MAX_LENGTH` characters (default: 65536) are never kept, which bounds the memory the cache can use. Fragments which include, extend, or embed other templates contain those templates once compiled, so they are discarded whenever any :class:`.Template` changes.
+	
+	"""
+	if not INCLUDE_STRING_CACHE_SIZE or len(string) > INCLUDE_STRING_CACHE_MAX_LENGTH:
+		return template.Template(string)
+	
+	if LOADING_TAG_RE.search(string):
+		generation = get_generation(TEMPLATES_GENERATION)
+	else:
+		generation = None
+	key = sha1(smart_str(string)).digest()
+	cached = _fragments.get(key)
+	if cached is None or cached[0] != generation:
+		cached = (generation, template.Template(string))
+		_fragments.set(key, cached)
+	return cached[1]
+
+
 class IncludeStringNode(template.Node):
 	def __init__(self, string):
 		self.string = string
 	
 	def render(self, context):
 		try:
-			t = template.Template(self.string.resolve(context))
+			string = self.string.resolve(context)
+			if isinstance(string, basestring) and not tag_re.search(string):
+				# Without any template syntax, the string would render as itself.
+				return string
+			t = get_fragment(string)
 			return t.render(context)
 		except template.TemplateSyntaxError:
 			if settings.TEMPLATE_DEBUG:
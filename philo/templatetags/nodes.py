@@ -6,9 +6,9 @@ The node template tags are automatically included as builtins if :mod:`philo` is
 from django import template
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.core.urlresolvers import reverse, NoReverseMatch
+from django.core.urlresolvers import get_script_prefix, NoReverseMatch
 from django.template.defaulttags import kwarg_re
-from django.utils.encoding import smart_str
+from django.utils.encoding import iri_to_uri, smart_str
 
 from philo.exceptions import ViewCanNotProvideSubpath
 
@@ -54,7 +54,7 @@ class NodeURLNode(template.Node):
 			
 			url = ''
 			try:
-				subpath = reverse(view_name, urlconf=node.view, args=args, kwargs=kwargs)
+				subpath = iri_to_uri(u'%s%s' % (get_script_prefix(), node.view.get_resolver().reverse(view_name, *args, **kwargs)))
 			except NoReverseMatch:
 				if self.as_var is None:
 					if settings.TEMPLATE_DEBUG:
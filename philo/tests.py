@@ -1,18 +1,38 @@
+import datetime
 import sys
 import traceback
+from decimal import Decimal
 
 from django import template
 from django.conf import settings
+from django.conf.urls.defaults import patterns, url
+from django.contrib.auth.middleware import AuthenticationMiddleware
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
 from django.db import connection, models
-from django.template import loader
+from django.http import HttpRequest, HttpResponse
+from django.template import loader, TemplateDoesNotExist
 from django.template.loaders import cached
 from django.test import TestCase
 from django.test.utils import setup_test_template_loader, restore_template_loaders
 from django.utils.datastructures import SortedDict
 
-from philo.exceptions import AncestorDoesNotExist
-from philo.models import Node, Page, Template, Tag
+from philo import middleware
+from philo.exceptions import AncestorDoesNotExist, UnresolvablePath
+from philo.loaders.database import CachedLoader
+from philo.middleware import RequestNodeMiddleware
+from philo.models import Node, MultiView, Page, Template, Contentlet, Tag, Attribute, EffectiveAttribute, JSONValue, BooleanValue, IntegerValue, DecimalValue, DateTimeValue, StringValue
+from philo.models import base, nodes, pages
+from philo.models.fields.entities import JSONAttribute
+from philo.signals import page_about_to_render_to_string, page_finished_rendering_to_string
+from philo.templatetags import include_string
+from philo.templatetags.embed import get_embed_context
+from philo.utils import entities, templates
+from philo.utils.cache import LRUCache, get_generation, bump_generation
+from philo.utils.dependencies import start_recording, stop_recording, record_object, object_generation_name
+from philo.utils.entities import LazyTreeAttributeMapper, prefetch_attributes
+from philo.views import node_view
 
 
 class TemplateTestCase(TestCase):
@@ -45,6 +65,7 @@ class TemplateTestCase(TestCase):
 			try:
 				test_template = loader.get_template(name)
 				output = test_template.render(template.Context(context))
+				streamed = u''.join(templates.iter_render(test_template, template.Context(context)))
 			except Exception:
 				exc_type, exc_value, exc_tb = sys.exc_info()
 				if exc_type != result:
@@ -53,6 +74,8 @@ class TemplateTestCase(TestCase):
 				continue
 			if output != result:
 				failures.append("Template test %s -- FAILED. Expected %r, got %r" % (name, result, output))
+			if streamed != output:
+				failures.append("Template test %s -- FAILED. Streamed output %r differs from %r" % (name, streamed, output))
 		
 		# Cleanup
 		settings.TEMPLATE_DEBUG = old_td
@@ -62,6 +85,71 @@ class TemplateTestCase(TestCase):
 		self.assertEqual(failures, [], "Tests failed:\n%s\n%s" % ('-'*70, ("\n%s\n" % ('-'*70)).join(failures)))
 	
 	
+	def test_embed_instances(self):
+		"Tests that constant embeds are fetched together at render time rather than when parsed"
+		setup_test_template_loader({'embed01': '{{ embedded.name|safe }}'})
+		try:
+			second = Tag.objects.create(name='Second tag', slug='second-tag')
+			t = template.Template('{%% embed philo.tag with "embed01" %%}{%% embed philo.tag 1 %%} {%% embed philo.tag %s %%}' % second.pk)
+			self.assertNumQueries(1, t.render, template.Context())
+			
+			second.name = 'Renamed tag'
+			second.save()
+			self.assertEqual(t.render(template.Context()), 'Test tag Renamed tag')
+		finally:
+			restore_template_loaders()
+	
+	def test_embed_context(self):
+		"Tests that embeds keep their positions in the embed context and find the closest template before them"
+		class Embed(object):
+			def __init__(self, template=None):
+				self.template = template
+			
+			def get_content_type(self, context):
+				return 'tag'
+			
+			def get_template(self, context):
+				return self.template
+			
+			def defines_template(self):
+				return self.template is not None
+		
+		context = template.Context()
+		embed_context = get_embed_context(context)
+		child = [Embed('child'), Embed()]
+		parent = [Embed('parent'), Embed(), Embed(False)]
+		
+		# The embeds of a parent template go before those of its children,
+		# without moving them.
+		embed_context.add_embeds({'tag': child})
+		positions = dict(embed_context.positions['tag'])
+		embed_context.add_embeds({'tag': parent})
+		for embed, position in positions.items():
+			self.assertEqual(embed_context.positions['tag'][embed], position)
+		appended = Embed()
+		embed_context.append('tag', appended)
+		
+		self.assertEqual(embed_context.get_embed_template(parent[1], context), 'parent')
+		# A definer without a usable template is skipped.
+		self.assertEqual(embed_context.get_embed_template(child[0], context), 'parent')
+		self.assertEqual(embed_context.get_embed_template(child[1], context), 'child')
+		self.assertEqual(embed_context.get_embed_template(appended, context), 'child')
+		
+		# A template rendered by an inclusion tag falls back on the embed context
+		# of the template which used it...
+		context.render_context.push()
+		inner = get_embed_context(context)
+		self.assertTrue(inner.parent is embed_context)
+		inner.append('tag', Embed())
+		embed_context.rendered = parent
+		self.assertEqual(inner.get_embed_template(inner.embeds['tag'][0], context), 'parent')
+		context.render_context.pop()
+		
+		# ...but not on the embed context of a template which has been rendered.
+		context.render_context.push()
+		context.render_context.push()
+		self.assertTrue(get_embed_context(context).parent is embed_context)
+	
 	def get_template_tests(self):
 		# SYNTAX --
 		# 'template_name': ('template contents', 'context dict', 'expected string output' or Exception class)
@@ -188,6 +276,59 @@ class TreePathTestCase(TestCase):
 		# Speed increase for leaf nodes - should this be tested?
 		self.assertQueryLimit(1, (fifth, 'sub/path/tail/len/five'), 'root/second/third/fourth/fifth/sub/path/tail/len/five', absolute_result=False)
 	
+	def test_get_path_trie(self):
+		root = Node.objects.get(slug='root')
+		third = Node.objects.get(slug='third')
+		second2 = Node.objects.get(slug='second2')
+		e = Node.DoesNotExist
+		
+		# Lookups against a built trie require no queries.
+		lookup = Node.objects.get_path_trie().lookup
+		
+		self.assertQueryLimit(0, (second2, 'sub/path/tail'), 'root/second2/sub/path/tail/', callable=lookup)
+		self.assertQueryLimit(0, (third, None), 'root/second/third', callable=lookup)
+		self.assertQueryLimit(0, e, 'invalid/path', callable=lookup)
+		
+		lookup = Node.objects.get_path_trie(root=root).lookup
+		self.assertQueryLimit(0, (root, None), '', callable=lookup)
+		self.assertQueryLimit(0, (root, 'invalid/path'), 'invalid/path', callable=lookup)
+		self.assertQueryLimit(0, (third, None), 'second/third', callable=lookup)
+		
+		# Saving a node invalidates the trie.
+		trie = Node.objects.get_path_trie(root=root)
+		third.slug = 'third-moved'
+		third.save()
+		self.assertFalse(trie is Node.objects.get_path_trie(root=root))
+		self.assertEqual(Node.objects.get_path_trie(root=root).lookup('second/third-moved'), (third, None))
+	
+	def test_get_many_with_path(self):
+		root = Node.objects.get(slug='root')
+		third = Node.objects.get(slug='third')
+		second2 = Node.objects.get(slug='second2')
+		fifth = Node.objects.get(slug='fifth')
+		paths = ['root/second2/sub/path/tail/', 'root/second/third', 'root/second/third/fourth/fifth/sub', 'invalid/path']
+		
+		# Any number of paths are resolved with a single query.
+		self.assertQueryLimit(1, {
+			paths[0]: (second2, 'sub/path/tail'),
+			paths[1]: (third, None),
+			paths[2]: (fifth, 'sub'),
+		}, paths, callable=Node.objects.get_many_with_path)
+		
+		# The same goes for fields other than the slug.
+		third_pk_path = '/'.join([str(node.pk) for node in third.get_ancestors(include_self=True)])
+		pk_paths = ['%d/%d/0' % (root.pk, second2.pk), third_pk_path, '0']
+		self.assertQueryLimit(1, {
+			pk_paths[0]: (second2, '0'),
+			pk_paths[1]: (third, None),
+		}, pk_paths, field='pk', callable=Node.objects.get_many_with_path)
+		
+		self.assertQueryLimit(1, {
+			'second/third': (third, None),
+			'invalid/path': (root, 'invalid/path'),
+			'': (root, None),
+		}, ['second/third', 'invalid/path', ''], root=root, callable=Node.objects.get_many_with_path)
+	
 	def test_get_path(self):
 		root = Node.objects.get(slug='root')
 		root2 = Node.objects.get(slug='root')
@@ -202,6 +343,391 @@ class TreePathTestCase(TestCase):
 		self.assertQueryLimit(1, 'second/third', root, callable=third.get_path)
 		self.assertQueryLimit(1, e, third, callable=second2.get_path)
 		self.assertQueryLimit(1, '? - ?', root, ' - ', 'title', callable=third.get_path)
+	
+	def test_full_path(self):
+		root = Node.objects.get(slug='root')
+		second = Node.objects.get(slug='second')
+		fifth = Node.objects.get(slug='fifth')
+		
+		self.assertQueryLimit(0, 'root/second/third/fourth/fifth', callable=fifth.get_path)
+		self.assertQueryLimit(0, 'second/third/fourth/fifth', root, callable=fifth.get_path)
+		
+		# Changing a slug rewrites the paths of all descendants.
+		second.slug = 'renamed'
+		second.save()
+		self.assertEqual(Node.objects.get(pk=fifth.pk).full_path, 'root/renamed/third/fourth/fifth')
+		self.assertEqual(Node.objects.get_with_path('root/renamed/third/fourth/fifth'), fifth)
+		
+		# Moving a node does the same.
+		second.parent = Node.objects.get(slug='second2')
+		second.save()
+		self.assertEqual(Node.objects.get(pk=fifth.pk).full_path, 'root/second2/renamed/third/fourth/fifth')
+		
+		# The paths can be rebuilt from scratch.
+		Node.objects.update(full_path='', full_path_prefix='')
+		self.assertEqual(Node.objects.rebuild_full_paths(), Node.objects.count())
+		self.assertEqual(Node.objects.get(pk=fifth.pk).full_path, 'root/second2/renamed/third/fourth/fifth')
+	
+	def test_get_many_with_many_paths(self):
+		# More prefixes than SQLite allows parameters in one query.
+		third = Node.objects.get(slug='third')
+		paths = ['root/second/third/%d' % i for i in xrange(1100)]
+		results = Node.objects.get_many_with_path(paths)
+		self.assertEqual(len(results), 1100)
+		self.assertEqual(results['root/second/third/7'], (third, '7'))
+		self.assertNumQueries(3, Node.objects.get_many_with_path, paths)
+		
+		# Matching on other fields is split up the same way.
+		third = Node.objects.get(slug='third')
+		pk_path = '/'.join([str(node.pk) for node in third.get_ancestors(include_self=True)])
+		paths = ['%s/%d' % (pk_path, i) for i in xrange(1100)]
+		results = Node.objects.get_many_with_path(paths, field='pk')
+		self.assertEqual(len(results), 1100)
+		self.assertEqual(results['%s/7' % pk_path], (third, '7'))
+		self.assertNumQueries(3, Node.objects.get_many_with_path, paths, field='pk')
+	
+	def test_long_full_path(self):
+		# Paths longer than the indexed prefix are still found.
+		node = Node.objects.get(slug='root')
+		for slug in ('a' * 200, 'b' * 200):
+			node = Node.objects.create(parent=node, slug=slug, view=node.view)
+		path = 'root/%s/%s' % ('a' * 200, 'b' * 200)
+		self.assertEqual(node.full_path, path)
+		self.assertEqual(node.full_path_prefix, path[:255])
+		self.assertEqual(Node.objects.get_with_path(path), node)
+		self.assertEqual(Node.objects.get_with_path(path + '/spam', absolute_result=False), (node, 'spam'))
+		
+		node.parent.slug = 'c' * 200
+		node.parent.save()
+		node = Node.objects.get(pk=node.pk)
+		path = 'root/%s/%s' % ('c' * 200, 'b' * 200)
+		self.assertEqual((node.full_path, node.full_path_prefix), (path, path[:255]))
+		self.assertEqual(Node.objects.get_many_with_path([path]), {path: (node, None)})
+
+
+class ProxyFieldPage(Page):
+	extra = JSONAttribute()
+	
+	class Meta:
+		proxy = True
+		app_label = 'philo'
+
+
+class AttributeTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def test_prefetch_attributes(self):
+		root = Node.objects.get(slug='root')
+		third = Node.objects.get(slug='third')
+		root.attributes['spam'] = 'eggs'
+		third.attributes['spam'] = 'ham'
+		third.attributes['tag'] = Tag.objects.get(pk=1)
+		
+		nodes = prefetch_attributes(Node.objects.all())
+		
+		def read_attributes():
+			return dict([(node.slug, (node.attributes.get('spam'), node.attributes.get('tag'))) for node in nodes])
+		
+		self.assertNumQueries(0, read_attributes)
+		attributes = read_attributes()
+		self.assertEqual(attributes['root'], ('eggs', None))
+		self.assertEqual(attributes['second'], ('eggs', None))
+		self.assertEqual(attributes['third'], ('ham', Tag.objects.get(pk=1)))
+	
+	def test_update(self):
+		tag = Tag.objects.get(pk=1)
+		node = Node.objects.get(slug='root')
+		node.attributes.update({'spam': 'eggs', 'tag': tag}, count=1)
+		
+		node = Node.objects.get(slug='root')
+		self.assertEqual(dict(node.attributes.items()), {'spam': 'eggs', 'tag': tag, 'count': 1})
+		
+		# Unchanged values aren't written.
+		node.attributes.keys()
+		self.assertNumQueries(2, node.attributes.update, spam='eggs', tag=tag)
+		
+		node.attributes.update(spam='ham', count=tag)
+		node = Node.objects.get(slug='root')
+		self.assertEqual(dict(node.attributes.items()), {'spam': 'ham', 'tag': tag, 'count': tag})
+		
+		# Replaced values are deleted, but their Attributes are kept.
+		self.assertFalse(IntegerValue.objects.exists())
+		self.assertEqual(Attribute.objects.filter(key='count').count(), 1)
+	
+	def test_many_to_many_value(self):
+		tags = [Tag.objects.get(pk=1)] + [Tag.objects.create(name='Tag %d' % i, slug='tag-%d' % i) for i in range(3)]
+		node = Node.objects.get(slug='root')
+		node.attributes['tags'] = Tag.objects.filter(pk__in=[tag.pk for tag in tags])
+		
+		value = node.attributes.get_attribute('tags').value
+		self.assertEqual(set(value.value), set(tags))
+		
+		value.set_value(Tag.objects.filter(pk__in=[tag.pk for tag in tags[:2]]))
+		self.assertEqual(set(value.value), set(tags[:2]))
+		
+		# Updating in place keeps a change of content type.
+		node.attributes.update(tags=Node.objects.filter(slug='root'))
+		value = Node.objects.get(slug='root').attributes.get_attribute('tags').value
+		self.assertEqual(value.content_type, ContentType.objects.get_for_model(Node))
+		self.assertEqual(list(value.value), [node])
+	
+	def test_attribute_proxy_fields(self):
+		page = ProxyFieldPage.objects.get(pk=1)
+		page.attributes['extra'] = 1
+		self.assertEqual(page.attributes.get_attribute('extra').value_content_type, ContentType.objects.get_for_model(IntegerValue))
+		
+		# Saving the field replaces the value with one of the field's value class.
+		page = ProxyFieldPage.objects.get(pk=1)
+		page.extra = 2
+		page.save()
+		self.assertEqual(Attribute.objects.get(key='extra').value_content_type, ContentType.objects.get_for_model(JSONValue))
+		self.assertEqual(ProxyFieldPage.objects.get(pk=1).extra, 2)
+		self.assertFalse(IntegerValue.objects.exists())
+	
+	def test_lazy_values(self):
+		node = Node.objects.get(slug='root')
+		node.attributes.update(title=u'Spam', subtitle=u'Eggs', priority=2)
+		
+		node = Node.objects.get(slug='root')
+		self.assertNumQueries(1, node.attributes.keys)
+		self.assertTrue('title' in node.attributes)
+		
+		# Values are fetched together, by type, when the first of them is needed.
+		self.assertNumQueries(1, lambda: node.attributes['title'])
+		self.assertNumQueries(0, lambda: node.attributes['subtitle'])
+		self.assertNumQueries(1, lambda: node.attributes['priority'])
+		self.assertEqual(dict(node.attributes.items()), {'title': u'Spam', 'subtitle': u'Eggs', 'priority': 2})
+		self.assertEqual(node.attributes.get('missing', 'default'), 'default')
+		self.assertEqual(sorted(node.attributes), ['priority', 'subtitle', 'title'])
+		
+		# Mappers are created for every entity, so they only have slots.
+		for mapper in (node.attributes, entities.LazyAttributeMapper(node), LazyTreeAttributeMapper(node), entities.LazyPassthroughAttributeMapper([node])):
+			self.assertFalse(hasattr(mapper, '__dict__'))
+	
+	def test_typed_values(self):
+		node = Node.objects.get(slug='root')
+		values = {
+			'flag': (True, BooleanValue),
+			'priority': (3, IntegerValue),
+			'price': (Decimal('9.95'), DecimalValue),
+			'published': (datetime.datetime(2011, 6, 1, 12, 30), DateTimeValue),
+			'title': (u'Spam', StringValue),
+			'long_title': (u'Spam' * 100, JSONValue),
+			'scores': ([1, 2], JSONValue),
+		}
+		for key, (value, value_class) in values.items():
+			node.attributes[key] = value
+		
+		node = Node.objects.get(slug='root')
+		for key, (value, value_class) in values.items():
+			self.assertEqual(node.attributes.get_attribute(key).value_content_type, ContentType.objects.get_for_model(value_class))
+			self.assertEqual(node.attributes[key], value)
+		
+		# Entities can be filtered by typed values in the database.
+		priorities = IntegerValue.objects.filter(value__gte=2)
+		value_ct = ContentType.objects.get_for_model(IntegerValue)
+		self.assertEqual(Node.objects.filter(attribute_set__key='priority', attribute_set__value_content_type=value_ct, attribute_set__value_object_id__in=priorities.values('pk')).count(), 1)
+	
+	def test_convert_json_values(self):
+		node = Node.objects.get(slug='root')
+		for key, value in (('priority', 3), ('title', u'Spam'), ('scores', [1, 2])):
+			attribute = Attribute(key=key, entity=node)
+			attribute.set_value(value, JSONValue)
+		
+		self.assertEqual(JSONValue.objects.convert(), 2)
+		node = Node.objects.get(slug='root')
+		for key, value_class in (('priority', IntegerValue), ('title', StringValue), ('scores', JSONValue)):
+			self.assertEqual(node.attributes.get_attribute(key).value_content_type, ContentType.objects.get_for_model(value_class))
+		self.assertEqual(dict(node.attributes.items()), {'priority': 3, 'title': u'Spam', 'scores': [1, 2]})
+		self.assertEqual(JSONValue.objects.count(), 1)
+	
+	def test_with_attribute(self):
+		tag = Tag.objects.get(pk=1)
+		root = Node.objects.get(slug='root')
+		second = Node.objects.get(slug='second')
+		third = Node.objects.get(slug='third')
+		root.attributes.update(featured=True, priority=2, tag=tag)
+		second.attributes.update(featured=False, priority=3)
+		third.attributes['priority'] = 1
+		Attribute(key='featured', entity=third).set_value(True, JSONValue)
+		
+		self.assertEqual(set(Node.objects.with_attribute('featured')), set([root, second, third]))
+		self.assertEqual(set(Node.objects.with_attribute('featured', True)), set([root, third]))
+		self.assertEqual(list(Node.objects.with_attribute('tag', tag)), [root])
+		self.assertEqual(list(Node.objects.with_attribute('featured', True).with_attribute('priority', 2)), [root])
+		self.assertEqual(list(Node.objects.with_attribute('priority').order_by_attribute('priority', IntegerValue)), [third, root, second])
+		self.assertEqual(list(Node.objects.with_attribute('priority').order_by_attribute('priority', IntegerValue, descending=True)), [second, root, third])
+	
+	def test_tree_attributes(self):
+		Node.objects.get(slug='root').attributes['spam'] = 'eggs'
+		Node.objects.get(slug='second').attributes['spam'] = 'ham'
+		
+		# Inherited attributes are found with a single query.
+		third = Node.objects.get(slug='third')
+		self.assertNumQueries(1, third.attributes.keys)
+		self.assertEqual(third.attributes['spam'], 'ham')
+		
+		third = Node.objects.get(slug='third')
+		self.assertEqual(third.get_attribute_mapper(LazyTreeAttributeMapper)['spam'], 'ham')
+	
+	def test_cached_tree_attributes(self):
+		tag = Tag.objects.get(pk=1)
+		Node.objects.get(slug='root').attributes['tag'] = tag
+		
+		cache_tree_attributes = entities.CACHE_TREE_ATTRIBUTES
+		entities.CACHE_TREE_ATTRIBUTES = True
+		try:
+			self.assertEqual(Node.objects.get(slug='third').attributes['tag'], tag)
+			
+			# The attributes come from the cache, but the instances which they
+			# refer to are fetched again.
+			tag.name = 'changed'
+			tag.save()
+			third = Node.objects.get(slug='third')
+			self.assertNumQueries(1, third.attributes.keys)
+			self.assertEqual(third.attributes['tag'].name, 'changed')
+		finally:
+			entities.CACHE_TREE_ATTRIBUTES = cache_tree_attributes
+	
+	def test_effective_attributes(self):
+		second = Node.objects.get(slug='second')
+		Node.objects.get(slug='root').attributes['spam'] = 'eggs'
+		second.attributes['spam'] = 'ham'
+		EffectiveAttribute.objects.rebuild(Node)
+		
+		third = Node.objects.get(slug='third')
+		effective = EffectiveAttribute.objects.get(entity_content_type=ContentType.objects.get_for_model(Node), entity_object_id=third.pk, key='spam')
+		self.assertEqual(effective.owner_object_id, second.pk)
+		
+		materialize = entities.MATERIALIZE_TREE_ATTRIBUTES
+		entities.MATERIALIZE_TREE_ATTRIBUTES = True
+		try:
+			self.assertNumQueries(1, third.attributes.keys)
+			self.assertEqual(third.attributes['spam'], 'ham')
+		finally:
+			entities.MATERIALIZE_TREE_ATTRIBUTES = materialize
+	
+	def test_effective_attributes_on_move(self):
+		materialize = base.MATERIALIZE_TREE_ATTRIBUTES
+		base.MATERIALIZE_TREE_ATTRIBUTES = True
+		models.signals.post_save.connect(base.update_effective_attributes, sender=Node)
+		try:
+			Node.objects.get(slug='second').attributes['spam'] = 'ham'
+			EffectiveAttribute.objects.rebuild(Node)
+			node_ct = ContentType.objects.get_for_model(Node)
+			third = Node.objects.get(slug='third')
+			self.assertEqual(EffectiveAttribute.objects.filter(entity_content_type=node_ct, entity_object_id=third.pk, key='spam').count(), 1)
+			
+			# Loaded instances don't need a query to tell whether they moved...
+			self.assertNumQueries(0, base.remember_parent, third)
+			# ...and a move is noticed even though mptt updates the database first.
+			third.parent = Node.objects.get(slug='second2')
+			third.save()
+			self.assertEqual(EffectiveAttribute.objects.filter(entity_content_type=node_ct, entity_object_id=third.pk, key='spam').count(), 0)
+		finally:
+			models.signals.post_save.disconnect(base.update_effective_attributes, sender=Node)
+			base.MATERIALIZE_TREE_ATTRIBUTES = materialize
+
+
+class TemplateCacheTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def setUp(self):
+		self.cache_templates = pages.CACHE_TEMPLATES
+		pages.CACHE_TEMPLATES = True
+	
+	def tearDown(self):
+		pages.CACHE_TEMPLATES = self.cache_templates
+	
+	def test_get_django_template(self):
+		template = Template.objects.all()[0]
+		compiled = template.get_django_template()
+		
+		# Compiled templates are shared between instances.
+		self.assertTrue(Template.objects.get(pk=template.pk).get_django_template() is compiled)
+		
+		# ...but not between different code.
+		template.code = 'changed'
+		self.assertFalse(template.get_django_template() is compiled)
+		
+		# Saving any template discards them.
+		other = Template.objects.exclude(pk=template.pk)[0]
+		compiled = other.get_django_template()
+		template.save()
+		self.assertFalse(other.get_django_template() is compiled)
+	
+	def test_cached_loader(self):
+		Template.objects.create(name='base', slug='loader-base', code='{% block content %}{% endblock %}')
+		included = Template.objects.create(name='included', slug='loader-included', code='included')
+		Template.objects.create(name='child', slug='loader-child', code='{% extends "loader-base" %}{% block content %}{% include "loader-included" %}{% endblock %}')
+		loader = CachedLoader()
+		
+		# The templates which a template extends or includes are fetched along
+		# with it, one query per level...
+		self.assertNumQueries(2, loader.load_template_sources, ['loader-child'])
+		# ...so that loading them later needs no queries at all.
+		self.assertNumQueries(0, loader.load_template_source, 'loader-base')
+		self.assertEqual(loader.load_template_source('loader-included')[0], 'included')
+		
+		# Compiled templates and missing names are kept as well.
+		compiled = loader.load_template('loader-child')[0]
+		self.assertNumQueries(0, loader.load_template, 'loader-child')
+		self.assertTrue(loader.load_template('loader-child')[0] is compiled)
+		self.assertRaises(TemplateDoesNotExist, loader.load_template_source, 'loader-missing')
+		self.assertNumQueries(0, self.assertRaises, TemplateDoesNotExist, loader.load_template_source, 'loader-missing')
+		
+		# Saving any template discards them.
+		included.code = 'changed'
+		included.save()
+		self.assertEqual(loader.load_template_source('loader-included')[0], 'changed')
+		self.assertFalse(loader.load_template('loader-child')[0] is compiled)
+
+
+class IncludeStringTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def setUp(self):
+		self.fragments, self.max_length = include_string._fragments, include_string.INCLUDE_STRING_CACHE_MAX_LENGTH
+		include_string._fragments = LRUCache(2)
+	
+	def tearDown(self):
+		include_string._fragments, include_string.INCLUDE_STRING_CACHE_MAX_LENGTH = self.fragments, self.max_length
+	
+	def test_fragment_cache(self):
+		get_fragment = include_string.get_fragment
+		fragment = get_fragment('{{ spam }}')
+		self.assertTrue(get_fragment('{{ spam }}') is fragment)
+		
+		# Only the most recently used fragments are kept...
+		get_fragment('{{ eggs }}')
+		get_fragment('{{ ham }}')
+		self.assertEqual(len(include_string._fragments), 2)
+		self.assertFalse(get_fragment('{{ spam }}') is fragment)
+		
+		# ...and long fragments aren't kept at all.
+		include_string.INCLUDE_STRING_CACHE_MAX_LENGTH = 5
+		self.assertFalse(get_fragment('{{ spam }}') is get_fragment('{{ spam }}'))
+		include_string.INCLUDE_STRING_CACHE_MAX_LENGTH = self.max_length
+		
+		# Fragments which load templates are discarded when templates change.
+		fragment = get_fragment('{% include "second" %}')
+		self.assertTrue(get_fragment('{% include "second" %}') is fragment)
+		bump_generation(pages.TEMPLATES_GENERATION)
+		self.assertFalse(get_fragment('{% include "second" %}') is fragment)
+	
+	def test_fast_path(self):
+		t = template.Template('{% load include_string %}{% include_string spam %}')
+		self.assertEqual(t.render(template.Context({'spam': '{{ eggs }}', 'eggs': 'ham'})), 'ham')
+		
+		# Strings without template syntax are output without being compiled.
+		get_fragment = include_string.get_fragment
+		def fail(string):
+			raise AssertionError('%r was compiled.' % string)
+		include_string.get_fragment = fail
+		try:
+			self.assertEqual(t.render(template.Context({'spam': 'plain text'})), 'plain text')
+		finally:
+			include_string.get_fragment = get_fragment
 
 
 class ContainerTestCase(TestCase):
@@ -216,3 +742,339 @@ class ContainerTestCase(TestCase):
 		contentlet_specs, contentreference_specs = t.containers
 		self.assertEqual(len(contentlet_specs), 0)
 		self.assertEqual(contentreference_specs, SortedDict([('one', ct), ('two', ct)]))
+	
+	def test_stored_containers(self):
+		ct = ContentType.objects.get_for_model(Tag)
+		t = Template.objects.create(name='stored', slug='stored', code="{% container one %}{% container two references philo.tag as tag2 %}")
+		self.assertEqual(t.container_specs, [['one'], [['two', ['philo', 'tag']]]])
+		
+		# Stored specs are used without parsing the code.
+		t = Template.objects.get(pk=t.pk)
+		t.code = ''
+		self.assertEqual(t.containers, (['one'], SortedDict([('two', ct)])))
+	
+	def test_dependent_containers(self):
+		parent = Template.objects.create(name='dependency', slug='dependency', code="{% container one %}")
+		child = Template.objects.create(name='child', slug='child', code="{% extends 'dependency' %}")
+		mention = Template.objects.create(name='mention', slug='mention', code="dependency")
+		self.assertEqual(child.container_specs, [['one'], []])
+		Template.objects.filter(pk__in=[child.pk, mention.pk]).update(container_specs='[["stale"], []]')
+		
+		# Dependents are only recalculated when the code changes...
+		parent.name = 'renamed'
+		parent.save()
+		self.assertEqual(Template.objects.get(pk=child.pk).container_specs, [['stale'], []])
+		
+		# ...and only if they actually extend or include the template.
+		parent.code = "{% container two %}"
+		parent.save()
+		self.assertEqual(Template.objects.get(pk=child.pk).container_specs, [['two'], []])
+		self.assertEqual(Template.objects.get(pk=mention.pk).container_specs, [['stale'], []])
+	
+	def test_cached_containers(self):
+		t = Template.objects.create(name='cached', slug='cached', code="{% container one cache 60 %}")
+		self.assertEqual(t.containers[0], ['one'])
+		page = Page.objects.create(template=t, title='cached')
+		contentlet = page.contentlets.create(name='one', content='{{ page.title }}')
+		page.contentreferences.create(name='two', content_type=ContentType.objects.get_for_model(Template), content_id=t.pk)
+		
+		contentlet_template = template.Template("{% container one cache 60 %}")
+		reference_template = template.Template("{% container two references philo.template as ref cache 60 %}{{ ref.name }}")
+		missing_template = template.Template("{% container three cache 60 %}")
+		def render(t):
+			return t.render(template.Context({'page': Page.objects.get(pk=page.pk)}))
+		
+		# The output is the same as without the option...
+		self.assertEqual(render(contentlet_template), '{{ page.title }}')
+		self.assertEqual(render(reference_template), 'cached')
+		self.assertEqual(render(missing_template), '')
+		
+		# ...but the page's containers aren't queried again, apart from fetching
+		# the page and the referenced instance.
+		self.assertNumQueries(1, render, contentlet_template)
+		self.assertNumQueries(2, render, reference_template)
+		self.assertNumQueries(1, render, missing_template)
+		
+		# The dependencies of cached content are still recorded.
+		start_recording()
+		render(contentlet_template)
+		self.assertTrue(object_generation_name(Contentlet, contentlet.pk) in stop_recording())
+		
+		# Content is only reused while its generation is current.
+		Contentlet.objects.filter(pk=contentlet.pk).update(content='updated')
+		self.assertEqual(render(contentlet_template), '{{ page.title }}')
+		bump_generation(object_generation_name(Contentlet, contentlet.pk))
+		self.assertEqual(render(contentlet_template), 'updated')
+		
+		# Saving a container, or creating one for an empty name, discards it.
+		contentlet.content = 'saved'
+		contentlet.save()
+		self.assertEqual(render(contentlet_template), 'saved')
+		page.contentlets.create(name='three', content='created')
+		self.assertEqual(render(missing_template), 'created')
+		
+		# Referenced instances are fetched every time.
+		Template.objects.filter(pk=t.pk).update(name='renamed')
+		self.assertEqual(render(reference_template), 'renamed')
+
+
+class TitleMultiView(MultiView):
+	page = models.ForeignKey(Page, blank=True, null=True)
+	
+	@property
+	def urlpatterns(self):
+		def closure_view(request):
+			return HttpResponse(self.page.title)
+		
+		return patterns('',
+			url(r'^method/$', self.method_view),
+			url(r'^closure/$', closure_view),
+		)
+	
+	def method_view(self, request):
+		return HttpResponse(self.page.title)
+	
+	class Meta:
+		app_label = 'philo'
+
+
+class ViewResolverTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def render(self, view, subpath):
+		request = HttpRequest()
+		request.node = Node()
+		request.node._subpath = subpath
+		return view.actually_render_to_response(request).content
+	
+	def test_shared_resolver(self):
+		page = Page.objects.get(pk=1)
+		first = TitleMultiView(pk=1, page_id=page.pk)
+		self.assertEqual(self.render(first, '/method/'), 'Never')
+		self.assertEqual(self.render(first, '/closure/'), 'Never')
+		
+		# A second instance shares the first one's resolver, but its views are
+		# rendered with the second instance and its own related objects.
+		Page.objects.filter(pk=page.pk).update(title='Changed')
+		second = TitleMultiView(pk=1, page_id=page.pk)
+		self.assertTrue(second.get_resolver() is first.get_resolver())
+		self.assertEqual(self.render(second, '/method/'), 'Changed')
+		self.assertEqual(self.render(second, '/closure/'), 'Changed')
+		self.assertEqual(self.render(first, '/method/'), 'Never')
+		self.assertEqual(first.page.title, 'Never')
+	
+	def test_blog_view_resolver(self):
+		try:
+			from philo.contrib.penfield.models import BlogView
+		except ImportError:
+			self.skipTest('philo.contrib.penfield requires django-taggit.')
+		fields = dict(pk=1, blog_id=1, index_page_id=1, entry_page_id=1, entry_archive_page_id=1, tag_page_id=1, tag_archive_page_id=1, entry_permalink_style='D')
+		first = BlogView(**fields)
+		resolver, instance, paths = first._get_cached_resolver()
+		second = BlogView(**fields)
+		request = HttpRequest()
+		request._multiview = second
+		
+		# The second instance reuses every view in the first one's resolver
+		# without building its own urlpatterns.
+		urlpatterns = BlogView.urlpatterns
+		def rebuild(self):
+			raise AssertionError('urlpatterns were rebuilt.')
+		BlogView.urlpatterns = property(rebuild)
+		try:
+			self.assertTrue(second._get_cached_resolver()[0] is resolver)
+			for pattern in resolver.url_patterns:
+				view = second._get_request_view(pattern.callback, instance, paths)
+				if hasattr(view, 'im_self'):
+					self.assertTrue(view.im_self is second)
+				else:
+					self.assertTrue(view is pattern.callback)
+					self.assertTrue(view.uses_request_instance)
+		finally:
+			BlogView.urlpatterns = urlpatterns
+		
+		# Views built by the first instance act for the one rendering the request.
+		self.assertTrue(first.get_request_instance(request) is second)
+		self.assertTrue(first.get_request_instance(HttpRequest()) is first)
+	
+	def test_related_changes(self):
+		page = Page.objects.get(pk=1)
+		view = TitleMultiView(pk=1, page_id=page.pk)
+		resolver = view.get_resolver()
+		
+		# Saving a model which a view has a foreign key to discards its resolver.
+		page.save()
+		self.assertFalse(TitleMultiView(pk=1, page_id=page.pk).get_resolver() is resolver)
+	
+	def test_get_view(self):
+		first = nodes.get_view(Page, 1)
+		second = nodes.get_view(Page, 1)
+		
+		# Each caller gets its own copy of the view and its related objects.
+		self.assertFalse(first is second)
+		self.assertFalse(first.template is second.template)
+		first.template.name = 'changed'
+		self.assertNotEqual(second.template.name, 'changed')
+		self.assertNotEqual(nodes.get_view(Page, 1).template.name, 'changed')
+	
+	def test_view_invalidation(self):
+		generation = get_generation(nodes.VIEWS_GENERATION)
+		Page.objects.get(pk=1).save()
+		if nodes.CACHE_VIEWS:
+			self.assertNotEqual(get_generation(nodes.VIEWS_GENERATION), generation)
+		else:
+			# Nothing is cached, so nothing needs to be invalidated.
+			self.assertEqual(get_generation(nodes.VIEWS_GENERATION), generation)
+
+
+class PageCacheTestCase(TestCase):
+	fixtures = ['test_fixtures.json']
+	
+	def setUp(self):
+		self.cache_pages, self.page_cache_vary = pages.CACHE_PAGES, pages.PAGE_CACHE_VARY
+		pages.CACHE_PAGES, pages.PAGE_CACHE_VARY = True, ()
+	
+	def tearDown(self):
+		pages.CACHE_PAGES, pages.PAGE_CACHE_VARY = self.cache_pages, self.page_cache_vary
+	
+	def create_page(self, code):
+		count = Template.objects.count()
+		page = Page.objects.create(template=Template.objects.create(name='cache', slug='cache-%d' % count, code=code), title='cached')
+		node = Node.objects.create(slug='cached-%d' % count, parent=Node.objects.get(slug='root'), view=page)
+		return page, node
+	
+	def get_request(self, node):
+		request = HttpRequest()
+		request.method = 'GET'
+		request.path = '/%s' % node.get_path()
+		request.session = {}
+		AuthenticationMiddleware().process_request(request)
+		request._messages = CookieStorage(request)
+		RequestNodeMiddleware().process_view(request, node_view, (), {'path': node.get_path()})
+		return request
+	
+	def get_content(self, page, node):
+		page = Page.objects.get(pk=page.pk)
+		return page.render_to_response(self.get_request(node)).content.strip()
+	
+	def render(self, code):
+		page, node = self.create_page(code)
+		request = self.get_request(node)
+		self.assertEqual(page.render_to_response(request).content.strip(), 'cached')
+		return cache.get(page.get_cache_key(request)) is not None
+	
+	def test_request_state(self):
+		self.assertTrue(self.render("{{ page.title }}"))
+		
+		# Responses which use the request's CSRF token, messages, or user aren't cached.
+		self.assertFalse(self.render("{% csrf_token %}{{ page.title }}"))
+		self.assertFalse(self.render("{% for message in messages %}{% endfor %}{{ page.title }}"))
+		self.assertFalse(self.render("{% if user.is_authenticated %}{% endif %}{{ page.title }}"))
+	
+	def test_dependency_generations(self):
+		name = object_generation_name(Page, 1)
+		generation = get_generation(name)
+		start_recording()
+		try:
+			record_object(Page, 1)
+			# A change made while rendering...
+			bump_generation(name)
+			record_object(Page, 1)
+		finally:
+			generations = stop_recording()
+		
+		# ...isn't masked by the generations stored with the output.
+		self.assertEqual(generations, {name: generation})
+	
+	def test_streaming(self):
+		page, node = self.create_page("{{ page.title }} {% container body %}")
+		page.contentlets.create(name='body', content='one')
+		request = self.get_request(node)
+		request.method = 'POST'
+		
+		sent = []
+		def receiver(sender, **kwargs):
+			sent.append(kwargs.get('string'))
+		page_about_to_render_to_string.connect(receiver)
+		page_finished_rendering_to_string.connect(receiver)
+		stream_pages = pages.STREAM_PAGES
+		pages.STREAM_PAGES = True
+		try:
+			response = page.render_to_response(request)
+			
+			# The page is prepared straight away, but only rendered once the
+			# response is consumed.
+			self.assertEqual(sent, [None])
+			page.contentlets.update(content='two')
+			self.assertEqual(u''.join(response).strip(), 'cached two')
+			self.assertEqual([bit and bit.strip() for bit in sent], [None, 'cached two'])
+		finally:
+			pages.STREAM_PAGES = stream_pages
+			page_about_to_render_to_string.disconnect(receiver)
+			page_finished_rendering_to_string.disconnect(receiver)
+	
+	def test_invalidation(self):
+		page, node = self.create_page("{{ page.title }} {% container body %} {{ attributes.spam }}")
+		contentlet = page.contentlets.create(name='body', content='one')
+		node.attributes['spam'] = 'eggs'
+		self.assertEqual(self.get_content(page, node), 'cached one eggs')
+		
+		# The cached content is served until something it used changes...
+		Page.objects.filter(pk=page.pk).update(title='changed')
+		self.assertEqual(self.get_content(page, node), 'cached one eggs')
+		
+		# ...such as a contentlet...
+		contentlet.content = 'two'
+		contentlet.save()
+		self.assertEqual(self.get_content(page, node), 'changed two eggs')
+		
+		# ...or an attribute of the node.
+		node = Node.objects.get(pk=node.pk)
+		node.attributes['spam'] = 'ham'
+		self.assertEqual(self.get_content(page, node), 'changed two ham')
+
+
+class UnresolvablePathTestCase(TestCase):
+	urls = 'philo.urls'
+	fixtures = ['test_fixtures.json']
+	
+	def setUp(self):
+		self.timeout, self.unresolvable_paths = middleware.UNRESOLVABLE_PATH_CACHE_TIMEOUT, middleware.unresolvable_paths
+		middleware.UNRESOLVABLE_PATH_CACHE_TIMEOUT = 60
+		middleware.unresolvable_paths = middleware.UnresolvablePathCache(10, 60)
+	
+	def tearDown(self):
+		middleware.UNRESOLVABLE_PATH_CACHE_TIMEOUT, middleware.unresolvable_paths = self.timeout, self.unresolvable_paths
+	
+	def get(self, path):
+		request = HttpRequest()
+		request.method = 'GET'
+		request.path = '/%s' % path
+		handler = RequestNodeMiddleware()
+		try:
+			handler.process_view(request, node_view, (), {'path': path})
+			return node_view(request, path=path)
+		except Exception, e:
+			response = handler.process_exception(request, e)
+			if response is None:
+				raise
+			return response
+	
+	def test_unresolvable_paths(self):
+		self.assertRaises(UnresolvablePath, self.get, 'missing')
+		self.assertTrue('/missing' in middleware.unresolvable_paths)
+		self.assertFalse('/other' in middleware.unresolvable_paths)
+		
+		# The next request for the path fails before any lookup is done.
+		self.assertNumQueries(0, self.assertRaises, UnresolvablePath, self.get, 'missing')
+		
+		# Other processes only see the path if the cache is shared.
+		shared = middleware.UnresolvablePathCache(10, 60, shared=True)
+		shared.add('/missing')
+		self.assertFalse('/missing' in middleware.UnresolvablePathCache(10, 60))
+		self.assertTrue('/missing' in middleware.UnresolvablePathCache(10, 60, shared=True))
+		
+		# Saving a node forgets every path, since it could now be resolvable.
+		Node.objects.get(slug='root').save()
+		self.assertFalse('/missing' in middleware.unresolvable_paths)
+		self.assertFalse('/missing' in shared)
@@ -138,4 +138,27 @@ def paginate(objects, per_page=None, page_number=1):
 	else:
 		objects = page.object_list
 	
-	return paginator, page, objects
\ No newline at end of file
+	return paginator, page, objects
+
+
+### Bulk operations
+
+
+def bulk_create(model, objects):
+	"""
+	Inserts the unsaved instances of ``model`` in ``objects`` into the database - with a single query if the installed version of django supports :meth:`QuerySet.bulk_create`, and with one query per instance otherwise.
+	
+	.. note:: Instances inserted with a single query don't have their primary keys set and aren't sent :data:`~django.db.models.signals.post_save`.
+	
+	:returns: ``True`` if the instances were inserted with a single query, or ``False`` if they were saved one at a time.
+	
+	"""
+	objects = list(objects)
+	manager = model._default_manager
+	if hasattr(manager, 'bulk_create'):
+		if objects:
+			manager.bulk_create(objects)
+		return True
+	for obj in objects:
+		obj.save(force_insert=True)
+	return False
@@ -0,0 +1,144 @@
+"""
+Helpers for keeping in-process caches consistent across processes. Each named "generation" is a number stored in django's cache; any process which changes the data behind an in-process cache bumps the generation, and every process compares the generation its cache was built against to the current one before trusting the cache.
+
+.. note:: Generations are only shared between processes if a shared cache backend (such as memcached) is configured. With a local-memory backend, each process will only see the changes which it made itself.
+
+"""
+import time
+from threading import Lock
+
+from django.core.cache import cache
+
+
+GENERATION_KEY_PREFIX = 'philo_generation__'
+
+
+# Indexes into the linked-list entries used by LRUCache.
+PREV, NEXT, KEY, VALUE, EXPIRES = 0, 1, 2, 3, 4
+
+
+class LRUCache(object):
+	"""
+	A bounded in-process cache which discards its least recently used entries once it holds more than ``max_size`` of them. Entries may also expire after ``timeout`` seconds.
+	
+	:param max_size: The maximum number of entries to keep.
+	:param timeout: The number of seconds an entry stays valid, or ``None`` if entries should only be discarded when space is needed.
+	
+	"""
+	def __init__(self, max_size, timeout=None):
+		self.max_size = max_size
+		self.timeout = timeout
+		self._lock = Lock()
+		self.clear()
+	
+	def clear(self):
+		"""Discards every entry."""
+		self._lock.acquire()
+		try:
+			self._entries = {}
+			# The root of a circular doubly-linked list; root[NEXT] is the least recently used entry.
+			root = []
+			root[:] = [root, root, None, None, None]
+			self._root = root
+		finally:
+			self._lock.release()
+	
+	def get(self, key, default=None):
+		"""Returns the value for ``key``, or ``default`` if there is no such entry or it has expired."""
+		self._lock.acquire()
+		try:
+			try:
+				entry = self._entries[key]
+			except KeyError:
+				return default
+			if entry[EXPIRES] is not None and entry[EXPIRES] < time.time():
+				self._unlink(entry)
+				return default
+			# Move the entry to the most recently used end of the list.
+			self._unlink(entry)
+			self._link(entry)
+			return entry[VALUE]
+		finally:
+			self._lock.release()
+	
+	def set(self, key, value):
+		"""Stores ``value`` for ``key``, discarding the least recently used entries if the cache is full."""
+		if self.timeout is None:
+			expires = None
+		else:
+			expires = time.time() + self.timeout
+		self._lock.acquire()
+		try:
+			if key in self._entries:
+				self._unlink(self._entries[key])
+			self._link([None, None, key, value, expires])
+			while len(self._entries) > self.max_size:
+				self._unlink(self._root[NEXT])
+		finally:
+			self._lock.release()
+	
+	def delete(self, key):
+		"""Discards the entry for ``key``, if there is one."""
+		self._lock.acquire()
+		try:
+			if key in self._entries:
+				self._unlink(self._entries[key])
+		finally:
+			self._lock.release()
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	def _link(self, entry):
+		root = self._root
+		last = root[PREV]
+		entry[PREV] = last
+		entry[NEXT] = root
+		last[NEXT] = root[PREV] = entry
+		self._entries[entry[KEY]] = entry
+	
+	def _unlink(self, entry):
+		entry[PREV][NEXT] = entry[NEXT]
+		entry[NEXT][PREV] = entry[PREV]
+		del self._entries[entry[KEY]]
+
+
+def get_generation(name):
+	"""Returns the current generation number for ``name``, initializing it if it isn't in the cache."""
+	key = GENERATION_KEY_PREFIX + name
+	generation = cache.get(key)
+	if generation is None:
+		# Seed with the current time so that a generation which has fallen out
+		# of the cache won't be mistaken for one that a process has already seen.
+		generation = int(time.time() * 1000)
+		cache.add(key, generation)
+		generation = cache.get(key, generation)
+	return generation
+
+
+def get_generations(names):
+	"""Returns a dictionary mapping each of ``names`` to its current generation number. The generations are fetched from the cache all at once, and any which aren't in the cache are initialized."""
+	names = list(names)
+	values = cache.get_many([GENERATION_KEY_PREFIX + name for name in names])
+	generations = {}
+	for name in names:
+		try:
+			generations[name] = values[GENERATION_KEY_PREFIX + name]
+		except KeyError:
+			generations[name] = get_generation(name)
+	return generations
+
+
+def bump_generation(name):
+	"""Increments the generation number for ``name``, invalidating any in-process caches built against an earlier generation. Returns the new generation number."""
+	key = GENERATION_KEY_PREFIX + name
+	try:
+		return cache.incr(key)
+	except ValueError:
+		# The key isn't in the cache; a fresh generation will do.
+		return get_generation(name)
+
+
+def model_generation_name(model, namespace):
+	"""Returns a generation name for ``model`` within the given ``namespace``."""
+	return '%s__%s.%s' % (namespace, model._meta.app_label, model._meta.object_name.lower())
@@ -0,0 +1,65 @@
+"""
+Tracks which objects are used while output is generated, so that cached output can be thrown away as soon as any of them changes. Every object and every model has a cache generation (see :mod:`philo.utils.cache`), which :func:`invalidate_object` bumps when the object is saved or deleted. While a recording is in progress in a thread, code which uses an object calls :func:`record_object` (or :func:`record_model`, if it depends on every instance of a model), and the generations involved are collected along with their numbers as of when they were first recorded - that is, before the objects were used. Output cached along with those numbers is still valid as long as none of the generations has changed since.
+
+"""
+import threading
+
+from philo.utils.cache import get_generation, bump_generation, model_generation_name
+
+
+OBJECT_NAMESPACE = 'objects'
+MODEL_NAMESPACE = 'models'
+
+
+_local = threading.local()
+
+
+def object_generation_name(model, pk):
+	"""Returns the name of the generation for the instance of ``model`` with the given ``pk``."""
+	return '%s__%s' % (model_generation_name(model, OBJECT_NAMESPACE), pk)
+
+
+def start_recording():
+	"""Starts recording dependencies in the current thread. Recordings may be nested; dependencies are added to every recording in progress."""
+	try:
+		recordings = _local.recordings
+	except AttributeError:
+		recordings = _local.recordings = []
+	recordings.append({})
+
+
+def stop_recording():
+	"""Stops the most recently started recording in the current thread and returns a dictionary mapping the names of the generations it collected to their numbers when they were first recorded."""
+	return _local.recordings.pop()
+
+
+def is_recording():
+	"""Returns ``True`` if a recording is in progress in the current thread."""
+	return bool(getattr(_local, 'recordings', None))
+
+
+def record_generation(name, generation=None):
+	"""Records a dependency on the generation called ``name``. Its current number is read the first time it is recorded, unless the ``generation`` that the output depends on is given - for example, when reusing output which was cached along with its dependencies."""
+	for recording in getattr(_local, 'recordings', ()):
+		if name not in recording:
+			if generation is None:
+				generation = get_generation(name)
+			recording[name] = generation
+
+
+def record_object(model, pk):
+	"""Records a dependency on the instance of ``model`` with the given ``pk``."""
+	if is_recording():
+		record_generation(object_generation_name(model, pk))
+
+
+def record_model(model):
+	"""Records a dependency on every instance of ``model``, including any which are created later."""
+	if is_recording():
+		record_generation(model_generation_name(model, MODEL_NAMESPACE))
+
+
+def invalidate_object(sender, instance, **kwargs):
+	"""Signal receiver which bumps the generations of ``instance`` and of its model."""
+	bump_generation(object_generation_name(sender, instance.pk))
+	bump_generation(model_generation_name(sender, MODEL_NAMESPACE))
@@ -1,22 +1,34 @@
-from functools import partial
-from UserDict import DictMixin
+from operator import or_
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 
-from philo.utils.lazycompat import SimpleLazyObject
+from philo.utils import bulk_create
+from philo.utils.cache import get_generation, bump_generation, model_generation_name
+from philo.utils.dependencies import record_generation, record_object
+
+
+CACHE_TREE_ATTRIBUTES = getattr(settings, 'PHILO_CACHE_TREE_ATTRIBUTES', False)
+TREE_ATTRIBUTES_CACHE_TIMEOUT = getattr(settings, 'PHILO_TREE_ATTRIBUTES_CACHE_TIMEOUT', 600)
+MATERIALIZE_TREE_ATTRIBUTES = getattr(settings, 'PHILO_MATERIALIZE_TREE_ATTRIBUTES', False)
+TREE_ATTRIBUTES_NAMESPACE = 'tree_attributes'
 
 
 ### AttributeMappers
 
 
-class AttributeMapper(object, DictMixin):
+class AttributeMapper(object):
 	"""
-	Given an :class:`~philo.models.base.Entity` subclass instance, this class allows dictionary-style access to the :class:`~philo.models.base.Entity`'s :class:`~philo.models.base.Attribute`\ s. In order to prevent unnecessary queries, the :class:`AttributeMapper` will cache all :class:`~philo.models.base.Attribute`\ s and the associated python values when it is first accessed.
+	Given an :class:`~philo.models.base.Entity` subclass instance, this class allows dictionary-style access to the :class:`~philo.models.base.Entity`'s :class:`~philo.models.base.Attribute`\ s. In order to prevent unnecessary queries, the :class:`AttributeMapper` will cache all :class:`~philo.models.base.Attribute`\ s when it is first accessed. Their values are fetched in bulk - with one query per type of value - the first time any value of that type is needed, and each python value is cached once it has been looked up.
 	
 	:param entity: The :class:`~philo.models.base.Entity` subclass instance whose :class:`~philo.models.base.Attribute`\ s will be made accessible.
 	
 	"""
+	__slots__ = ('entity', '_attributes_cache', '_values', '_pending', '_cache_filled')
+	
 	def __init__(self, entity):
 		self.entity = entity
 		self.clear_cache()
@@ -25,12 +37,20 @@ class AttributeMapper(object, DictMixin):
 		"""Returns the ultimate python value of the :class:`~philo.models.base.Attribute` with the given ``key`` from the cache, populating the cache if necessary."""
 		if not self._cache_filled:
 			self._fill_cache()
-		return self._cache[key]
+		return self._get_value(key)
+	
+	def __contains__(self, key):
+		# The value itself doesn't need to be fetched.
+		try:
+			return self.get_attribute(key) is not None
+		except KeyError:
+			return False
+	has_key = __contains__
 	
 	def __setitem__(self, key, value):
-		"""Given a python value, sets the value of the :class:`~philo.models.base.Attribute` with the given ``key`` to that value."""
+		"""Given a python value, sets the value of the :class:`~philo.models.base.Attribute` with the given ``key`` to that value. The value is stored as a :class:`~philo.models.base.ForeignKeyValue` if it is a model instance, a :class:`~philo.models.base.ManyToManyValue` if it is a queryset, an instance of the first of the :data:`~philo.models.base.SCALAR_VALUE_MODELS` which accepts it if there is one, and a :class:`~philo.models.base.JSONValue` otherwise."""
 		# Prevent circular import.
-		from philo.models.base import JSONValue, ForeignKeyValue, ManyToManyValue, Attribute
+		from philo.models.base import Attribute
 		old_attr = self.get_attribute(key)
 		if old_attr and old_attr.entity_content_type == ContentType.objects.get_for_model(self.entity) and old_attr.entity_object_id == self.entity.pk:
 			attribute = old_attr
@@ -39,19 +59,144 @@ class AttributeMapper(object, DictMixin):
 			attribute.entity = self.entity
 			attribute.full_clean()
 		
+		attribute.set_value(value=value, value_class=self._get_value_class(value))
+		self._values[key] = attribute.value.value
+		self._attributes_cache[key] = attribute
+	
+	def _get_value_class(self, value):
+		from philo.models.base import JSONValue, ForeignKeyValue, ManyToManyValue, get_scalar_value_class
 		if isinstance(value, models.query.QuerySet):
-			value_class = ManyToManyValue
+			return ManyToManyValue
 		elif isinstance(value, models.Model):
-			value_class = ForeignKeyValue
+			return ForeignKeyValue
+		return get_scalar_value_class(value) or JSONValue
+	
+	def update(self, other=None, **kwargs):
+		"""
+		Sets the values of several :class:`~philo.models.base.Attribute`\ s at once, like :meth:`dict.update`. Rather than saving each value and :class:`~philo.models.base.Attribute` separately as :meth:`__setitem__` does, this compares the new values to the current ones and only writes what has changed: values of the same type are updated in place, and new :class:`~philo.models.base.Attribute`\ s are inserted with a single query where django supports it. Everything is written in one transaction, unless a transaction is already being managed.
+		
+		Values are saved normally, with ``force_update`` or ``force_insert``, so their own signals are sent as usual. :class:`~philo.models.base.Attribute`\ s which are saved individually send their signals as well; :data:`~django.db.models.signals.post_save` is sent by hand only for :class:`~philo.models.base.Attribute`\ s inserted in bulk, and for those whose value was changed in place without the :class:`~philo.models.base.Attribute` itself being saved.
+		
+		"""
+		values = {}
+		if other is not None:
+			if hasattr(other, 'keys'):
+				for key in other.keys():
+					values[key] = other[key]
+			else:
+				for key, value in other:
+					values[key] = value
+		values.update(kwargs)
+		if not values:
+			return
+		
+		if transaction.is_managed():
+			self.set_values(values)
 		else:
-			value_class = JSONValue
+			transaction.commit_on_success(self.set_values)(values)
+	
+	def set_values(self, values, value_classes=None):
+		"""
+		Does the work of :meth:`update` for the dictionary ``values``, without managing a transaction.
 		
-		attribute.set_value(value=value, value_class=value_class)
-		self._cache[key] = attribute.value.value
-		self._attributes_cache[key] = attribute
+		:param value_classes: An optional dictionary mapping keys to the :class:`~philo.models.base.AttributeValue` subclass which should hold their values. Otherwise, the class is chosen based on the type of each value, as :meth:`__setitem__` does.
+		
+		"""
+		from philo.models.base import Attribute, ManyToManyValue, get_values_in_bulk
+		if not self._cache_filled:
+			self._fill_cache()
+		ct = ContentType.objects.get_for_model(self.entity)
+		
+		# Only the entity's own attributes can be changed; inherited ones are overridden.
+		attributes = {}
+		for key in values:
+			attribute = self._attributes_cache.get(key)
+			if attribute is not None and attribute.entity_content_type_id == ct.pk and attribute.entity_object_id == self.entity.pk:
+				attributes[key] = attribute
+		
+		value_pks = {}
+		for attribute in attributes.values():
+			if attribute.value_content_type_id is not None:
+				value_pks.setdefault(attribute.value_content_type_id, set()).add(attribute.value_object_id)
+		current_values = {}
+		for ct_pk, pks in value_pks.items():
+			current_values[ct_pk] = get_values_in_bulk(ContentType.objects.get_for_id(ct_pk).model_class(), pks)
+		
+		created = []
+		changed = []
+		value_classes = value_classes or {}
+		for key, value in values.items():
+			value_class = value_classes.get(key) or self._get_value_class(value)
+			try:
+				attribute = attributes[key]
+			except KeyError:
+				attribute = Attribute(key=key, entity_content_type=ct, entity_object_id=self.entity.pk)
+				# The cache shows that the key is free, and the content type is known
+				# to exist, so skip the queries which full_clean would make.
+				attribute.clean_fields(exclude=['entity_content_type', 'value_content_type', 'value_object_id'])
+				current = None
+			else:
+				current = current_values.get(attribute.value_content_type_id, {}).get(attribute.value_object_id)
+			
+			if isinstance(current, value_class):
+				if value_class is ManyToManyValue:
+					current.set_value(value)
+					# The members are saved, but a changed content type isn't.
+					current.save()
+				elif self._value_unchanged(current, value):
+					setattr(attribute, Attribute.value.cache_attr, current)
+					continue
+				else:
+					current.set_value(value)
+					current.save(force_update=True)
+				attribute_value = current
+				changed.append(attribute)
+			else:
+				attribute_value = value_class()
+				if value_class is ManyToManyValue:
+					# ManyToManyValues save themselves.
+					attribute_value.set_value(value)
+				else:
+					attribute_value.set_value(value)
+					attribute_value.save(force_insert=True)
+				attribute.value_content_type = ContentType.objects.get_for_model(value_class)
+				attribute.value_object_id = attribute_value.pk
+				if attribute.pk is None:
+					created.append(attribute)
+				else:
+					# Saving sends post_save.
+					attribute.save()
+				if isinstance(current, models.Model):
+					# Only delete the old value once nothing points at it; deleting
+					# it cascades to any Attributes which still do.
+					current.delete()
+			
+			setattr(attribute, Attribute.value.cache_attr, attribute_value)
+			self._values[key] = attribute_value.value
+			self._attributes_cache[key] = attribute
+		
+		if bulk_create(Attribute, created):
+			# The attributes were inserted without their primary keys or signals.
+			pks = dict(Attribute.objects.filter(entity_content_type=ct, entity_object_id=self.entity.pk, key__in=[a.key for a in created]).values_list('key', 'pk'))
+			for attribute in created:
+				attribute.pk = pks[attribute.key]
+				models.signals.post_save.send(sender=Attribute, instance=attribute, created=True, raw=False, using=Attribute._default_manager.db)
+		
+		for attribute in changed:
+			models.signals.post_save.send(sender=Attribute, instance=attribute, created=False, raw=False, using=Attribute._default_manager.db)
+	
+	def _value_unchanged(self, current, value):
+		from philo.models.base import ForeignKeyValue
+		if isinstance(current, ForeignKeyValue):
+			# Compare without fetching the current instance.
+			if value is None:
+				return current.content_type_id is None and current.object_id is None
+			return current.content_type_id == ContentType.objects.get_for_model(value).pk and current.object_id == value.pk
+		return current.value == value
 	
 	def get_attributes(self):
 		"""Returns an iterable of all of the :class:`~philo.models.base.Entity`'s :class:`~philo.models.base.Attribute`\ s."""
+		record_object(type(self.entity), self.entity.pk)
 		return self.entity.attribute_set.all()
 	
 	def get_attribute(self, key, default=None):
@@ -64,59 +209,118 @@ class AttributeMapper(object, DictMixin):
 		"""Returns the keys from the cache, first populating the cache if necessary."""
 		if not self._cache_filled:
 			self._fill_cache()
-		return self._cache.keys()
+		return self._attributes_cache.keys()
 	
 	def items(self):
 		"""Returns the items from the cache, first populating the cache if necessary."""
 		if not self._cache_filled:
 			self._fill_cache()
-		return self._cache.items()
+		return [(key, self._get_value(key)) for key in self._attributes_cache]
 	
 	def values(self):
 		"""Returns the values from the cache, first populating the cache if necessary."""
 		if not self._cache_filled:
 			self._fill_cache()
-		return self._cache.values()
+		return [self._get_value(key) for key in self._attributes_cache]
+	
+	def __iter__(self):
+		return iter(self.keys())
+	
+	def __len__(self):
+		return len(self.keys())
+	
+	def iterkeys(self):
+		return iter(self.keys())
+	
+	def itervalues(self):
+		return iter(self.values())
+	
+	def iteritems(self):
+		return iter(self.items())
+	
+	def get(self, key, default=None):
+		"""Returns the value for ``key`` if there is an :class:`~philo.models.base.Attribute` with that key, and ``default`` otherwise."""
+		try:
+			return self[key]
+		except KeyError:
+			return default
+	
+	def setdefault(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			self[key] = default
+		return default
+	
+	def __repr__(self):
+		return repr(dict(self.items()))
+	
+	def __cmp__(self, other):
+		if other is None:
+			return 1
+		if isinstance(other, AttributeMapper):
+			other = dict(other.items())
+		return cmp(dict(self.items()), other)
 	
 	def _fill_cache(self):
 		if self._cache_filled:
 			return
 		
-		attributes = self.get_attributes()
-		value_lookups = {}
-		
-		for a in attributes:
-			value_lookups.setdefault(a.value_content_type_id, []).append(a.value_object_id)
+		for a in self.get_attributes():
 			self._attributes_cache[a.key] = a
-		
-		values_bulk = dict(((ct_pk, SimpleLazyObject(partial(ContentType.objects.get_for_id(ct_pk).model_class().objects.in_bulk, pks))) for ct_pk, pks in value_lookups.items()))
-		
-		cache = {}
-		
-		for a in attributes:
-			cache[a.key] = SimpleLazyObject(partial(self._lazy_value_from_bulk, values_bulk, a))
-			a._value_cache = cache[a.key]
-		
-		self._cache.update(cache)
+		self._add_pending(self._attributes_cache.values())
 		self._cache_filled = True
 	
-	def _lazy_value_from_bulk(self, bulk, attribute):
-		v = bulk[attribute.value_content_type_id].get(attribute.value_object_id)
-		return getattr(v, 'value', None)
+	def _add_pending(self, attributes):
+		# Queues ``attributes`` so that their values are fetched together, by
+		# type, when the first of them is needed.
+		for a in attributes:
+			if a.value_content_type_id is not None:
+				self._pending.setdefault(a.value_content_type_id, []).append(a)
+	
+	def _get_value(self, key):
+		# Returns the python value of the cached attribute with the given key,
+		# first fetching the values of every pending attribute of the same type.
+		try:
+			return self._values[key]
+		except KeyError:
+			pass
+		from philo.models.base import Attribute
+		attribute = self._attributes_cache[key]
+		pending = self._pending.pop(attribute.value_content_type_id, None)
+		if pending:
+			pending = [a for a in pending if not hasattr(a, Attribute.value.cache_attr)]
+			if pending:
+				fetch_attribute_values(pending)
+		value = getattr(attribute.value, 'value', None)
+		self._values[key] = value
+		return value
 	
 	def clear_cache(self):
 		"""Clears the cache."""
-		self._cache = {}
 		self._attributes_cache = {}
+		self._values = {}
+		self._pending = {}
 		self._cache_filled = False
+	
+	def _prime_cache(self, attributes, complete=True):
+		# Caches ``attributes``, whose values have already been fetched. Later
+		# attributes override earlier ones with the same key.
+		for a in attributes:
+			self._attributes_cache[a.key] = a
+			self._values.pop(a.key, None)
+		if complete:
+			self._cache_filled = True
 
 
 class LazyAttributeMapperMixin(object):
 	"""In some cases, it may be that only one attribute value needs to be fetched. In this case, it is more efficient to avoid populating the cache whenever possible. This mixin overrides the :meth:`__getitem__` and :meth:`get_attribute` methods to prevent their populating the cache. If the cache has been populated (i.e. through :meth:`keys`, :meth:`values`, etc.), then the value or attribute will simply be returned from the cache."""
+	__slots__ = ()
+	
 	def __getitem__(self, key):
-		if key not in self._cache and not self._cache_filled:
+		if key not in self._attributes_cache and not self._cache_filled:
 			self._add_to_cache(key)
-		return self._cache[key]
+		return self._get_value(key)
 	
 	def get_attribute(self, key, default=None):
 		if key not in self._attributes_cache and not self._cache_filled:
@@ -133,43 +337,88 @@ class LazyAttributeMapperMixin(object):
 		except Attribute.DoesNotExist:
 			raise KeyError
 		else:
-			val = getattr(attr.value, 'value', None)
-			self._cache[key] = val
+			self._values[key] = getattr(attr.value, 'value', None)
 			self._attributes_cache[key] = attr
 
 
 class LazyAttributeMapper(LazyAttributeMapperMixin, AttributeMapper):
+	__slots__ = ()
+	
 	def get_attributes(self):
-		return super(LazyAttributeMapper, self).get_attributes().exclude(key__in=self._cache.keys())
+		return super(LazyAttributeMapper, self).get_attributes().exclude(key__in=self._attributes_cache.keys())
 
 
 class TreeAttributeMapper(AttributeMapper):
-	"""The :class:`~philo.models.base.TreeEntity` class allows the inheritance of :class:`~philo.models.base.Attribute`\ s down the tree. This mapper will return the most recently declared :class:`~philo.models.base.Attribute` among the :class:`~philo.models.base.TreeEntity`'s ancestors or set an attribute on the :class:`~philo.models.base.Entity` it is attached to."""
+	"""
+	The :class:`~philo.models.base.TreeEntity` class allows the inheritance of :class:`~philo.models.base.Attribute`\ s down the tree. This mapper will return the most recently declared :class:`~philo.models.base.Attribute` among the :class:`~philo.models.base.TreeEntity`'s ancestors or set an attribute on the :class:`~philo.models.base.Entity` it is attached to.
+	
+	The :class:`~philo.models.base.Attribute`\ s of the entity and its ancestors are fetched with a single query which joins on the entity's tree bounds - or, if :setting:`PHILO_MATERIALIZE_TREE_ATTRIBUTES` is ``True``, with a lookup of the entity's :class:`~philo.models.base.EffectiveAttribute`\ s. If :setting:`PHILO_CACHE_TREE_ATTRIBUTES` is ``True``, the :class:`~philo.models.base.Attribute`\ s which apply to each entity - and their values - are kept in django's cache until an :class:`~philo.models.base.Attribute` of any instance of the entity's model changes, or any instance is saved, deleted, or moved; the instances which their values refer to are fetched again each time. Default: ``False``.
+	
+	"""
+	__slots__ = ()
+	
+	def get_ancestor_attributes(self, **filters):
+		"""Returns a :class:`QuerySet` of the :class:`~philo.models.base.Attribute`\ s of the entity and its ancestors which match ``filters``, sorted by increasing level of the entity they belong to. Each :class:`~philo.models.base.Attribute` is annotated with that level as ``entity_level``."""
+		from philo.models.base import Attribute
+		entity = self.entity
+		opts = entity._meta
+		mptt_opts = entity._mptt_meta
+		qn = connection.ops.quote_name
+		
+		def column(name):
+			return '%s.%s' % (qn(opts.db_table), qn(opts.get_field(name).column))
+		
+		where = [
+			'%s = %s.%s' % (column(opts.pk.name), qn(Attribute._meta.db_table), qn(Attribute._meta.get_field('entity_object_id').column)),
+			'%s = %%s' % column(mptt_opts.tree_id_attr),
+			'%s <= %%s' % column(mptt_opts.left_attr),
+			'%s >= %%s' % column(mptt_opts.right_attr),
+		]
+		params = [getattr(entity, mptt_opts.tree_id_attr), getattr(entity, mptt_opts.left_attr), getattr(entity, mptt_opts.right_attr)]
+		
+		record_object(type(entity), entity.pk)
+		record_generation(tree_attributes_generation_name(type(entity)))
+		ct = ContentType.objects.get_for_model(entity)
+		return Attribute.objects.filter(entity_content_type=ct, **filters).extra(select={'entity_level': column(mptt_opts.level_attr)}, tables=[opts.db_table], where=where, params=params).order_by('entity_level')
+	
+	def get_effective_attributes(self, **filters):
+		"""Returns a :class:`QuerySet` of the :class:`~philo.models.base.Attribute`\ s which match ``filters`` and apply to the entity according to its :class:`~philo.models.base.EffectiveAttribute`\ s - at most one for each key."""
+		from philo.models.base import Attribute
+		record_object(type(self.entity), self.entity.pk)
+		record_generation(tree_attributes_generation_name(type(self.entity)))
+		ct = ContentType.objects.get_for_model(self.entity)
+		return Attribute.objects.filter(effective_attribute_set__entity_content_type=ct, effective_attribute_set__entity_object_id=self.entity.pk, **filters)
+	
 	def get_attributes(self):
 		"""Returns a list of :class:`~philo.models.base.Attribute`\ s sorted by increasing parent level. When used to populate the cache, this will cause :class:`~philo.models.base.Attribute`\ s on the root to be overwritten by those on its children, etc."""
-		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
-		ct = ContentType.objects.get_for_model(self.entity)
-		attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys())
-		return sorted(attrs, key=lambda x: ancestors[x.entity_object_id])
+		if MATERIALIZE_TREE_ATTRIBUTES:
+			return list(self.get_effective_attributes())
+		return list(self.get_ancestor_attributes())
+	
+	def _fill_cache(self):
+		if self._cache_filled:
+			return
+		if not CACHE_TREE_ATTRIBUTES:
+			return super(TreeAttributeMapper, self)._fill_cache()
+		self._prime_cache(get_tree_attributes(self))
 
 
 class LazyTreeAttributeMapper(LazyAttributeMapperMixin, TreeAttributeMapper):
+	__slots__ = ()
+	
 	def get_attributes(self):
-		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
-		ct = ContentType.objects.get_for_model(self.entity)
-		attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys()).exclude(key__in=self._cache.keys())
-		return sorted(attrs, key=lambda x: ancestors[x.entity_object_id])
+		if MATERIALIZE_TREE_ATTRIBUTES:
+			return list(self.get_effective_attributes().exclude(key__in=self._attributes_cache.keys()))
+		return list(self.get_ancestor_attributes().exclude(key__in=self._attributes_cache.keys()))
 	
 	def _raw_get_attribute(self, key):
 		from philo.models import Attribute
-		ancestors = dict(self.entity.get_ancestors(include_self=True).values_list('pk', 'level'))
-		ct = ContentType.objects.get_for_model(self.entity)
+		if MATERIALIZE_TREE_ATTRIBUTES:
+			attributes = self.get_effective_attributes(key=key)
+		else:
+			attributes = self.get_ancestor_attributes(key=key).order_by('-entity_level')
 		try:
-			attrs = Attribute.objects.filter(entity_content_type=ct, entity_object_id__in=ancestors.keys(), key=key)
-			sorted_attrs = sorted(attrs, key=lambda x: ancestors[x.entity_object_id], reverse=True)
-			return sorted_attrs[0]
+			return attributes[0]
 		except IndexError:
 			raise Attribute.DoesNotExist
 
@@ -181,6 +430,8 @@ class PassthroughAttributeMapper(AttributeMapper):
 	:param entities: An iterable of :class:`.Entity` subclass instances.
 	
 	"""
+	__slots__ = ('_attributes',)
+	
 	def __init__(self, entities):
 		self._attributes = [e.attributes for e in entities]
 		super(PassthroughAttributeMapper, self).__init__(self._attributes[0].entity)
@@ -191,8 +442,14 @@ class PassthroughAttributeMapper(AttributeMapper):
 		
 		for a in reversed(self._attributes):
 			a._fill_cache()
-			self._attributes_cache.update(a._attributes_cache)
-			self._cache.update(a._cache)
+			for key, attribute in a._attributes_cache.items():
+				self._attributes_cache[key] = attribute
+				if key in a._values:
+					self._values[key] = a._values[key]
+				else:
+					self._values.pop(key, None)
+			for ct_pk, attributes in a._pending.items():
+				self._pending.setdefault(ct_pk, []).extend(attributes)
 		
 		self._cache_filled = True
 	
@@ -207,10 +464,173 @@ class PassthroughAttributeMapper(AttributeMapper):
 
 class LazyPassthroughAttributeMapper(LazyAttributeMapperMixin, PassthroughAttributeMapper):
 	"""The :class:`LazyPassthroughAttributeMapper` is lazy in that it tries to avoid accessing the :class:`AttributeMapper`\ s that it uses for lookups. However, those :class:`AttributeMapper`\ s may or may not be lazy themselves."""
-	def _raw_get_attribute(self, key):
-		from philo.models import Attribute
+	__slots__ = ()
+	
+	def _add_to_cache(self, key):
+		# The value is looked up through the mapper it comes from, so that it is
+		# fetched along with that mapper's other values of the same type.
 		for a in self._attributes:
 			attr = a.get_attribute(key)
 			if attr is not None:
-				return attr
-		raise Attribute.DoesNotExist
\ No newline at end of file
+				self._attributes_cache[key] = attr
+				self._values[key] = a[key]
+				return
+		raise KeyError(key)
+
+
+def fetch_attribute_values(attributes, targets=True):
+	"""Fetches the values of ``attributes`` with one query per type of value, and - unless ``targets`` is ``False`` - the instances referred to by any :class:`~philo.models.base.ForeignKeyValue`\ s among them with one query per content type (see :func:`fetch_attribute_targets`), and caches them on the :class:`~philo.models.base.Attribute`\ s and values so that accessing them won't cause any further queries."""
+	from philo.models.base import Attribute, get_values_in_bulk
+	value_pks = {}
+	for a in attributes:
+		if a.value_content_type_id is not None:
+			value_pks.setdefault(a.value_content_type_id, set()).add(a.value_object_id)
+	
+	values = {}
+	for ct_pk, pks in value_pks.items():
+		values[ct_pk] = get_values_in_bulk(ContentType.objects.get_for_id(ct_pk).model_class(), pks)
+	
+	for a in attributes:
+		setattr(a, Attribute.value.cache_attr, values.get(a.value_content_type_id, {}).get(a.value_object_id))
+	
+	if targets:
+		fetch_attribute_targets(attributes)
+
+
+def fetch_attribute_targets(attributes):
+	"""Fetches the instances referred to by any :class:`~philo.models.base.ForeignKeyValue`\ s among the already fetched values of ``attributes`` with one query per content type, rather than one query each, and records them as dependencies."""
+	from philo.models.base import Attribute, ForeignKeyValue, get_values_in_bulk
+	fk_values = []
+	for a in attributes:
+		value = getattr(a, Attribute.value.cache_attr, None)
+		if isinstance(value, ForeignKeyValue):
+			fk_values.append(value)
+	
+	target_pks = {}
+	for v in fk_values:
+		if v.content_type_id is not None and v.object_id is not None:
+			target_pks.setdefault(v.content_type_id, set()).add(v.object_id)
+	targets = {}
+	for ct_pk, pks in target_pks.items():
+		model = ContentType.objects.get_for_id(ct_pk).model_class()
+		if model is not None:
+			targets[ct_pk] = get_values_in_bulk(model, pks)
+			for pk in pks:
+				record_object(model, pk)
+	for v in fk_values:
+		if v.content_type_id in targets:
+			setattr(v, ForeignKeyValue.value.cache_attr, targets[v.content_type_id].get(v.object_id))
+
+
+def tree_attributes_generation_name(model):
+	"""Returns the name of the generation which is bumped whenever the :class:`~philo.models.base.Attribute`\ s inherited by instances of ``model`` might change."""
+	return model_generation_name(model, TREE_ATTRIBUTES_NAMESPACE)
+
+
+def get_tree_attributes(mapper):
+	"""Returns the list of :class:`~philo.models.base.Attribute`\ s which apply to the entity of the :class:`TreeAttributeMapper` ``mapper``, in increasing order of precedence and with their values already fetched, using django's cache for up to :setting:`PHILO_TREE_ATTRIBUTES_CACHE_TIMEOUT` seconds (default: 600) when possible. The instances which :class:`~philo.models.base.ForeignKeyValue`\ s refer to aren't cached, since nothing discards the cache when they change; they are fetched again each time."""
+	entity = mapper.entity
+	generation_name = tree_attributes_generation_name(type(entity))
+	record_object(type(entity), entity.pk)
+	record_generation(generation_name)
+	generation = get_generation(generation_name)
+	opts = entity._meta
+	key = 'philo_tree_attributes__%s.%s__%s' % (opts.app_label, opts.object_name.lower(), entity.pk)
+	
+	cached = cache.get(key)
+	if cached is not None and cached[0] == generation:
+		attributes = cached[1]
+	else:
+		attributes = mapper.get_attributes()
+		fetch_attribute_values(attributes, targets=False)
+		cache.set(key, (generation, attributes), TREE_ATTRIBUTES_CACHE_TIMEOUT)
+	fetch_attribute_targets(attributes)
+	return attributes
+
+
+def invalidate_tree_attributes(sender, **kwargs):
+	"""Signal receiver which discards the cached :class:`~philo.models.base.Attribute`\ s of every instance of the :class:`~philo.models.base.TreeEntity` subclass ``sender``."""
+	bump_generation(tree_attributes_generation_name(sender))
+
+
+def invalidate_tree_attributes_for_attribute(sender, instance, **kwargs):
+	"""Signal receiver which discards the cached :class:`~philo.models.base.Attribute`\ s of the model of an :class:`~philo.models.base.Attribute`'s entity, if it is a :class:`~philo.models.base.TreeEntity` subclass."""
+	from philo.models.base import TreeEntity
+	model = ContentType.objects.get_for_id(instance.entity_content_type_id).model_class()
+	if model is not None and issubclass(model, TreeEntity):
+		invalidate_tree_attributes(model)
+
+
+def invalidate_tree_attributes_for_value(sender, instance, **kwargs):
+	"""Signal receiver which discards the cached :class:`~philo.models.base.Attribute`\ s of the models of any entities which have ``instance`` as the value of an :class:`~philo.models.base.Attribute`."""
+	from philo.models.base import Attribute
+	for attribute in Attribute.objects.filter(value_content_type=ContentType.objects.get_for_model(sender), value_object_id=instance.pk):
+		invalidate_tree_attributes_for_attribute(Attribute, attribute)
+
+
+def prefetch_attributes(entities, keys=None):
+	"""
+	Fills the :attr:`~philo.models.base.Entity.attributes` caches of ``entities`` with one query for the :class:`~philo.models.base.Attribute`\ s of all of them, one query per type of value, and one query per content type referred to by :class:`~philo.models.base.ForeignKeyValue`\ s, rather than with separate queries for each entity. The :class:`~philo.models.base.Attribute`\ s which a :class:`TreeAttributeMapper` inherits are fetched as well, after one more query per model for the entities' ancestors. Passthrough mappers are left alone.
+	
+	:param entities: An iterable (such as a :class:`QuerySet`) of :class:`~philo.models.base.Entity` subclass instances.
+	:param keys: If given, only the :class:`~philo.models.base.Attribute`\ s with these keys are fetched. Since :class:`AttributeMapper`\ s fetch every :class:`~philo.models.base.Attribute` at once, this is only useful with lazy mappers.
+	:returns: A list of the entities.
+	
+	"""
+	from philo.models.base import Attribute
+	entities = list(entities)
+	
+	# For each mapper, the (content type pk, object pk) pairs of its entity and any
+	# ancestors it inherits from, ordered from the lowest to the highest priority.
+	owners = []
+	trees = {}
+	for entity in entities:
+		mapper = entity.attributes
+		if isinstance(mapper, PassthroughAttributeMapper):
+			continue
+		if isinstance(mapper, TreeAttributeMapper):
+			trees.setdefault(type(entity), []).append(mapper)
+		else:
+			owners.append((mapper, [(ContentType.objects.get_for_model(entity).pk, entity.pk)]))
+	
+	for model, mappers in trees.items():
+		opts = model._mptt_meta
+		ct_pk = ContentType.objects.get_for_model(model).pk
+		bounds = [(getattr(m.entity, opts.tree_id_attr), getattr(m.entity, opts.left_attr), getattr(m.entity, opts.right_attr)) for m in mappers]
+		query = reduce(or_, [Q(**{opts.tree_id_attr: tree_id, '%s__lte' % opts.left_attr: left, '%s__gte' % opts.right_attr: right}) for tree_id, left, right in bounds])
+		nodes = {}
+		for pk, tree_id, left, right, level in model._default_manager.filter(query).values_list('pk', opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr):
+			nodes.setdefault(tree_id, []).append((level, left, right, pk))
+		for mapper, (tree_id, left, right) in zip(mappers, bounds):
+			ancestors = [(level, pk) for level, l, r, pk in nodes.get(tree_id, ()) if l <= left and r >= right]
+			ancestors.sort()
+			owners.append((mapper, [(ct_pk, pk) for level, pk in ancestors]))
+	
+	if not owners:
+		return entities
+	
+	object_pks = {}
+	for mapper, owner_list in owners:
+		for ct_pk, pk in owner_list:
+			object_pks.setdefault(ct_pk, set()).add(pk)
+			record_object(ContentType.objects.get_for_id(ct_pk).model_class(), pk)
+	
+	attributes = Attribute.objects.filter(reduce(or_, [Q(entity_content_type=ct_pk, entity_object_id__in=pks) for ct_pk, pks in object_pks.items()]))
+	if keys is not None:
+		attributes = attributes.filter(key__in=keys)
+	attributes = list(attributes)
+	
+	fetch_attribute_values(attributes)
+	
+	by_owner = {}
+	for a in attributes:
+		by_owner.setdefault((a.entity_content_type_id, a.entity_object_id), []).append(a)
+	
+	for mapper, owner_list in owners:
+		mapper_attributes = []
+		for owner in owner_list:
+			mapper_attributes.extend(by_owner.get(owner, ()))
+		if keys is None:
+			mapper.clear_cache()
+		mapper._prime_cache(mapper_attributes, complete=keys is None)
+	return entities
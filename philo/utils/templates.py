@@ -1,14 +1,19 @@
 import itertools
+import re
 
-from django.template import TextNode, VariableNode, Context
+from django.template import Node, TextNode, VariableNode, Context
 from django.template.loader_tags import BlockNode, ExtendsNode, BlockContext, ConstantIncludeNode
 from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe
 
 from philo.templatetags.containers import ContainerNode
 
 
 LOADED_TEMPLATE_ATTR = '_philo_loaded_template'
 BLANK_CONTEXT = Context()
+#: Matches the names of templates which are extended or included by a constant name.
+TEMPLATE_REFERENCE_RE = re.compile(r'{%\s*(?:extends|include)\s+(["\'])(.+?)\1')
 
 
 def get_extended(self):
@@ -24,6 +29,11 @@ setattr(ExtendsNode, LOADED_TEMPLATE_ATTR, property(get_extended))
 setattr(ConstantIncludeNode, LOADED_TEMPLATE_ATTR, property(get_included))
 
 
+def get_referenced_paths(code):
+	"""Returns a set of the paths of the templates which ``code`` extends or includes by a constant name, normalized the way :meth:`~philo.models.base.SlugTreeEntityManager.get_with_path` would normalize them."""
+	return set(['/'.join([segment for segment in match[1].split('/') if segment]) for match in TEMPLATE_REFERENCE_RE.findall(code)])
+
+
 def get_containers(template):
 		# Build a tree of the templates we're using, placing the root template first.
 		levels = build_extension_tree(template.nodelist)
@@ -120,4 +130,38 @@ def build_extension_tree(nodelist):
 	else:
 		# Base case: root.
 		nodelists.append(LazyContainerFinder(nodelist))
-	return nodelists
\ No newline at end of file
+	return nodelists
+
+
+def iter_render(template, context):
+	"""
+	Renders ``template`` with ``context`` one top-level node at a time, yielding the output of each node as soon as it has been rendered. The output is the same as that of ``template.render(context)``; however, if the template extends another, the nodes of the root template are rendered in turn, so the output which comes before the first block - such as the ``<head>`` of a page - is available before the rest of the page has been rendered.
+	
+	"""
+	context.render_context.push()
+	try:
+		for bit in _iter_render_nodelist(template.nodelist, context):
+			yield bit
+	finally:
+		context.render_context.pop()
+
+
+def _iter_render_nodelist(nodelist, context):
+	for node in nodelist:
+		if isinstance(node, ExtendsNode):
+			for bit in _iter_render_extends(node, context):
+				yield bit
+		elif isinstance(node, Node):
+			yield mark_safe(force_unicode(nodelist.render_node(node, context)))
+		else:
+			yield mark_safe(force_unicode(node))
+
+
+def _iter_render_extends(node, context):
+	# This mirrors ExtendsNode.render (as replaced by philo.templatetags.embed),
+	# except that the parent's nodes are rendered one at a time.
+	# philo.templatetags.embed imports this module.
+	from philo.templatetags.embed import prepare_extends_node
+	compiled_parent = prepare_extends_node(node, context)
+	for bit in _iter_render_nodelist(compiled_parent.nodelist, context):
+		yield bit
@@ -0,0 +1,97 @@
+from copy import copy
+
+from philo.utils.cache import get_generation, bump_generation, model_generation_name
+
+
+PATH_TRIE_NAMESPACE = 'path_tries'
+
+
+_path_tries = {}
+
+
+class PathTrie(object):
+	"""
+	An in-process trie of the :class:`~philo.models.base.TreeEntity` instances below ``root``, keyed on the value of ``field`` for each path segment. Once built, a :class:`PathTrie` resolves paths without any queries.
+	
+	:param queryset: A :class:`QuerySet` containing (at least) every instance below ``root``.
+	:param root: The instance which will be considered the root of all lookups, or ``None`` to start from the top level of the tree.
+	:param field: The field on the model which should be matched against path segments.
+	
+	"""
+	def __init__(self, queryset, root=None, field='pk'):
+		self.model = queryset.model
+		self.root = root
+		self.field = field
+		self._children = {}
+		self._branches = {getattr(root, 'pk', None): self._children}
+		opts = self.model._mptt_meta
+		# Ordering by tree and left value guarantees that parents are seen before their children.
+		self.add(queryset.order_by(opts.tree_id_attr, opts.left_attr))
+	
+	def add(self, objects):
+		"""Adds ``objects`` to the trie. Parents must come before their children, as they do when ordered by tree and left value; objects which aren't below ``root`` are skipped."""
+		branches = self._branches
+		opts = self.model._mptt_meta
+		for obj in objects:
+			try:
+				siblings = branches[getattr(obj, "%s_id" % opts.parent_attr)]
+			except KeyError:
+				# Not below the root.
+				continue
+			children = {}
+			siblings[unicode(getattr(obj, self.field))] = (obj, children)
+			branches[obj.pk] = children
+	
+	def lookup(self, path, pathsep='/'):
+		"""
+		Returns a tuple containing a copy of the deepest object found along ``path`` (or ``root`` if no deeper object is found) and the remainder of the path after that object as a string (or ``None`` if there is no remaining path). This mirrors :meth:`.TreeEntityManager.get_with_path` with ``absolute_result=False``.
+		
+		:raises django.core.exceptions.ObjectDoesNotExist: if there is no root and no object matches the first segment of ``path``.
+		
+		"""
+		segments = [segment for segment in path.split(pathsep) if segment]
+		obj = self.root
+		children = self._children
+		depth = 0
+		
+		for segment in segments:
+			try:
+				obj, children = children[segment]
+			except KeyError:
+				break
+			depth += 1
+		
+		if obj is None:
+			raise self.model.DoesNotExist('%s matching query does not exist.' % self.model._meta.object_name)
+		
+		# Callers are free to annotate the instance, so never hand out the cached one.
+		return copy(obj), pathsep.join(segments[depth:]) or None
+
+
+def get_path_trie(manager, root=None, field='pk'):
+	"""Returns a :class:`PathTrie` for the instances of ``manager.model`` below ``root``. Tries are kept for the life of the process and rebuilt whenever an instance of the model is saved, deleted, or moved in any process."""
+	model = manager.model
+	generation = get_generation(model_generation_name(model, PATH_TRIE_NAMESPACE))
+	key = (model, getattr(root, 'pk', None), field)
+	
+	try:
+		trie_generation, trie = _path_tries[key]
+	except KeyError:
+		pass
+	else:
+		if trie_generation == generation:
+			return trie
+	
+	if root is None:
+		queryset = manager.all()
+	else:
+		queryset = root.get_descendants()
+	
+	trie = PathTrie(queryset, root, field)
+	_path_tries[key] = (generation, trie)
+	return trie
+
+
+def invalidate_path_tries(sender, **kwargs):
+	"""Signal receiver which marks every :class:`PathTrie` for ``sender`` as stale in all processes."""
+	bump_generation(model_generation_name(sender, PATH_TRIE_NAMESPACE))
@@ -3,7 +3,7 @@ from django.core.urlresolvers import resolve
 from django.http import Http404, HttpResponseRedirect
 from django.views.decorators.vary import vary_on_headers
 
-from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED
+from philo.exceptions import MIDDLEWARE_NOT_CONFIGURED, UnresolvablePath
 
 
 @vary_on_headers('Accept')
@@ -14,7 +14,7 @@ def node_view(request, path=None, **kwargs):
 	- the request has an attached :class:`.Node`.
 	- the attached :class:`~philo.models.nodes.Node` handles any remaining path beyond its location.
 	
-	If these conditions are not met, then :func:`node_view` will either raise :exc:`Http404` or, if it seems like the address was mistyped (for example missing a trailing slash), return an :class:`HttpResponseRedirect` to the correct address.
+	If these conditions are not met, then :func:`node_view` will either raise :exc:`~philo.exceptions.UnresolvablePath` (a subclass of :exc:`Http404`) or, if it seems like the address was mistyped (for example missing a trailing slash), return an :class:`HttpResponseRedirect` to the correct address.
 	
 	Otherwise, :func:`node_view` will call the :class:`.Node`'s :meth:`~.Node.render_to_response` method, passing ``kwargs`` in as the ``extra_context``.
 	
@@ -34,7 +34,7 @@ def node_view(request, path=None, **kwargs):
 			view, args, kwargs = resolve(path)
 			if view != node_view:
 				return HttpResponseRedirect(path)
-		raise Http404
+		raise UnresolvablePath
 	
 	node = request.node
 	subpath = request.node._subpath
@@ -47,7 +47,7 @@ def node_view(request, path=None, **kwargs):
 		# If the subpath isn't handled, check settings.APPEND_SLASH. If
 		# it's True, try to correct the subpath.
 		if not settings.APPEND_SLASH:
-			raise Http404
+			raise UnresolvablePath
 		
 		if subpath[-1] == "/":
 			subpath = subpath[:-1]
@@ -65,7 +65,7 @@ def node_view(request, path=None, **kwargs):
 		view, args, kwargs = resolve(redirect_url)
 		
 		if view == node_view:
-			raise Http404
+			raise UnresolvablePath
 		else:
 			return HttpResponseRedirect(redirect_url)
 	